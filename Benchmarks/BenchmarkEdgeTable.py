@@ -0,0 +1,58 @@
+'''
+Benchmark: building the edge table
+
+Times adding every patch pair (P * (P-1) / 2 edges) to the columnar
+EdgeTable and building its DataFrame, as the number of patches grows.
+Time per edge should stay flat (linear total time). For comparison the
+old row-by-row DataFrame approach (DataFrame.append, here pd.concat of
+one row, which copies the whole frame each time) is timed for the
+smaller patch counts only.
+
+Usage: python BenchmarkEdgeTable.py
+'''
+
+import os, sys, time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from EdgeList import EdgeTable
+
+
+def pair_edges(nPatches, seed=0):
+    """Edges for all patch pairs, grouped by source patch as the solver returns them."""
+    rng = np.random.default_rng(seed)
+    for patchID in range(1, nPatches + 1):
+        yield [(patchID, toID, float(rng.uniform(0, 1e5)), None)
+               for toID in range(patchID + 1, nPatches + 1)]
+
+
+def build_table(nPatches):
+    table = EdgeTable(capacity=min(nPatches * (nPatches - 1) // 2, 1000000))
+    for edges in pair_edges(nPatches):
+        table.add_edges(edges)
+    return table.to_dataframe()
+
+
+def build_appended(nPatches):
+    df = pd.DataFrame(columns=['FROM_ID','TO_ID','COST'])
+    for edges in pair_edges(nPatches):
+        for fromID, toID, cost, path in edges:
+            df = pd.concat([df, pd.DataFrame([{'FROM_ID': fromID, 'TO_ID': toID, 'COST': cost}])],
+                           ignore_index=True)
+    return df
+
+
+if __name__ == '__main__':
+    print("Patches,Edges,EdgeTable(s),us/edge,RowAppend(s)")
+    for nPatches in (50, 100, 200, 400, 800):
+        nEdges = nPatches * (nPatches - 1) // 2
+        t0 = time.perf_counter()
+        build_table(nPatches)
+        tTable = time.perf_counter() - t0
+        tAppend = ''
+        if nPatches <= 100:
+            t0 = time.perf_counter()
+            build_appended(nPatches)
+            tAppend = f"{time.perf_counter() - t0:.3f}"
+        print(f"{nPatches},{nEdges},{tTable:.3f},{1e6*tTable/nEdges:.2f},{tAppend}")
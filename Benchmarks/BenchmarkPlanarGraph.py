@@ -0,0 +1,59 @@
+'''
+Benchmark: minimum planar graph vs. pairwise edges
+
+Times the pairwise edge list (one cost distance solve per source patch,
+each stopped once every higher-ID patch is reached) against the minimum
+planar graph (one solve seeded from all patches, see
+CostDistance.planar_edges) on a synthetic 500 x 500 cost raster with 50
+and 100 patches, and compares the two edge lists (see
+PatchGraph.compare_edges): edges kept, shortest path stretch over the
+pairwise costs, and minimum spanning tree cost.
+
+Usage: python BenchmarkPlanarGraph.py [raster size]
+'''
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from CostDistance import iter_sources, planar_edges
+from PatchGraph import compare_edges
+
+
+def make_rasters(size, nPatches, seed=0):
+    """Random rectangular patches (nodata = -9999) on a random cost surface."""
+    rng = np.random.default_rng(seed)
+    arrPatch = np.full((size, size), -9999, dtype=np.int32)
+    for patchID in range(1, nPatches + 1):
+        r, c = rng.integers(0, size - 10, 2)
+        arrPatch[r:r+rng.integers(2, 10), c:c+rng.integers(2, 10)] = patchID
+    arrCost = rng.uniform(1, 10, (size, size))
+    return arrPatch, arrCost
+
+
+def columns(edges):
+    """FROM_ID, TO_ID and COST arrays of a list of edges."""
+    return tuple(np.array([e[k] for e in edges]) for k in range(3))
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print("Patches,Pairwise(s),Planar(s),Speedup,PairwiseEdges,PlanarEdges,"
+          "StretchMean,StretchMax,MSTRatio")
+    for nPatches in (50, 100):
+        arrPatch, arrCost = make_rasters(size, nPatches)
+        patchIDs = np.unique(arrPatch[arrPatch != -9999]).tolist()
+
+        t0 = time.perf_counter()
+        pairwise = [e for _, edges, _ in iter_sources(arrPatch, arrCost, 30.0, patchIDs, settle=True)
+                    for e in edges]
+        tPairwise = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        planar, _, _ = planar_edges(arrPatch, arrCost, 30.0)
+        tPlanar = time.perf_counter() - t0
+
+        stats = compare_edges(*columns(planar), *columns(pairwise))
+        print(f"{nPatches},{tPairwise:.3f},{tPlanar:.3f},{tPairwise / tPlanar:.1f},"
+              f"{len(pairwise)},{len(planar)},{stats['stretch_mean']:.4f},"
+              f"{stats['stretch_max']:.4f},{stats['mst'] / stats['ref_mst']:.4f}")
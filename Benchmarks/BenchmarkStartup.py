@@ -0,0 +1,50 @@
+'''
+Benchmark: script startup time
+
+Times starting a fresh Python process that imports each workflow script
+(as the toolbox and every worker process do), and lists the heavy
+libraries the import loaded. Libraries are meant to be imported only on
+the code paths that use them, so none should show up here. For
+comparison, the time to import each heavy library on its own is given.
+
+Usage: python BenchmarkStartup.py [repeats]
+'''
+
+import os, sys, subprocess, statistics
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts')
+MODULES = ('CreateEdgeList_v2', 'SummarizeGraph', 'CalculatePatchConnectivityAttributes',
+           'PatchConnect')
+HEAVY = ('arcpy', 'arcgis', 'pandas', 'networkx', 'scipy', 'skimage')
+
+
+def startup(code, repeats):
+    """Median wall time (s) of a fresh interpreter running code, and its output."""
+    times, out = [], ''
+    timer = "import time; _t = time.perf_counter()\n"
+    report = "\nprint('%.4f' % (time.perf_counter() - _t))"
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-c', timer + code + report], cwd=SCRIPTS,
+                                capture_output=True, text=True, check=True)
+        lines = result.stdout.split()
+        times.append(float(lines[-1]))
+        out = ' '.join(lines[:-1])
+    return statistics.median(times), out
+
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print("Module,Import(s),HeavyLibrariesLoaded")
+    for module in MODULES:
+        code = (f"import sys; import {module}\n"
+                f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules) or '-')")
+        seconds, loaded = startup(code, repeats)
+        print(f"{module},{seconds:.3f},{loaded}")
+    print("\nLibrary,Import(s)")
+    for library in HEAVY:
+        try:
+            seconds, _ = startup(f"import {library}", repeats)
+        except subprocess.CalledProcessError:
+            print(f"{library},not installed")
+            continue
+        print(f"{library},{seconds:.3f}")
@@ -0,0 +1,68 @@
+'''
+Benchmark: tiled (out-of-core) vs. in-memory cost distance
+
+Solves the cost distance from one source patch across a synthetic cost
+raster (float32, memory-mapped from disk) in memory, with
+CostDistance.solve_source, and tile by tile within several memory
+budgets, with a CostDistance.TiledSurface. Reports the time, the peak
+memory allocated by the solve (traced with tracemalloc), the number of
+tile solves and the largest difference between the two solutions' least
+costs to the other patches (should be 0).
+
+Usage: python BenchmarkTiledCostDistance.py [raster size]
+'''
+
+import os, sys, time, shutil, tempfile, tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from CostDistance import PatchIndex, TiledSurface, solve_source, solve_source_tiled, tile_size
+
+
+def make_rasters(folder, size, nPatches=20, seed=0):
+    """Random patches on a random float32 cost surface, saved to memory-mapped .npy files."""
+    rng = np.random.default_rng(seed)
+    arrPatch = np.full((size, size), -9999, dtype=np.int32)
+    for patchID in range(1, nPatches + 1):
+        r, c = rng.integers(0, size - 10, 2)
+        arrPatch[r:r+rng.integers(2, 10), c:c+rng.integers(2, 10)] = patchID
+    arrCost = np.lib.format.open_memmap(os.path.join(folder, 'cost.npy'), 'w+',
+                                        np.float32, (size, size))
+    for r in range(0, size, 256):
+        arrCost[r:r+256] = rng.uniform(1, 10, (min(256, size - r), size))
+    arrCost.flush()
+    return arrPatch, np.load(os.path.join(folder, 'cost.npy'), mmap_mode='r')
+
+
+def traced(func):
+    """Result, time (s) and peak memory allocated (MB) of a call."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    folder = tempfile.mkdtemp()
+    try:
+        arrPatch, arrCost = make_rasters(folder, size)
+        index = PatchIndex(arrPatch)
+        source = int(index.ids[0])
+        (_, edges, _), seconds, peak = traced(lambda: solve_source(source, index, arrCost, 30.0))
+        costs = np.array([cost for _, _, cost, _ in edges])
+        print("Mode,TileMemory(MB),Tile,Seconds,PeakMemory(MB),TileSolves,MaxDifference")
+        print(f"in memory,,,{seconds:.2f},{peak:.1f},,")
+        for budget in (16, 64, 256):
+            tile = tile_size(budget)
+            surface = TiledSurface(arrCost, 30.0, tile, folder)
+            (_, tiled, stats), seconds, peak = traced(
+                lambda: solve_source_tiled(source, index, surface))
+            surface.close()
+            diff = np.abs(np.array([cost for _, _, cost, _ in tiled]) - costs).max()
+            print(f"tiled,{budget},{tile},{seconds:.2f},{peak:.1f},{stats['solves']},{diff:g}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,69 @@
+'''
+Benchmark: destination patch minimum costs
+
+Compares the original per-pair loop in CreateEdgeList_v2.py (one boolean
+mask and one np.where scan of the raster per destination patch) with the
+single-pass PatchIndex.zonal_min, on a synthetic 1000 x 1000 raster with
+50, 200 and 800 patches. Times are for one source patch.
+
+Usage: python BenchmarkZonalMinimum.py [raster size]
+'''
+
+import os, sys, time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+from CostDistance import PatchIndex
+
+
+def make_patches(size, nPatches, seed=0):
+    """Random square patches (nodata = -9999) and a random cost distance surface."""
+    rng = np.random.default_rng(seed)
+    arrPatch = np.full((size, size), -9999, dtype=np.int32)
+    for patchID in range(1, nPatches + 1):
+        r, c = rng.integers(0, size - 10, 2)
+        arrPatch[r:r+rng.integers(2, 10), c:c+rng.integers(2, 10)] = patchID
+    cd_array = rng.uniform(0, 1e5, (size, size))
+    return arrPatch, cd_array
+
+
+def loop_minimum(arrPatch, cd_array, patchIDs, patchID):
+    """The original to-patch loop."""
+    out = []
+    for toID in patchIDs:
+        if toID > patchID:
+            least_cost_distance = cd_array[arrPatch == toID].min()
+            rowMin, colMin = np.where(cd_array == least_cost_distance)
+            out.append((toID, least_cost_distance, rowMin[0], colMin[0]))
+    return out
+
+
+def indexed_minimum(index, cd_array, patchID):
+    """Single pass zonal minimum over the patch index."""
+    mins, cells = index.zonal_min(cd_array)
+    keep = index.ids > patchID
+    return index.ids[keep], mins[keep], cells[keep]
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print("Patches,Loop(s),Indexed(s),IndexBuild(s),Speedup")
+    for nPatches in (50, 200, 800):
+        arrPatch, cd_array = make_patches(size, nPatches)
+        patchIDs = np.unique(arrPatch).tolist()
+        patchIDs.remove(-9999)
+        patchID = patchIDs[0]
+
+        t0 = time.perf_counter()
+        loop_minimum(arrPatch, cd_array, patchIDs, patchID)
+        tLoop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        index = PatchIndex(arrPatch)
+        tBuild = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        indexed_minimum(index, cd_array, patchID)
+        tIndexed = time.perf_counter() - t0
+
+        print(f"{len(patchIDs)},{tLoop:.4f},{tIndexed:.4f},{tBuild:.4f},{tLoop/tIndexed:.0f}x")
@@ -5,11 +5,33 @@
 #  within the distance threshold and (2) the inverse distance weighted patch area,
 #  i.e. area of further distances are discounted using a decay rate:
 #   SUM: exp(ln(0.1) * (patch distance)) * (patch area)
+#  With several decay distances (--decay-distances, default maxDistance),
+#  one IDW area column is written for each (idwArea_<distance>).
+#
+#  With several thresholds (maxDistance T1 T2 ...), one long-format table
+#  is written, with a row per patch and threshold (patchID, threshold,
+#  attributes...). Patch areas and edges are read once; each threshold
+#  adds only its new edges, and centrality is recomputed only for the
+#  subgraphs those edges changed, spread over --workers processes.
 #
 # Requires: NetworkX to be stored in script folder (or installed)
+#  Patch areas are read from the raster attribute table with arcpy, or
+#  tabulated from a GeoTIFF/.npy patch raster without ArcGIS (RasterIO.py)
 #
-# Inputs: <Patch raster> <edge list> <maxDistance>
+# Inputs: <Patch raster> <edge list> <maxDistance> [<maxDistance> ...]
+#         [--decay-distances D1 [D2 ...]]
+#         [--backend networkx|csr] [--workers N]
+#         [--samples K | --epsilon E] [--delta D] [--seed S]
 # Output: <Patch connected attribute table (CSV format)>
+#
+# The "csr" backend computes the centrality attributes from a sparse
+#  (CSR) adjacency matrix with scipy.sparse.csgraph (see PatchGraph.py),
+#  optionally over several processes. It matches the NetworkX values to
+#  within floating point round-off (relative differences below 1e-9).
+#  With --samples or --epsilon it estimates betweenness from a sample of
+#  source patches (fixed size, or grown until every estimate is within
+#  epsilon) and adds a betweennessCI column: the half-width of each
+#  estimate's 1-delta confidence interval (in the same units).
 #  
 # June 14, 2012
 # John.Fay@duke.edu
@@ -24,112 +46,274 @@
 #---------------------------------------------------------------------------------
 
 # Import system modules
-import sys, arcpy, math
-import networkx as nx
-
-# Check out any necessary licenses
-arcpy.CheckOutExtension("spatial")
-arcpy.env.overwriteOutput = True
-
-# Input variables
-debug = False
-if debug:
-    patchRaster = "../Data/ENH_LCP_ModelInputs_Final2019.gdb/S_Patches_60ha"
-    edgeListFN = "../S_guild/edge_list.csv"
-    maxDistance = 1600  
-    k = math.log(0.1) / maxDistance ##Decay coefficient
-else:
-    patchRaster = sys.argv[1]   
-    edgeListFN = sys.argv[2]    
-    maxDistance = int(sys.argv[3])   
-    k = math.log(0.1) / maxDistance ##Decay coefficient
-
-# Output variables
-if debug:
-    outputFN = "../S_guild/connections.csv" 
-else:
-    outputFN = sys.argv[4]   
-    
+import argparse, math
+import numpy as np
+from EdgeList import load_edges
+import RasterIO
+
 
 ##---FUNCTIONS---
-def msg(txt): print (txt); arcpy.AddMessage(txt); return
+def msg(txt): RasterIO.add_message(txt); return
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compute patch connectivity attributes")
+    parser.add_argument('patchRaster', help="Patch raster")
+    parser.add_argument('edgeListFN', help="Edge list (csv)")
+    parser.add_argument('maxDistance', type=int, nargs='+',
+                        help="Cost distance threshold(s); with several, a long-format table "
+                             "with one row per patch and threshold is written")
+    parser.add_argument('outputFN', help="Output patch attribute table (csv)")
+    parser.add_argument('--decay-distances', type=float, nargs='+', default=None,
+                        help="Distance(s) at which IDW area weights fall to 0.1 "
+                             "(default: each maxDistance); one idwArea column each")
+    parser.add_argument('--backend', choices=['networkx','csr'], default='networkx',
+                        help="Centrality backend (default: networkx)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes for the csr backend, or for the "
+                             "subgraphs of several thresholds (default: 1)")
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument('--samples', type=int, default=None,
+                          help="Estimate betweenness from this many sampled sources (csr backend)")
+    sampling.add_argument('--epsilon', type=float, default=None,
+                          help="Sample sources until normalized betweenness is within epsilon (csr backend)")
+    parser.add_argument('--delta', type=float, default=0.1,
+                        help="Confidence interval error probability (default: 0.1)")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="Random seed for the sampled sources [optional]")
+    args = parser.parse_args(argv)
+    if args.samples is not None or args.epsilon is not None:
+        args.backend = 'csr'
+    return args
+
+def area_attributes(patchIDs, areas, u, v, w, decayDistances):
+    '''Degree, connected area and IDW areas (one per decay distance) of each patch,
+    as products of sparse edge matrices with the patch area vector'''
+    from scipy import sparse
+    ids = np.asarray(list(patchIDs))
+    areas = np.asarray(areas, dtype=float)
+    order = np.argsort(ids)
+    #Every edge end must be a patch of the raster: searchsorted alone would
+    #credit a missing patch to its neighbour in ID order
+    ends = np.concatenate([u, v])
+    pos = np.searchsorted(ids, ends, sorter=order)
+    found = pos < len(ids)
+    found[found] = ids[order[pos[found]]] == ends[found]
+    if not found.all():
+        raise KeyError("Edge list patch(es) not in the patch raster: %s"
+                       %", ".join("%d" %p for p in np.unique(ends[~found])[:10]))
+    rows = order[pos].astype(int)
+    cols = np.concatenate([rows[len(u):], rows[:len(u)]])
+    dist = np.concatenate([w, w])
+    shape = (len(ids), len(ids))
+    def weighted_area(weights):
+        return sparse.csr_matrix((weights, (rows, cols)), shape=shape) @ areas
+    degree = np.bincount(rows, minlength=len(ids))
+    connArea = weighted_area(np.ones(dist.size))
+    #Decay kernel: weight 0.1 at the decay distance
+    idwAreas = [weighted_area(np.exp(math.log(0.1) / d * dist)) for d in decayDistances]
+    return degree, connArea, idwAreas
+
+def count_components(u, v):
+    '''Number of connected components of the graph of edges u-v'''
+    from scipy import sparse
+    from scipy.sparse import csgraph
+    if not len(u):
+        return 0
+    nodes, uv = np.unique(np.concatenate([u, v]), return_inverse=True)
+    A = sparse.csr_matrix((np.ones(len(u)), (uv[:len(u)], uv[len(u):])),
+                          shape=(len(nodes), len(nodes)))
+    return csgraph.connected_components(A, directed=False)[0]
+
+def networkx_centrality(u, v, w):
+    '''Degree, betweenness, and closeness centrality - one subgraph at time'''
+    import networkx as nx
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip(u.tolist(), v.tolist(), w.tolist()))
+    dG = {}
+    bG = {}
+    cG = {}
+    for subG in (G.subgraph(c).copy() for c in nx.connected_components(G)):
+        #msg("Calculating degree centrality...")
+        dG.update(nx.centrality.degree_centrality(subG))
+        #msg("Calculating betweenness centrality...")
+        bG.update(nx.centrality.betweenness_centrality(subG,normalized=True,weight='weight'))
+        #msg("Calculating closeness centrality...")
+        cG.update(nx.centrality.closeness_centrality(subG,distance='weight'))
+    return dG, bG, cG
+
+def component_task(task):
+    '''Worker task: degree, betweenness, closeness centrality and betweenness CI
+    (None unless sampled) of one subgraph, given as (backend, (u, v, w), sampling)'''
+    backend, (u, v, w), sampling = task
+    if backend == 'csr':
+        dG, bG, cG, eG = csr_centrality(u, v, w, 1, **sampling)
+        return dG, bG, cG, eG if sampling else None
+    return networkx_centrality(u, v, w) + (None,)
+
+def threshold_attributes(patchIDs, areas, u, v, w, thresholds, decayDistances=None,
+                         backend='networkx', workers=1, sampling=None):
+    '''Area and centrality attributes at each of the (increasing) thresholds, as
+    (threshold, degree, connArea, idwAreas, dG, bG, cG, eG) tuples. Edges are
+    added to one ThresholdSweep in order of cost: area sums are updated with the
+    new edges only, and centrality is recomputed only for the subgraphs that gained
+    edges (the others keep their values), with all of these subgraphs spread over
+    a pool of workers. IDW areas decay at decayDistances, by default each threshold'''
+    from PatchGraph import ThresholdSweep, pool_map
+    sampling = sampling or {}
+    order = np.argsort(w, kind='stable')
+    u, v, w = u[order], v[order], w[order]
+    sweep = ThresholdSweep(u, v, w)
+    degree = np.zeros(len(patchIDs), dtype=int)
+    connArea = np.zeros(len(patchIDs))
+    idwSums = [np.zeros(len(patchIDs)) for _ in decayDistances or []]
+    steps, tasks = [], []
+    for t in thresholds:
+        start = sweep.n_edges
+        sweep.advance(t)
+        end = sweep.n_edges
+        newDegree, newArea, newIdw = area_attributes(patchIDs, areas, u[start:end], v[start:end],
+                                                     w[start:end], decayDistances or [])
+        degree = degree + newDegree
+        connArea = connArea + newArea
+        if decayDistances:
+            idwSums = [a + b for a, b in zip(idwSums, newIdw)]
+            idwAreas = idwSums
+        else:
+            #Decaying at the threshold itself, every edge's weight changes
+            idwAreas = area_attributes(patchIDs, areas, u[:end], v[:end], w[:end], [t])[2]
+        changed = sweep.changed_components()
+        #Patches without edges yet are single node components of the sweep
+        nSubgraphs = sweep.n_components - (len(sweep.nodes) - (degree > 0).sum())
+        msg("Threshold %d: %d new edge(s), %d subgraph(s), %d of them changed"
+            %(t, end - start, nSubgraphs, len(changed)))
+        steps.append((t, degree, connArea, idwAreas, len(changed)))
+        tasks.extend((backend, edges, sampling) for _, edges in changed)
+
+    msg("Calculating centrality of %d subgraph(s)" %len(tasks))
+    results = iter(pool_map(component_task, tasks, workers))
+    dG, bG, cG, eG = {}, {}, {}, ({} if backend == 'csr' and sampling else None)
+    for t, degree, connArea, idwAreas, nChanged in steps:
+        for _ in range(nChanged):
+            d, b, c, e = next(results)
+            dG.update(d); bG.update(b); cG.update(c)
+            if eG is not None: eG.update(e)
+        yield t, degree, connArea, idwAreas, dG, bG, cG, eG
+
+def format_rows(patchIDs, degree, connArea, idwAreas, dG, bG, cG, eG, threshold=None):
+    '''Output table rows of each patch; with a threshold, it follows the patch ID'''
+    isolated = ", ".join(["0.0"] * (1 + len(idwAreas))) + ", 0, 0.0, 0.0, 0.0"
+    if eG is not None: isolated += ", 0.0"
+    lines = []
+    for n, patchID in enumerate(patchIDs):
+        key = "%d" %patchID if threshold is None else "%d, %d" %(patchID, threshold)
+        if not degree[n]:
+            lines.append("%s, %s" %(key, isolated))
+            continue
+        between = bG[patchID] * 100.0
+        closeness = cG[patchID] * 100.0
+        degreeN = dG[patchID] * 100.0
+        line = "%s, %2.4f, %s, %d, %2.4f, %2.4f, %2.4f" %(
+            key, connArea[n], ", ".join("%2.4f" %a[n] for a in idwAreas),
+            degree[n], between, closeness, degreeN)
+        if eG is not None:
+            line += ", %2.4f" %(eG[patchID] * 100.0)
+        lines.append(line)
+    return lines
+
+def csr_centrality(u, v, w, workers=1, **sampling):
+    '''Degree, betweenness, closeness centrality and betweenness CI from a CSR adjacency matrix'''
+    from PatchGraph import centrality
+    nodes, degree, closeness, between, error = centrality(u, v, w, workers, **sampling)
+    nodes = nodes.tolist()
+    return (dict(zip(nodes, degree.tolist())),
+            dict(zip(nodes, between.tolist())),
+            dict(zip(nodes, closeness.tolist())),
+            dict(zip(nodes, error.tolist())))
+
 
 ##---PROCESSES---
-# Create a list of patch IDs and a dictionary of areas
-msg("Creating list of patch areas")
-patchAreas = {}
-cellSize2HA = (arcpy.Raster(patchRaster).meanCellWidth ** 2) / 10000.0
-rows = arcpy.SearchCursor(patchRaster)
-row = rows.next()
-while row:
-    patchAreas[row.VALUE] = row.COUNT * cellSize2HA
-    row = rows.next()
-del row, rows
-patchIDs = patchAreas.keys()
-
-# Create a graph from the edge list
-msg("Creating graph from nodes < %d from each other" %maxDistance)
-G = nx.Graph()
-subDict = {}
-edgeList = open(edgeListFN,'r')
-headerLine = edgeList.readline()
-dataLine = edgeList.readline()
-while dataLine:
-    lineData = dataLine.split(",")
-    u = int(lineData[0])
-    v = int(lineData[1])
-    w = float(lineData[2][:-1])
-    if w <= maxDistance:
-        G.add_edge(u,v,weight = w)
-    dataLine = edgeList.readline()
-edgeList.close()
-
-# Calculate degree, betweenness, and closeness centrality - one subgraph at time
-subGs = nx.connected_component_subgraphs(G)
-msg("There graph contains %d subgraph(s)" %sum(1 for _ in subGs))
-dG = {}
-bG = {}
-cG = {}
-for subG in nx.connected_component_subgraphs(G):
-    #msg("Calculating degree centrality...")
-    dG.update(nx.centrality.degree_centrality(subG))
-    #msg("Calculating betweenness centrality...")
-    bG.update(nx.centrality.betweenness_centrality(subG,normalized=True,weight='weight'))
-    #msg("Calculating closeness centrality...")
-    cG.update(nx.centrality.closeness_centrality(subG,distance='weight'))
-
-# Create the output file
-msg("Writing outputs to %s" %outputFN)
-connAreaFileObj = open(outputFN, 'w')
-connAreaFileObj.write("patchID, connectedArea, idwArea, degree, betweenness, closeness, degreeCen\n")
-
-# Loop through patch IDs
-for patchID in patchIDs:
-    if not patchID in G.nodes():
-        msg("Patch #%d is isolated" %patchID)
-        connAreaFileObj.write("%d, 0.0, 0.0, 0, 0.0, 0.0, 0.0\n" %patchID)
-        continue
-    # Reset area accumulators
-    connArea = 0
-    idwArea = 0
-    # Get the edges connected to the selected node
-    edges = G.edges.data(nbunch=patchID)#G.edge[patchID]
-    # Diameter (number of neighbors)
-    degree = len(edges)
-    
-    # Loop through each connected patch and tabulate area and IDW area
-    for (fromID,toID,wt) in edges:
-        distance = wt['weight']
-        connArea += patchAreas[toID]
-        idwArea += math.exp(k * distance) * patchAreas[toID]
-    between = bG[patchID] * 100.0
-    closeness = cG[patchID] * 100.0
-    degreeN = dG[patchID] * 100.0
-
-    # Write values to the file
-    connAreaFileObj.write("%d, %2.4f, %2.4f, %d, %2.4f, %2.4f, %2.4f\n"
-                          %(patchID, connArea, idwArea, degree, between, closeness, degreeN))
-
-# Close the text file
-connAreaFileObj.close()
+def main(argv=None):
+    # Input variables
+    debug = False
+    if debug:
+        patchRaster = "../Data/ENH_LCP_ModelInputs_Final2019.gdb/S_Patches_60ha"
+        edgeListFN = "../S_guild/edge_list.csv"
+        thresholds = [1600]
+        decayDistances = None
+        backend = 'networkx'
+        workers = 1
+        sampling = {}
+    else:
+        args = get_args(argv)
+        patchRaster = args.patchRaster
+        edgeListFN = args.edgeListFN
+        thresholds = sorted(set(args.maxDistance))
+        decayDistances = args.decay_distances
+        backend = args.backend
+        workers = args.workers
+        sampling = {}
+        if args.samples is not None or args.epsilon is not None:
+            sampling = dict(samples=args.samples, epsilon=args.epsilon,
+                            delta=args.delta, seed=args.seed)
+    # Output variables
+    if debug:
+        outputFN = "../S_guild/connections.csv"
+    else:
+        outputFN = args.outputFN
+
+    # Create a list of patch IDs and a dictionary of areas
+    msg("Creating list of patch areas")
+    ids, areas = RasterIO.get_backend(patchRaster).patch_areas(patchRaster)
+    patchAreas = dict(zip(ids.tolist(), areas.tolist()))
+    patchIDs = patchAreas.keys()
+
+    # Create a graph from the edge list
+    maxDistance = thresholds[-1]
+    msg("Creating graph from nodes < %d from each other" %maxDistance)
+    u, v, w = load_edges(edgeListFN, max_cost=maxDistance)
+    idwNames = ["idwArea"] if len(decayDistances or [0]) == 1 else ["idwArea_%g" %d for d in decayDistances]
+    header = "patchID, %sconnectedArea, %s, degree, betweenness, closeness, degreeCen%s"
+
+    if len(thresholds) > 1:
+        # One long-format table over all thresholds
+        lines = [header %("threshold, ", ", ".join(idwNames),
+                          ", betweennessCI" if backend == 'csr' and sampling else "")]
+        areaList = [patchAreas[p] for p in patchIDs]
+        for t, degree, connArea, idwAreas, dG, bG, cG, eG in threshold_attributes(
+                list(patchIDs), areaList, u, v, w, thresholds, decayDistances,
+                backend, workers, sampling):
+            msg("Threshold %d: %d isolated patch(es)" %(t, (degree == 0).sum()))
+            lines.extend(format_rows(patchIDs, degree, connArea, idwAreas, dG, bG, cG, eG, t))
+    else:
+        # Calculate degree, betweenness, and closeness centrality
+        msg("There graph contains %d subgraph(s)" %count_components(u, v))
+        eG = None
+        if backend == 'csr' and len(u):
+            dG, bG, cG, eG = csr_centrality(u, v, w, workers, **sampling)
+            if sampling:
+                msg("Betweenness estimated from sampled sources")
+            else:
+                eG = None
+        else:
+            dG, bG, cG = networkx_centrality(u, v, w)
+
+        # Calculate degree, connected area and IDW area(s) for all patches at once
+        degree, connArea, idwAreas = area_attributes(patchIDs, [patchAreas[p] for p in patchIDs],
+                                                     u, v, w, decayDistances or [maxDistance])
+
+        # Format the rows of the output file
+        for n, patchID in enumerate(patchIDs):
+            if not degree[n]:
+                msg("Patch #%d is isolated" %patchID)
+        lines = [header %("", ", ".join(idwNames), ", betweennessCI" if eG is not None else "")]
+        lines.extend(format_rows(patchIDs, degree, connArea, idwAreas, dG, bG, cG, eG))
+
+    # Create the output file
+    msg("Writing outputs to %s" %outputFN)
+    with open(outputFN, 'w') as connAreaFileObj:
+        connAreaFileObj.write("\n".join(lines) + "\n")
+
 
+#Guard the entry point so worker processes can import this module safely
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1133 @@
+'''
+Cost Distance
+Spring 2021 - John.Fay@duke.edu
+
+Cost distance routines used by CreateEdgeList_v2.py. Everything in here
+works on plain NumPy arrays (no arcpy), so the functions can be run in
+worker processes as well as in the toolbox process itself.
+
+The patch and cost arrays are handed to each worker once, through shared
+memory, and each worker then computes the cost distance surface and the
+patch-to-patch minimum costs for a batch of source patches.
+
+Patch cells are looked up through a PatchIndex (the flat pixel offsets of
+every patch, sorted by patch ID) that is built once, so the minimum cost
+to every destination patch is found in a single pass over the patch
+cells rather than one full raster scan per patch pair.
+
+The wavefront of each solve can be cut off at a maximum cost and/or once
+every higher-ID destination patch has been reached; cells beyond the
+cutoff are left at infinity and patch pairs that are not reached are
+dropped, just as pairs without a viable connection are.
+
+Cost distance layers are not sent back from the workers: each one is
+written straight to the on-disk stack (see CostDistanceStack.py) as soon
+as it is computed.
+
+With a maximum cost, patch pairs that cannot be connected below it can be
+pruned before any solve (see candidate_pairs): every step of a least
+cost path costs at least the minimum cell cost per unit of distance, so
+the gap between two patches' bounding boxes gives a lower bound on their
+cost. For the same reason, nothing beyond a fixed reach of the source
+patch can be reached below the maximum cost, so each solve is limited to
+a window of that reach around the source patch.
+
+Without a cutoff, solves can instead start on a small window around the
+source patch that is doubled until its results are certified (every
+destination reached below the smallest cost on the window's edge, which
+no path leaving the window can beat). Only the window of the cost array
+is copied for each solve, and results are mapped back to raster
+coordinates.
+
+Sources are scheduled so no solve is wasted (see schedule_sources):
+patches left without unresolved pairs are not solved unless their cost
+distance layer is wanted, and solves whose layer is not kept stop once
+their targets are reached.
+
+Least cost paths can also be counted into a corridor raster (see
+PathDensity) as each source is solved, rather than kept.
+
+Rasters too large to hold in memory are solved out of core (see
+TiledSurface): the patch and cost arrays are memory-mapped files and each
+solve works through tiles of the cost raster that fit a memory budget,
+passing costs across the tile edges until no tile can improve them.
+'''
+
+import os, sys, time
+import math
+import functools
+import shutil
+import tempfile
+import heapq
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+#Cells read at a time from arrays that may be memory-mapped
+BLOCK_CELLS = 1 << 22
+
+
+#%% SHARED ARRAYS
+#Arrays made available to the worker processes (set by _init_worker)
+_shared = {}
+
+
+def share_array(arr):
+    """
+    Copy an array into a new shared memory block and return the block
+    along with the (name, shape, dtype) tuple needed to attach to it.
+    The caller is responsible for closing and unlinking the block.
+
+    Memory-mapped arrays (out-of-core rasters) are not copied: the block
+    is None and the workers map the same file.
+    """
+    if isinstance(arr, np.memmap):
+        return None, (arr.filename, arr.shape, arr.dtype.str, arr.offset)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[:] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def attach_array(spec):
+    """
+    Attach to a shared memory block created by share_array and return
+    the block and a NumPy view of it (or None and a read-only memory map
+    of a memory-mapped array's file).
+    """
+    if len(spec) == 4:
+        filename, shape, dtype, offset = spec
+        return None, np.memmap(filename, dtype=np.dtype(dtype), mode='r', shape=shape,
+                               offset=offset)
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _init_worker(patchSpec, costSpec, settings, stack):
+    """Pool initializer: attach to the shared patch and cost arrays."""
+    shmPatch, arrPatch = attach_array(patchSpec)
+    shmCost, arrCost = attach_array(costSpec)
+    #Keep references to the blocks so the views stay valid
+    _shared.update(settings=settings, stack=stack)
+    _shared.update(shmPatch=shmPatch, shmCost=shmCost,
+                   arrPatch=arrPatch, arrCost=arrCost,
+                   index=PatchIndex(arrPatch))
+
+
+#%% PATCH INDEX
+class PatchIndex:
+    """
+    Index of the cells belonging to each patch, built once per raster.
+
+    cells holds the flat (row-major) offsets of all patch cells grouped by
+    patch ID, and in row-major order within each patch. ids, starts and
+    counts give the patch IDs (ascending) and the position and size of
+    each patch's run of cells.
+    """
+
+    def __init__(self, arrPatch, nodata=-9999):
+        #Read in blocks of rows, so memory-mapped rasters are never loaded whole
+        nRows, nCols = arrPatch.shape
+        step = max(1, BLOCK_CELLS // max(nCols, 1))
+        cells, labels = [], []
+        for r in range(0, nRows, step):
+            block = np.asarray(arrPatch[r:r+step]).ravel()
+            found = np.flatnonzero(block != nodata)
+            cells.append(found + r * nCols)
+            labels.append(block[found])
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        labels = np.concatenate(labels) if labels else np.empty(0, dtype=arrPatch.dtype)
+        #A stable sort keeps the cells of each patch in row-major order
+        order = np.argsort(labels, kind='stable')
+        self.cells = cells[order]
+        self.ids, self.starts, self.counts = np.unique(labels[order],
+                                                       return_index=True,
+                                                       return_counts=True)
+        self.shape = arrPatch.shape
+        self._bboxes = None
+
+    @property
+    def bboxes(self):
+        """(row0, col0, row1, col1) bounding box of each patch, aligned with ids."""
+        if self._bboxes is None:
+            rows, cols = np.unravel_index(self.cells, self.shape)
+            self._bboxes = np.column_stack([np.minimum.reduceat(rows, self.starts),
+                                            np.minimum.reduceat(cols, self.starts),
+                                            np.maximum.reduceat(rows, self.starts),
+                                            np.maximum.reduceat(cols, self.starts)])
+        return self._bboxes
+
+    def patch_cells(self, patchID):
+        """Return the flat offsets of the cells in one patch."""
+        i = np.searchsorted(self.ids, patchID)
+        return self.cells[self.starts[i]:self.starts[i] + self.counts[i]]
+
+    def zonal_min(self, values, window=None):
+        """
+        Return the minimum of values within every patch and the flat
+        offset of the first (row-major) cell holding that minimum, as two
+        arrays aligned with ids. Done in one pass over the patch cells.
+
+        If window, a (row0, col0, row1, col1) box, is given, values only
+        covers that window of the raster; patch cells outside it count as
+        infinite.
+        """
+        if window is None:
+            vals = values.ravel()[self.cells]
+        else:
+            r0, c0, r1, c1 = window
+            rows, cols = np.unravel_index(self.cells, self.shape)
+            inside = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+            vals = np.full(self.cells.size, np.inf)
+            vals[inside] = values[rows[inside] - r0, cols[inside] - c0]
+        mins = np.minimum.reduceat(vals, self.starts)
+        #Position of the first cell in each patch equal to its minimum
+        pos = np.where(vals == np.repeat(mins, self.counts),
+                       np.arange(vals.size), vals.size)
+        first = np.minimum.reduceat(pos, self.starts)
+        return mins, self.cells[first]
+
+
+#%% PRUNING
+def min_cost(arrCost):
+    """Smallest passable (non-negative) cell cost, read in blocks of rows."""
+    step = max(1, BLOCK_CELLS // max(arrCost.shape[1], 1))
+    mins = [block[block >= 0].min(initial=np.inf)
+            for block in (np.asarray(arrCost[r:r+step]) for r in range(0, arrCost.shape[0], step))]
+    return min(mins, default=np.inf)
+
+
+def cost_lower_bound(gap, cellSize, minCost):
+    """
+    Lower bound on the least cost between two patches whose cell centers
+    are at least gap apart. Every step costs at least minCost per unit of
+    length, except the first one out of the (zero cost) source patch,
+    which costs half that over at most a diagonal cell.
+    """
+    return minCost * (gap - math.sqrt(2) * cellSize / 2)
+
+
+def reach_cells(cellSize, minCost, max_cost):
+    """
+    Number of cells beyond a source patch's bounding box that a least
+    cost path costing up to max_cost can reach (see cost_lower_bound).
+    """
+    return int(math.ceil((max_cost / minCost + math.sqrt(2) * cellSize / 2) / cellSize)) + 1
+
+
+def candidate_pairs(index, cellSize, minCost, max_cost):
+    """
+    Return, for each patch ID, the array of higher patch IDs that might be
+    connected at a cost up to max_cost, judging by the gap between their
+    bounding boxes (see cost_lower_bound). Candidate pairs are enumerated
+    with a KD-tree on the bounding box centers, so far-apart pairs are
+    never looked at.
+    """
+    boxes = index.bboxes.astype(np.float64)
+    centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+    halfDiag = np.hypot(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) / 2
+    #Largest center distance (in cells) at which a pair might be under max_cost
+    radius = reach_cells(cellSize, minCost, max_cost) + 2 * halfDiag.max()
+    from scipy.spatial import cKDTree
+    pairs = cKDTree(centers).query_pairs(radius, output_type='ndarray')
+    i, j = np.sort(pairs, axis=1).T if pairs.size else (np.empty(0, int), np.empty(0, int))
+    #Gap between bounding boxes, in map units
+    rowGap = np.maximum(0, np.maximum(boxes[j, 0] - boxes[i, 2], boxes[i, 0] - boxes[j, 2]))
+    colGap = np.maximum(0, np.maximum(boxes[j, 1] - boxes[i, 3], boxes[i, 1] - boxes[j, 3]))
+    gap = np.hypot(rowGap, colGap) * cellSize
+    keep = cost_lower_bound(gap, cellSize, minCost) <= max_cost
+    i, j = i[keep], j[keep]
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    bounds = np.searchsorted(i, np.arange(len(index.ids) + 1))
+    return {patchID: index.ids[j[bounds[k]:bounds[k+1]]]
+            for k, patchID in enumerate(index.ids.tolist())}
+
+
+#%% SCHEDULING
+def schedule_sources(patchIDs, candidates=None, cover=False, layers=()):
+    """
+    Choose the source patches to solve and the target patches of each.
+
+    By default every patch is solved to the patches with higher IDs (or
+    to its candidates, see candidate_pairs), and patches left without
+    targets are not solved at all. With cover, the sources are instead
+    picked greedily (most unresolved pairs first) so that every candidate
+    pair is solved from one of its two patches, with the fewest solves;
+    a source's targets can then have lower IDs too. Least costs are only
+    approximately symmetric (the end patch's cells count towards the
+    cost, the start patch's do not), so the edges differ slightly from a
+    default run.
+
+    Patches in layers are always solved, for their cost distance layer.
+    Returns the list of sources (in patchIDs order) and a dictionary of
+    their target arrays.
+    """
+    patchIDs = list(patchIDs)
+    if candidates is None:
+        ids = np.array(patchIDs)
+        candidates = {patchID: ids[k+1:] for k, patchID in enumerate(patchIDs)}
+    targets = {}
+    if not cover:
+        targets = {p: np.asarray(candidates[p]) for p in patchIDs if len(candidates[p])}
+    else:
+        #Undirected candidate pair graph
+        neighbors = {p: set() for p in patchIDs}
+        for p in patchIDs:
+            for q in candidates[p].tolist():
+                neighbors[p].add(q)
+                neighbors[q].add(p)
+        rank = {p: k for k, p in enumerate(patchIDs)}
+        heap = [(-len(neighbors[p]), rank[p], p) for p in patchIDs if neighbors[p]]
+        heapq.heapify(heap)
+        while heap:
+            degree, _, p = heapq.heappop(heap)
+            if -degree != len(neighbors[p]):
+                #Stale entry: requeue with the current degree
+                if neighbors[p]:
+                    heapq.heappush(heap, (-len(neighbors[p]), rank[p], p))
+                continue
+            targets[p] = np.array(sorted(neighbors[p], key=rank.get), dtype=np.int64)
+            for q in neighbors[p]:
+                neighbors[q].discard(p)
+            neighbors[p] = set()
+    layers = set(layers)
+    sources = [p for p in patchIDs if p in targets or p in layers]
+    for p in sources:
+        targets.setdefault(p, np.empty(0, dtype=np.int64))
+    return sources, targets
+
+
+#%% SOLVER
+@functools.lru_cache(maxsize=None)
+def _mcp_cutoff():
+    """MCP_Cutoff class, defined on first use (skimage is only imported by solves)."""
+    from skimage import graph
+
+    class MCP_Cutoff(graph.MCP_Geometric):
+        """
+        MCP_Geometric that stops expanding the wavefront once the cumulative
+        cost passes max_cost. Cells are settled in order of increasing cost,
+        so every cell with a cost up to max_cost holds its final value when
+        the search stops; anything above it is only a partial estimate.
+        """
+
+        def __init__(self, costs, sampling, max_cost):
+            graph.MCP_Geometric.__init__(self, costs, sampling=sampling)
+            self.max_cost = max_cost
+
+        def goal_reached(self, index, cumcost):
+            #Returning 2 stops the whole search
+            return 2 if cumcost > self.max_cost else 0
+
+    return MCP_Cutoff
+
+
+def mcp_solver(costs, cellSize, max_cost=None):
+    """
+    MCP_Geometric solver (which accounts for diagonals) over a cost array,
+    stopping once the cost passes max_cost if it is set.
+    """
+    from skimage import graph
+    if max_cost is None:
+        return graph.MCP_Geometric(costs, sampling=(cellSize, cellSize))
+    return _mcp_cutoff()(costs, (cellSize, cellSize), max_cost)
+
+
+def source_window(index, patchID, pad):
+    """
+    Return the (row0, col0, row1, col1) window extending pad cells beyond
+    the bounding box of a patch, clipped to the raster (the whole raster
+    if pad is None).
+    """
+    nRows, nCols = index.shape
+    if pad is None:
+        return 0, 0, nRows, nCols
+    box = index.bboxes[np.searchsorted(index.ids, patchID)]
+    return (max(box[0] - pad, 0), max(box[1] - pad, 0),
+            min(box[2] + pad + 1, nRows), min(box[3] + pad + 1, nCols))
+
+
+def boundary_min(cd_window, window, shape):
+    """
+    Smallest cost on the edge of a solve window, leaving out the sides
+    that lie on the edge of the raster (infinite if the window is the
+    whole raster). No path out of the window costs less.
+    """
+    r0, c0, r1, c1 = window
+    sides = [cd_window[0, :] if r0 > 0 else None,
+             cd_window[-1, :] if r1 < shape[0] else None,
+             cd_window[:, 0] if c0 > 0 else None,
+             cd_window[:, -1] if c1 < shape[1] else None]
+    return min([side.min() for side in sides if side is not None], default=np.inf)
+
+
+def _solve_window(patchID, index, arrCost, cellSize, window, max_cost, targetCells):
+    """
+    Solve the cost distance from one source patch within a window of the
+    cost raster (copying only that window). If targetCells is given, the
+    search stops once those of them inside the window are reached.
+
+    Returns the windowed cost distance array (infinite beyond the cost
+    where the search stopped), that cost, and the traceback array and
+    neighbor offsets of the solve (see trace_paths).
+    """
+    r0, c0, r1, c1 = window
+
+    def to_window(cells):
+        i, j = np.unravel_index(cells, index.shape)
+        inside = (i >= r0) & (i < r1) & (j >= c0) & (j < c1)
+        return list(zip(i[inside] - r0, j[inside] - c0))
+
+    #Reclassify cost in source patch cells to zero
+    sourceCells = index.patch_cells(patchID)
+    arrCostMod = arrCost[r0:r1, c0:c1].copy()
+    startCells = to_window(sourceCells)
+    arrCostMod[tuple(np.array(startCells).T)] = 0
+
+    #Create the MCP object (Geometric accounts for diagonals)
+    cost_graph = mcp_solver(arrCostMod, cellSize, max_cost)
+
+    #End once the target cells are reached; with none left, at the source itself
+    endCells = None
+    if targetCells is not None:
+        endCells = to_window(targetCells) or startCells[:1]
+
+    #Compute cost distance and traceback arrays from a source
+    cd_window, traceback = cost_graph.find_costs(starts=startCells, ends=endCells)
+
+    #Discard partial costs beyond the point where the search stopped
+    stop_cost = np.inf if max_cost is None else max_cost
+    if endCells is not None:
+        endCosts = cd_window[tuple(np.array(endCells).T)]
+        endCosts = endCosts[np.isfinite(endCosts)]
+        if endCosts.size:
+            stop_cost = min(stop_cost, endCosts.max())
+    if stop_cost < np.inf:
+        cd_window[cd_window > stop_cost] = np.inf
+    return cd_window, stop_cost, traceback, np.asarray(cost_graph.offsets)
+
+
+def trace_paths(traceback, offsets, endCells):
+    """
+    Trace the least cost paths back from many end cells at once, through
+    the traceback array of an MCP solve (the index into offsets of each
+    cell's predecessor, negative at the start cells).
+
+    All paths are stepped back together, with NumPy, and a path stops as
+    soon as it runs into a cell already traced by another one: it then
+    shares the rest of that path, so each cell is traced only once.
+
+    endCells are flat offsets into traceback. Returns one (n, 2) array of
+    (row, col) cells per end cell, from the start of the path to its end
+    (the same cells as MCP.traceback).
+    """
+    nCols = traceback.shape[1]
+    steps = offsets[:, 0].astype(np.int64) * nCols + offsets[:, 1]
+    tb = traceback.ravel()
+    n = len(endCells)
+    #Walker (and step) that first traced each cell
+    owner = np.full(tb.size, -1, dtype=np.int32)
+    ownerStep = np.zeros(tb.size, dtype=np.int32)
+    join = np.full(n, -1)
+    joinStep = np.zeros(n, dtype=np.int64)
+    walkers, cells, stepNo = [], [], []
+    active = np.arange(n)
+    cur = np.asarray(endCells, dtype=np.int64)
+    step = 0
+    while active.size:
+        #Walkers reaching a cell already traced join that path
+        hit = owner[cur] >= 0
+        join[active[hit]] = owner[cur[hit]]
+        joinStep[active[hit]] = ownerStep[cur[hit]]
+        active, cur = active[~hit], cur[~hit]
+        #Walkers meeting on the same cell at this step follow the first one
+        _, first, inverse = np.unique(cur, return_index=True, return_inverse=True)
+        lead = active[first][inverse]
+        follow = lead != active
+        join[active[follow]] = lead[follow]
+        joinStep[active[follow]] = step
+        active, cur = active[~follow], cur[~follow]
+        owner[cur] = active
+        ownerStep[cur] = step
+        walkers.append(active)
+        cells.append(cur)
+        stepNo.append(np.full(active.size, step))
+        #Step back to the predecessors; walkers at a start cell are done
+        t = tb[cur]
+        more = t >= 0
+        active, cur = active[more], cur[more] - steps[t[more]]
+        step += 1
+
+    #Each walker's own segment, from its end cell back
+    walkers, cells, stepNo = (np.concatenate(x) if x else np.empty(0, dtype=np.int64)
+                              for x in (walkers, cells, stepNo))
+    order = np.lexsort((stepNo, walkers))
+    cells = cells[order]
+    bounds = np.searchsorted(walkers[order], np.arange(n + 1))
+    paths = []
+    for w in range(n):
+        parts = [cells[bounds[w]:bounds[w + 1]]]
+        while join[w] >= 0:
+            w, s = join[w], joinStep[w]
+            parts.append(cells[bounds[w] + s:bounds[w + 1]])
+        path = np.concatenate(parts)[::-1]
+        paths.append(np.column_stack(np.divmod(path, nCols)))
+    return paths
+
+
+def solve_source(patchID, index, arrCost, cellSize, lcp=False, max_cost=None, settle=False,
+                 reach=None, targets=None, adaptive=None):
+    """
+    Compute the cost distance surface from one source patch and the
+    least cost to every patch with a higher ID, or to the target patches
+    (an array of patch IDs) if given.
+
+    If max_cost is set, the wavefront stops once it passes that cost; if
+    settle is True, it stops once every target patch has been reached.
+    Either way, cells beyond the point where the search stopped are set
+    to infinity.
+
+    If reach is set, the solve is limited to a window extending that many
+    cells beyond the source patch's bounding box (cells outside it are
+    set to infinity). It comes from the pruning pre-pass and leaves the
+    results unchanged when max_cost is set.
+
+    If adaptive is set, the solve starts on a window padded by that many
+    cells and the padding is doubled (up to reach, if set) until the
+    window is certified: every target patch is reached at a cost no
+    greater than the smallest cost on the window's edge, or that edge is
+    beyond max_cost. Costs above the window's edge minimum are then
+    uncertain and set to infinity, so the cost distance surface is
+    partial, but the edges are those of a full raster solve.
+
+    Returns the windowed cost distance array, a list of edges, each a
+    tuple of (FROM_ID, TO_ID, COST, path) where path is the list of
+    (row, col) cells of the least cost path (or None if lcp is False),
+    and a dict of solve statistics: the (row0, col0, row1, col1) window
+    in the raster, its number of cells, the number of solves and the
+    solve time. Patch pairs without a viable connection, or beyond the
+    cutoff, are dropped.
+    """
+    start = time.perf_counter()
+
+    #Patches the solve must reach: the higher IDs (the tail of the index),
+    #or the targets
+    k = np.searchsorted(index.ids, patchID, side='right')
+    if targets is None:
+        wanted = index.ids > patchID
+    else:
+        wanted = np.isin(index.ids, targets)
+    targetCells = None
+    if settle:
+        if targets is not None:
+            targetCells = np.concatenate([index.patch_cells(toID) for toID in targets.tolist()]
+                                         + [index.cells[:0]])
+        else:
+            targetCells = index.cells[index.starts[k]:] if k < index.ids.size else index.cells[:0]
+
+    #Solve, growing the window until its results are certified. Without a
+    #cutoff every target must be inside the window, so start there.
+    pad = reach if adaptive is None else (adaptive if reach is None else min(adaptive, reach))
+    if adaptive is not None and max_cost is None and wanted.any():
+        box = index.bboxes[np.searchsorted(index.ids, patchID)]
+        far = index.bboxes[wanted]
+        pad = max(pad, (box[:2] - far[:, :2]).max(), (far[:, 2:] - box[2:]).max())
+    full = source_window(index, patchID, None)
+    solves = 0
+    while True:
+        window = source_window(index, patchID, pad)
+        if adaptive is not None and reach is None and \
+                2 * (window[2] - window[0]) * (window[3] - window[1]) > full[2] * full[3]:
+            #Not worth risking a second solve: use the whole raster
+            window = full
+        cd_window, stop_cost, traceback, offsets = _solve_window(patchID, index, arrCost, cellSize,
+                                                                 window, max_cost, targetCells)
+        mins, minCells = index.zonal_min(cd_window, window)
+        solves += 1
+        if adaptive is None or window == full:
+            break
+        edgeMin = min(boundary_min(cd_window, window, index.shape), stop_cost)
+        need = mins[wanted].max(initial=-np.inf)
+        if max_cost is not None:
+            need = min(need, max_cost)
+        if need <= edgeMin:
+            #Costs above the edge minimum might be lower through the outside
+            cd_window[cd_window > edgeMin] = np.inf
+            break
+        if reach is not None and pad >= reach:
+            break
+        pad = 2 * pad if reach is None else min(2 * pad, reach)
+    r0, c0, r1, c1 = window
+
+    #Keep the target patches that could be reached
+    keep = wanted & np.isfinite(mins)
+    toIDs = index.ids[keep].tolist()
+    costs = mins[keep].tolist()
+
+    #Least cost paths from the cell with the lowest cost in each patch,
+    #traced together and shifted back to raster coordinates
+    paths = [None] * len(toIDs)
+    if lcp and toIDs:
+        r, c = np.unravel_index(minCells[keep], index.shape)
+        ends = (r - r0) * (c1 - c0) + (c - c0)
+        paths = [path + (r0, c0) for path in trace_paths(traceback, offsets, ends)]
+    edges = [(patchID, toID, cost, path) for toID, cost, path in zip(toIDs, costs, paths)]
+
+    stats = dict(window=window, cells=(r1 - r0) * (c1 - c0), solves=solves,
+                 seconds=time.perf_counter() - start)
+    return cd_window, edges, stats
+
+
+#%% TILED SOLVER
+#Memory used per cell of a tile solve, in bytes: the cost and cost
+#distance windows, the graph of the window's cells and the search
+TILE_BYTES_PER_CELL = 270
+
+
+def tile_size(budget_mb):
+    """Side, in cells, of the tiles whose solves fit in a memory budget (MB)."""
+    side = math.isqrt(int(budget_mb * 2**20 / TILE_BYTES_PER_CELL)) - 2
+    return max(side, 16)
+
+
+def tile_graph(costs, cellSize, seeds, seedCosts):
+    """
+    Sparse graph of the cells of a window of the cost raster, with the
+    edges of an MCP_Geometric solve: each cell is linked to its 8
+    neighbors at the mean of their costs times the distance between them,
+    and impassable cells (negative or infinite cost) are left out. An extra
+    node, after the cells, is linked to each of the seed cells (flat
+    offsets into the window) at its current cost distance (seedCosts), so a
+    single search from that node continues a solve from all the costs
+    already known.
+    """
+    h, w = costs.shape
+    n = h * w
+    passable = np.isfinite(costs) & (costs >= 0)
+    cellIDs = np.arange(n, dtype=np.int32).reshape(h, w)
+    rows, cols, data = [], [], []
+    for dr, dc in _FORWARD:
+        a = (slice(0, h - dr), slice(max(-dc, 0), w - max(dc, 0)))
+        b = (slice(dr, h), slice(max(dc, 0), w - max(-dc, 0)))
+        linked = passable[a] & passable[b]
+        length = np.sqrt(np.sum((np.array([dr, dc], dtype=np.float64) * cellSize) ** 2))
+        rows.append(cellIDs[a][linked])
+        cols.append(cellIDs[b][linked])
+        data.append(0.5 * (costs[a][linked] + costs[b][linked]) * length)
+    rows.append(np.full(seeds.size, n, dtype=np.int32))
+    cols.append(seeds.astype(np.int32))
+    data.append(seedCosts)
+    from scipy.sparse import csr_matrix
+    return csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+                      shape=(n + 1, n + 1))
+
+
+class TiledSurface:
+    """
+    Cost distance surface of the whole raster, kept in a memory-mapped
+    scratch file (cd_<process id>.npy in folder) and solved one tile of
+    tile x tile cells at a time, so memory use is set by the tile size
+    rather than the raster size. One surface is reused for every source
+    patch a process solves.
+
+    Each tile is solved with a one cell halo, continuing from the costs
+    already known in it (see tile_graph); cells whose cost improves mark
+    the other tiles whose halo holds them for another solve. Tiles are
+    solved in order of the least improved cost in them, as cells are in
+    a single solve, until no tile is left to solve: the costs are then
+    those of a solve over the whole raster.
+
+    Tiles are only filled in (set to infinity) once a solve reaches them,
+    so solves stopped at a maximum cost only touch the tiles around their
+    source.
+    """
+
+    def __init__(self, arrCost, cellSize, tile, folder):
+        self.arrCost = arrCost
+        self.cellSize = cellSize
+        self.tile = tile
+        self.shape = arrCost.shape
+        self.tiles = (-(-self.shape[0] // tile), -(-self.shape[1] // tile))
+        self.path = os.path.join(folder, f"cd_{os.getpid()}.npy")
+        self.cd = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float64,
+                                            shape=self.shape)
+        self.touched = np.zeros(self.tiles, dtype=bool)
+
+    def close(self):
+        """Drop the scratch file."""
+        del self.cd
+        os.remove(self.path)
+
+    def _tile_of(self, cells):
+        """Flat index of the tile holding each cell (flat offsets)."""
+        rows, cols = np.divmod(cells, self.shape[1])
+        return (rows // self.tile) * self.tiles[1] + cols // self.tile
+
+    def _by_tile(self, cells):
+        """Order cells by tile; returns the order and each tile's bounds in it."""
+        tiles = self._tile_of(cells)
+        order = np.argsort(tiles, kind='stable')
+        return order, np.searchsorted(tiles[order], np.arange(self.touched.size + 1))
+
+    def _tiles_in(self, window):
+        """Flat indices of the tiles overlapping a (row0, col0, row1, col1) window."""
+        r0, c0, r1, c1 = window
+        ti = np.arange(r0 // self.tile, (r1 - 1) // self.tile + 1)
+        tj = np.arange(c0 // self.tile, (c1 - 1) // self.tile + 1)
+        return (ti[:, None] * self.tiles[1] + tj).ravel()
+
+    def _touch(self, tiles):
+        """Fill in the tiles not yet reached, at an infinite cost."""
+        T = self.tile
+        for t in tiles[~self.touched.ravel()[tiles]].tolist():
+            i, j = divmod(t, self.tiles[1])
+            self.cd[i*T:(i+1)*T, j*T:(j+1)*T] = np.inf
+        self.touched.ravel()[tiles] = True
+
+    def touched_cells(self):
+        """Number of cells in the tiles reached by the last solve."""
+        T = self.tile
+        rows = np.minimum(T, self.shape[0] - T * np.arange(self.tiles[0]))
+        cols = np.minimum(T, self.shape[1] - T * np.arange(self.tiles[1]))
+        return int(np.outer(rows, cols)[self.touched].sum())
+
+    def surface(self):
+        """The whole cost distance surface (a memory-mapped array)."""
+        self._touch(np.arange(self.touched.size))
+        return self.cd
+
+    def solve(self, sourceCells, targetCells, targetPatch, nTargets, max_cost=None,
+              settle=False):
+        """
+        Solve the cost distance from the source cells (flat offsets), up to
+        max_cost if set, and return the least cost to each of nTargets
+        target patches (infinite if not reached) and the number of tile
+        solves. targetCells are the target patches' cells and targetPatch
+        the number (0 to nTargets - 1) of the patch of each.
+
+        If settle is True, the solve stops as soon as the least cost to
+        every target patch is final: no tile left to solve holds an
+        improved cost below it. Costs above that may be partial.
+        """
+        from scipy.sparse import csgraph
+        T = self.tile
+        nRows, nCols = self.shape
+        nTileCols = self.tiles[1]
+        limit = np.inf if max_cost is None else max_cost
+        self.touched[:] = False
+        sourceOrder, sourceBounds = self._by_tile(sourceCells)
+        targetOrder, targetBounds = self._by_tile(targetCells)
+        patchMin = np.full(nTargets, np.inf)
+        queue, keys = [], {}
+
+        def cells_in(cells, order, bounds, window):
+            """Cells (as window rows and columns) of the tiles inside a window."""
+            r0, c0, r1, c1 = window
+            picked = np.concatenate([order[bounds[t]:bounds[t+1]]
+                                     for t in self._tiles_in(window).tolist()] + [order[:0]])
+            rows, cols = np.divmod(cells[picked], nCols)
+            inside = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+            return rows[inside] - r0, cols[inside] - c0, picked[inside]
+
+        def mark(rows, cols, values, solved=-1):
+            """Queue the tiles whose halo holds improved cells, keyed by their least cost."""
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    r, c = rows + dr, cols + dc
+                    inside = (r >= 0) & (r < nRows) & (c >= 0) & (c < nCols)
+                    tiles = (r[inside] // T) * nTileCols + c[inside] // T
+                    vals = values[inside]
+                    order = np.lexsort((vals, tiles))
+                    tiles, vals = tiles[order], vals[order]
+                    first = np.r_[True, tiles[1:] != tiles[:-1]] if tiles.size else tiles.astype(bool)
+                    for t, key in zip(tiles[first].tolist(), vals[first].tolist()):
+                        if t != solved and key < keys.get(t, np.inf):
+                            keys[t] = key
+                            heapq.heappush(queue, (key, t))
+
+        #Start from the source cells, at no cost
+        self._touch(np.unique(self._tile_of(sourceCells)))
+        self.cd.reshape(-1)[sourceCells] = 0
+        rows, cols = np.divmod(sourceCells, nCols)
+        mark(rows, cols, np.zeros(sourceCells.size))
+
+        solves = 0
+        while queue:
+            key, t = heapq.heappop(queue)
+            if keys.get(t) != key:
+                continue
+            if settle and key >= patchMin.max(initial=-np.inf):
+                break
+            del keys[t]
+            i, j = divmod(t, nTileCols)
+            window = (max(i*T - 1, 0), max(j*T - 1, 0),
+                      min((i+1)*T + 1, nRows), min((j+1)*T + 1, nCols))
+            r0, c0, r1, c1 = window
+            self._touch(self._tiles_in(window))
+
+            #Solve the tile and its halo, with the source cells at no cost
+            costs = np.array(self.arrCost[r0:r1, c0:c1], dtype=np.float64)
+            rows, cols, _ = cells_in(sourceCells, sourceOrder, sourceBounds, window)
+            costs[rows, cols] = 0
+            cd = np.array(self.cd[r0:r1, c0:c1])
+            seeds = np.flatnonzero(np.isfinite(cd))
+            g = tile_graph(costs, self.cellSize, seeds, cd.ravel()[seeds])
+            del costs
+            dist = csgraph.dijkstra(g, directed=False, indices=g.shape[0] - 1,
+                                    limit=np.nextafter(limit, np.inf))[:-1].reshape(cd.shape)
+            del g
+            dist[dist > limit] = np.inf
+            improved = dist < cd
+            solves += 1
+            if not improved.any():
+                continue
+            cd[improved] = dist[improved]
+            self.cd[r0:r1, c0:c1] = cd
+
+            #Only cells near the edge of the window lie in other tiles' halos
+            improved[2:-2, 2:-2] = False
+            rows, cols = np.nonzero(improved)
+            mark(rows + r0, cols + c0, cd[rows, cols], solved=t)
+
+            #Update the least cost to the target patches in the window
+            rows, cols, picked = cells_in(targetCells, targetOrder, targetBounds, window)
+            np.minimum.at(patchMin, targetPatch[picked], cd[rows, cols])
+        return patchMin, solves
+
+
+def solve_source_tiled(patchID, index, surface, max_cost=None, settle=False, targets=None):
+    """
+    Out-of-core version of solve_source: solve the cost distance from one
+    source patch on a TiledSurface, to the patches with a higher ID or
+    the target patches if given, up to max_cost and/or until every target
+    is reached (settle). Least cost paths are not traced.
+
+    Returns the surface's cost distance array (over the whole raster), the
+    edges (with no paths) and the solve statistics (the window is the
+    whole raster, and cells the number of cells in the tiles reached).
+    """
+    start = time.perf_counter()
+    if targets is None:
+        wanted = index.ids > patchID
+    else:
+        wanted = np.isin(index.ids, targets)
+    wantedIDs = np.flatnonzero(wanted)
+    targetCells = np.concatenate([index.cells[index.starts[k]:index.starts[k] + index.counts[k]]
+                                  for k in wantedIDs.tolist()] + [index.cells[:0]])
+    targetPatch = np.repeat(np.arange(wantedIDs.size), index.counts[wantedIDs])
+    mins, solves = surface.solve(index.patch_cells(patchID), targetCells, targetPatch,
+                                 wantedIDs.size, max_cost, settle)
+    keep = np.isfinite(mins)
+    edges = [(patchID, toID, cost, None)
+             for toID, cost in zip(index.ids[wantedIDs[keep]].tolist(), mins[keep].tolist())]
+    stats = dict(window=source_window(index, patchID, None),
+                 cells=surface.touched_cells(), solves=solves,
+                 seconds=time.perf_counter() - start)
+    return surface, edges, stats
+
+
+def _process_source(patchID, index, arrCost, stack, settings):
+    """Solve one source patch, write its layer to the stack, return its edges and stats."""
+    settings = dict(settings)
+    targets = settings.pop('targets', None)
+    if targets is not None:
+        settings['targets'] = targets[patchID]
+    #Without a layer to keep, the solve can stop once its targets are reached
+    keepLayer = stack is not None and patchID in stack
+    if not keepLayer:
+        settings['settle'] = True
+    if 'tile' in settings:
+        #Out of core: one tiled surface per process, reused for every source
+        if 'surface' not in _shared:
+            _shared['surface'] = TiledSurface(arrCost, settings['cellSize'],
+                                              settings['tile'], settings['scratch'])
+        surface, edges, stats = solve_source_tiled(patchID, index, _shared['surface'],
+                                                   settings.get('max_cost'),
+                                                   settings.get('settle', False),
+                                                   settings.get('targets'))
+        if keepLayer:
+            stack.write(patchID, surface.surface(), stats['window'])
+        return edges, stats
+    cd_window, edges, stats = solve_source(patchID, index, arrCost, **settings)
+    if keepLayer:
+        stack.write(patchID, cd_window, stats['window'])
+    return edges, stats
+
+
+def _solve_batch(batch):
+    """Worker task: solve each source patch in a batch."""
+    results = []
+    for patchID in batch:
+        edges, stats = _process_source(patchID,
+                                       _shared['index'],
+                                       _shared['arrCost'],
+                                       _shared['stack'],
+                                       _shared['settings'])
+        results.append((patchID, edges, stats))
+    if _shared['stack'] is not None:
+        _shared['stack'].close()
+    return results
+
+
+def _set_executable():
+    """
+    Script tools run inside ArcGISPro.exe; point multiprocessing at the
+    Python interpreter of the active environment instead.
+    """
+    if os.path.basename(sys.executable).lower() == 'arcgispro.exe':
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+
+
+def iter_sources(arrPatch, arrCost, cellSize, patchIDs, lcp=False, workers=1,
+                 max_cost=None, settle=False, stack=None, reach=None, targets=None,
+                 adaptive=None, tile=None, scratch=None):
+    """
+    Generator yielding (patchID, edges, stats) for each source patch, in
+    the order of patchIDs, whatever the number of workers. See
+    solve_source for the lcp, max_cost and settle options and the stats.
+
+    reach (see reach_cells) limits each solve to a window around the
+    source, and targets, a dictionary of patch ID arrays keyed by source
+    (see schedule_sources), sets the patches each source is solved to.
+    adaptive sets the initial padding of adaptively grown solve windows
+    (see solve_source).
+
+    If stack (a CostDistanceStack.StackWriter, already created) is given,
+    the cost distance layer of each source it holds is written to it as
+    soon as it is computed. Other sources stop as soon as their targets
+    are reached (as with settle).
+
+    With workers > 1, the patch and cost arrays are placed in shared
+    memory once and the source patches are spread over a process pool in
+    batches; only the edges of each batch are sent back.
+
+    If tile is set, sources are solved out of core (see TiledSurface), on
+    tiles of tile x tile cells, each process keeping its cost distance
+    surface in a scratch file in a temporary folder made in scratch
+    (default: the system's temporary folder). Memory-mapped patch and cost
+    arrays are then shared by file rather than copied. lcp, reach and
+    adaptive do not apply.
+    """
+    patchIDs = list(patchIDs)
+    settings = dict(cellSize=cellSize, lcp=lcp, max_cost=max_cost, settle=settle,
+                    adaptive=adaptive)
+    if reach is not None:
+        settings['reach'] = reach
+    if targets is not None:
+        settings['targets'] = targets
+    if tile is not None:
+        settings.update(tile=tile, scratch=tempfile.mkdtemp(prefix='cd_', dir=scratch))
+
+    try:
+        yield from _iter_solved(arrPatch, arrCost, patchIDs, workers, stack, settings)
+    finally:
+        if tile is not None:
+            if 'surface' in _shared:
+                _shared.pop('surface').close()
+            shutil.rmtree(settings['scratch'], ignore_errors=True)
+
+
+def _iter_solved(arrPatch, arrCost, patchIDs, workers, stack, settings):
+    """Solve the sources in this process or a pool of workers (see iter_sources)."""
+    #Single process: solve in place
+    if workers <= 1 or len(patchIDs) < 2:
+        index = PatchIndex(arrPatch)
+        for patchID in patchIDs:
+            yield (patchID,) + _process_source(patchID, index, arrCost, stack, settings)
+        if stack is not None:
+            stack.close()
+        return
+
+    #Split sources into batches; several per worker to balance the load
+    batchSize = max(1, math.ceil(len(patchIDs) / (workers * 4)))
+    batches = [patchIDs[i:i+batchSize] for i in range(0, len(patchIDs), batchSize)]
+
+    _set_executable()
+    shmPatch, patchSpec = share_array(arrPatch)
+    shmCost, costSpec = share_array(arrCost)
+    try:
+        with multiprocessing.Pool(workers, initializer=_init_worker,
+                                  initargs=(patchSpec, costSpec, settings, stack)) as pool:
+            #imap returns batches in submission order
+            for results in pool.imap(_solve_batch, batches):
+                for result in results:
+                    yield result
+    finally:
+        for shm in (shmPatch, shmCost):
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+
+#%% CORRIDORS
+class PathDensity:
+    """
+    Counts of the least cost paths crossing each raster cell (a corridor
+    raster), accumulated one source patch at a time so no path has to be
+    kept once it is counted.
+
+    Besides the count of all paths, a count is kept for each cost in
+    max_costs, of the paths whose least cost is no more than it.
+
+    Usage:
+    >>> density = PathDensity(arrPatch.shape, max_costs=[2000])
+    >>> density.add(edges)          # (FROM_ID, TO_ID, COST, path) tuples
+    >>> density.grid, density.grids[2000]
+    """
+
+    def __init__(self, shape, max_costs=()):
+        self.shape = tuple(shape)
+        self.grid = np.zeros(self.shape, dtype=np.int32)
+        self.grids = {c: np.zeros(self.shape, dtype=np.int32) for c in max_costs}
+
+    def add(self, edges):
+        """Add the paths of a list of (FROM_ID, TO_ID, COST, path) edges."""
+        paths = [(cost, path) for _, _, cost, path in edges if path is not None and len(path)]
+        if not paths:
+            return
+        lengths = np.array([len(path) for _, path in paths])
+        cells = np.concatenate([path for _, path in paths])
+        flat = np.ravel_multi_index((cells[:, 0], cells[:, 1]), self.shape)
+        np.add.at(self.grid.ravel(), flat, 1)
+        costs = np.repeat([cost for cost, _ in paths], lengths)
+        for max_cost, grid in self.grids.items():
+            np.add.at(grid.ravel(), flat[costs <= max_cost], 1)
+
+
+#%% MINIMUM PLANAR GRAPH
+#Offsets to the neighbors that follow a cell in row-major order, so each
+#pair of neighboring cells is visited once
+_FORWARD = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def allocate(traceback, offsets):
+    """
+    Follow the traceback of a multi-source solve (see trace_paths) from
+    every cell back towards the start cell its least cost path comes from,
+    by pointer jumping: each pass doubles the number of steps every
+    pointer skips, so paths of any length are resolved in a logarithmic
+    number of vectorized passes.
+
+    Returns three flat arrays: the predecessor of each cell, the start
+    cell of its path (-1 where unreached), and the cell of its path just
+    after the start cell (the cell itself at start cells).
+    """
+    nCols = traceback.shape[1]
+    steps = offsets[:, 0].astype(np.int64) * nCols + offsets[:, 1]
+    tb = traceback.ravel()
+    cells = np.arange(tb.size)
+    moving = tb >= 0
+    pred = cells.copy()
+    pred[moving] -= steps[tb[moving]]
+    #Pointers stop at the cells whose predecessor is a start cell
+    ptr = np.where(moving & (tb[pred] >= 0), pred, cells)
+    active = np.flatnonzero(ptr != cells)
+    while active.size:
+        ptr[active] = ptr[ptr[active]]
+        active = active[ptr[active] != ptr[ptr[active]]]
+    start = np.where(moving, pred[ptr], cells)
+    start[tb < -1] = -1
+    return pred, start, ptr
+
+
+def planar_edges(arrPatch, arrCost, cellSize, lcp=False, max_cost=None, nodata=-9999):
+    """
+    Edges of the minimum planar graph of the patches (Fall et al. 2007),
+    from one cost distance solve seeded from every patch at once.
+
+    Each cell is allocated to the patch it is cheapest to reach from (a
+    cost allocation, or Voronoi, map). Two patches are linked where their
+    allocation regions meet, at the cost of the cheapest path across that
+    boundary: the cost distance from the first patch to a cell on one
+    side, the step to a neighbor on the other, and that neighbor's cost
+    distance from the second patch. As in the pairwise solves (from the
+    lower ID patch), half the cost of the cell where the path enters the
+    higher ID patch is added. Edge costs are then never below those of
+    the pairwise list, and equal to them when the least cost path runs
+    through the two regions only (and enters the higher ID patch at the
+    same cell).
+
+    If max_cost is set, the solve stops once it passes that cost and
+    edges beyond it are dropped. If lcp is True, each edge's least cost
+    path is traced (from FROM_ID to TO_ID).
+
+    Returns the edges, as (FROM_ID, TO_ID, COST, path) tuples in order of
+    FROM_ID then TO_ID, the allocation array (patch IDs, nodata where no
+    patch is reached), and a dict of statistics: the number of boundary
+    cell pairs and the solve and total time.
+    """
+    t0 = time.perf_counter()
+    index = PatchIndex(arrPatch, nodata)
+    shape = arrPatch.shape
+
+    #Seed the solve from every patch cell
+    arrCostMod = np.array(arrCost, dtype=np.float64)
+    arrCostMod.ravel()[index.cells] = 0
+    cost_graph = mcp_solver(arrCostMod, cellSize, max_cost)
+    starts = np.column_stack(np.unravel_index(index.cells, shape))
+    cd, traceback = cost_graph.find_costs(starts=starts)
+    solveSeconds = time.perf_counter() - t0
+    if max_cost is not None:
+        cd[cd > max_cost] = np.inf
+    offsets = np.asarray(cost_graph.offsets)
+
+    #Allocate each cell to the patch of its start cell
+    pred, start, anchor = allocate(traceback, offsets)
+    reached = (start >= 0) & np.isfinite(cd.ravel())
+    alloc = np.full(arrPatch.size, nodata, dtype=np.int32)
+    alloc[reached] = arrPatch.ravel()[start[reached]]
+    alloc = alloc.reshape(shape)
+
+    #Half the cost of the patch cell each path starts at, times its first step
+    lengths = np.hypot(*offsets.T.astype(np.float64)) * cellSize
+    costFlat = np.asarray(arrCost, dtype=np.float64).ravel()
+    #Impassable patch cells cannot be entered (only left, from the source patch)
+    costFlat = np.where(costFlat < 0, np.inf, costFlat)
+    tbFlat = traceback.ravel()
+    entry = np.zeros(arrPatch.size)
+    first = np.flatnonzero(reached & (anchor == np.arange(arrPatch.size)) & (tbFlat >= 0))
+    entry[first] = costFlat[pred[first]] / 2 * lengths[tbFlat[first]]
+
+    #Cheapest link across each boundary between allocation regions
+    nRows, nCols = shape
+    cdFlat, costModFlat, allocFlat = cd.ravel(), arrCostMod.ravel(), alloc.ravel()
+    cellIDs = np.arange(arrPatch.size).reshape(shape)
+    links = []
+    for dr, dc in _FORWARD:
+        p = cellIDs[:nRows - dr, max(0, -dc):nCols - max(0, dc)].ravel()
+        q = p + dr * nCols + dc
+        ap, aq = allocFlat[p], allocFlat[q]
+        keep = (ap != aq) & (ap != nodata) & (aq != nodata)
+        p, q = p[keep], q[keep]
+        #Orient each link from the lower to the higher patch ID
+        swap = allocFlat[p] > allocFlat[q]
+        p[swap], q[swap] = q[swap], p[swap]
+        length = cellSize * math.hypot(dr, dc)
+        cost = cdFlat[p] + cdFlat[q] + (costModFlat[p] + costModFlat[q]) / 2 * length
+        #The path enters the higher ID patch at q itself, or at the start of q's path
+        atStart = start[q] == q
+        cost += np.where(atStart, costFlat[q] / 2 * length, entry[anchor[q]])
+        links.append((p, q, cost))
+    p, q, cost = (np.concatenate(x) for x in zip(*links))
+    if not p.size:
+        #No two allocation regions meet (one patch, or patches cut off from each other)
+        stats = dict(boundary=0, solve_seconds=solveSeconds, seconds=time.perf_counter() - t0)
+        return [], alloc, stats
+    fromIDs, toIDs = allocFlat[p].astype(np.int64), allocFlat[q].astype(np.int64)
+    order = np.lexsort((cost, toIDs, fromIDs))
+    best = order[np.r_[True, (np.diff(fromIDs[order]) != 0) | (np.diff(toIDs[order]) != 0)]]
+    best = best[np.isfinite(cost[best])]
+    if max_cost is not None:
+        best = best[cost[best] <= max_cost]
+
+    paths = [None] * best.size
+    if lcp and best.size:
+        traced = trace_paths(traceback, offsets, np.concatenate([p[best], q[best]]))
+        paths = [np.concatenate([a, b[::-1]]) for a, b in zip(traced[:best.size], traced[best.size:])]
+    edges = list(zip(fromIDs[best].tolist(), toIDs[best].tolist(), cost[best].tolist(), paths))
+    stats = dict(boundary=p.size, solve_seconds=solveSeconds, seconds=time.perf_counter() - t0)
+    return edges, alloc, stats
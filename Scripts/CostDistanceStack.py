@@ -0,0 +1,168 @@
+'''
+Cost Distance Stack
+Spring 2021 - John.Fay@duke.edu
+
+Writing and reading the stack of cost distance arrays produced by
+CreateEdgeList_v2.py (one layer per source patch, in ascending patch ID
+order).
+
+Two storage formats are supported:
+  npy     - a single 3D .npy file, preallocated on disk and filled one
+            layer at a time through a memory map. Single layers can be
+            memory-mapped back without loading the whole stack.
+  chunked - a folder holding one compressed .npz file per patch layer
+            (layer_<patchID>.npz). Much smaller on disk; each layer is
+            decompressed on its own when read.
+
+Both formats store the patch IDs of the layers alongside the stack
+(<stack>.patchIDs.npy, or patchIDs.npy inside the chunked folder).
+
+Layers can be stored as float64 (default) or float32, for all source
+patches or only some of them.
+'''
+
+import os
+import numpy as np
+
+FORMATS = ('npy', 'chunked')
+
+
+def patchid_path(path):
+    """File holding the patch IDs of the layers of a stack."""
+    if os.path.isdir(path) or not path.lower().endswith('.npy'):
+        return os.path.join(path, 'patchIDs.npy')
+    return os.path.splitext(path)[0] + '.patchIDs.npy'
+
+
+class StackWriter:
+    """
+    Writes cost distance layers to disk as soon as they are computed.
+
+    The writer only holds the file settings, so it can be passed to worker
+    processes; each process opens its own memory map on first write.
+    """
+
+    def __init__(self, path, patchIDs, shape, dtype='float64', fmt='npy'):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown stack format: {fmt}")
+        self.path = path
+        self.patchIDs = list(patchIDs)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.fmt = fmt
+        self._layers = {p:i for i,p in enumerate(self.patchIDs)}
+        self._mm = None
+
+    def __getstate__(self):
+        #Memory maps are not passed between processes
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
+    def create(self, resume=False):
+        """
+        Preallocate the stack on disk (call once, before writing). When
+        resuming, an existing stack of the same size and type is kept so
+        the layers already written are not lost.
+        """
+        if self.fmt == 'npy':
+            shape = (len(self.patchIDs),) + self.shape
+            kept = False
+            if resume and os.path.isfile(self.path):
+                mm = np.load(self.path, mmap_mode='r')
+                kept = mm.shape == shape and mm.dtype == np.dtype(self.dtype)
+                del mm
+            if not kept:
+                mm = np.lib.format.open_memmap(self.path, mode='w+', dtype=self.dtype,
+                                               shape=shape)
+                del mm
+        else:
+            os.makedirs(self.path, exist_ok=True)
+        np.save(patchid_path(self.path), np.array(self.patchIDs))
+        return self
+
+    def __contains__(self, patchID):
+        return patchID in self._layers
+
+    def layer_path(self, patchID):
+        """File holding one layer in the chunked format."""
+        return os.path.join(self.path, f'layer_{patchID}.npz')
+
+    def write(self, patchID, cd_array, window=None):
+        """
+        Write the cost distance layer of one source patch. If window, a
+        (row0, col0, row1, col1) box, is given, cd_array only covers that
+        window and the rest of the layer is set to infinity.
+        """
+        if window is not None and cd_array.shape != self.shape:
+            r0, c0, r1, c1 = window
+            layer = np.full(self.shape, np.inf, dtype=self.dtype)
+            layer[r0:r1, c0:c1] = cd_array
+            cd_array = layer
+        if self.fmt == 'npy':
+            if self._mm is None:
+                self._mm = np.load(self.path, mmap_mode='r+')
+            self._mm[self._layers[patchID]] = cd_array
+            self._mm.flush()
+        else:
+            np.savez_compressed(self.layer_path(patchID),
+                                layer=cd_array.astype(self.dtype, copy=False))
+
+    def close(self):
+        """Flush and release the memory map, if open."""
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+
+
+class CostDistanceStack:
+    """
+    Read access to a cost distance stack written by StackWriter.
+
+    For the npy format the stack is memory-mapped, so reading one layer
+    only touches that layer on disk. Layers are looked up by the patch IDs
+    saved with the stack; for an npy stack written without them, pass the
+    patch IDs (ascending, as used when the stack was written), otherwise
+    layers are looked up by position.
+
+    Usage:
+    >>> stack = CostDistanceStack('edgelist.npy')
+    >>> cd_array = stack.layer(12)
+    """
+
+    def __init__(self, path, patchIDs=None):
+        self.path = path
+        if os.path.isdir(path):
+            self.fmt = 'chunked'
+            self.patchIDs = np.load(patchid_path(path)).tolist()
+            self._mm = None
+        else:
+            self.fmt = 'npy'
+            self._mm = np.load(path, mmap_mode='r')
+            if patchIDs is None and os.path.isfile(patchid_path(path)):
+                patchIDs = np.load(patchid_path(path)).tolist()
+            elif patchIDs is None:
+                patchIDs = range(self._mm.shape[0])
+            self.patchIDs = list(patchIDs)
+        self._layers = {p:i for i,p in enumerate(self.patchIDs)}
+
+    def __len__(self):
+        return len(self.patchIDs)
+
+    def __contains__(self, patchID):
+        return patchID in self._layers
+
+    def layer(self, patchID):
+        """Return the cost distance array of one source patch."""
+        if self.fmt == 'npy':
+            return self._mm[self._layers[patchID]]
+        with np.load(os.path.join(self.path, f'layer_{patchID}.npz')) as f:
+            return f['layer']
+
+    def __getitem__(self, patchID):
+        return self.layer(patchID)
+
+    def layers(self):
+        """Iterate over (patchID, cost distance array) pairs, one at a time."""
+        for patchID in self.patchIDs:
+            yield patchID, self.layer(patchID)
@@ -10,6 +10,14 @@ Optionally it will also produce a 3D stacked numpy array comprised
 of a layer for each patch (D1) and the least cost distance to
 that patch for each pixel (D2/3)
 
+Rasters are read through RasterIO, so GeoTIFF and .npy rasters need no
+ArcGIS. The options (parallel workers, cost cutoffs and pruning, the
+stacked array format, --resume, corridor rasters, --mpg, --tiled) are
+described in the README and in the --help text.
+
+Usage: CreateEdgeList_v2.py <patch raster> <cost raster> <edge list csv>
+           [<least cost path feature class>] [options]
+
 Spring 2021 - John.Fay@duke.edu
 '''
 
@@ -17,174 +25,470 @@ Spring 2021 - John.Fay@duke.edu
 #%% SET UP
 
 #Import libraries
-import arcpy
+import os, sys, argparse, shutil, tempfile
 import numpy as np
-import pandas as pd
-from skimage import graph
-from arcgis import GIS, GeoAccessor, geometry
-
-#Initialize the ArcGIS API "GIS" object
-gis = GIS('home')
-
-# Get input datasets: Patches and CostSurface
-debug = False
-if debug:
-    orig_patchRaster = '..\\Data\\ENH_LCP_ModelInputs_Final2019.gdb\\S_Patches_60ha'
-    orig_costRaster = '..\\Data\\ENH_LCP_ModelInputs_Final2019.gdb\\S_CostSurface'
-    edgeListFN = '..\\Scratch\\edgelist4.csv'
-    lcp_featureclass = edgeListFN.replace('.csv','.shp')
-    arcpy.env.overwriteOutput = True
-
-else:
-    orig_patchRaster = arcpy.GetParameterAsText(0)
-    orig_costRaster = arcpy.GetParameterAsText(1)
-    edgeListFN = arcpy.GetParameterAsText(2)
-    lcp_featureclass = arcpy.GetParameterAsText(3)
-
-# Subset the cost raster to match dimensions of the patch raster
-arcpy.env.cellSize = orig_patchRaster
-arcpy.env.extent = orig_patchRaster
-arcpy.env.snapRaster = orig_patchRaster
+
+import RasterIO
+from CostDistanceStack import StackWriter
+from EdgeList import EdgeTable, EdgeCheckpoint, CSV_TOLERANCE, binary_path, load_edges
+from FeatureWriter import cells_to_xy, open_writer
 
 
 #%% FUNCTIONS
 
 #Message function: shows messages locally and in ArcGIS Pro
 def msg(txt):
-    print(txt)
-    arcpy.AddMessage(txt)
+    RasterIO.add_message(txt)
     return
 
-#Convert row-column values to geographic coordinates
-def to_xy(row,col):
-    x_geom = extent.upperLeft.X + (col * cellSize) 
-    y_geom = extent.upperLeft.Y - (row * cellSize) 
-    return [x_geom,y_geom]
-
-#%% Subset the cost raster to match the patch raster
-msg("Subsetting rasters")
-costRaster = arcpy.sa.ExtractByRectangle(orig_costRaster, orig_patchRaster, "INSIDE")
-patchRaster= arcpy.sa.ExtractByRectangle(orig_patchRaster, costRaster, "INSIDE")
-
-#%% Get the spatial reference, extent, and lower left coordinates
-sr = arcpy.Describe(patchRaster).spatialReference
-cellSize = arcpy.Describe(patchRaster).meanCellWidth
-extent = arcpy.Describe(patchRaster).extent
-llCorner = extent.lowerLeft
-
-#%% Create arrays of the patch and core rasters
-msg("Converting rasters to NumPy arrays")
-arrPatch = arcpy.RasterToNumPyArray(patchRaster,
-                                    lower_left_corner=llCorner,
-                                    nodata_to_value=-9999)
-
-arrCost = arcpy.RasterToNumPyArray(costRaster,
-                                   lower_left_corner=llCorner,
-                                   nodata_to_value=-9999)
-                                   
-
-#Check that arrays are the same size
-if arrPatch.shape != arrCost.shape:
-    msg("Input rasters must be of same size")
-    sys.exit[0]
-
-#%% Create a list of patchIDs
-patchIDs = np.unique(arrPatch).tolist()
-patchIDs.remove(-9999)
-msg(f"{len(patchIDs)} patches to process")
-
-#%% Initialize the output dataframe and CostDistArrays list
-df_patches = pd.DataFrame(columns = ['FROM_ID','TO_ID','COST','geometry'])
-costDistArrays = []
-
-#%% Initialize the progressor
-step = 0
-steps = len(patchIDs)
-arcpy.SetProgressor("step", "Computing Cost Distances...",step,steps,1)
-
-#%% Loop through each patch and compute its cost distance to all other patches
-for patchID in patchIDs:
-    step += 1
-    arcpy.SetProgressorLabel("Patch {} of {} ".format(step,steps))
-
-    #Reclassify cost in source patch cells to zero & set no data to high cost
-    arrCostMod = arrCost.copy()
-    arrCostMod[arrPatch == patchID] = 0
-    #arrCostMod[arrCostMod == -9999] = arrCostMod.max() * 10000
-
-    #Create the MCP object (Geometric accounts for diagonals)
-    cost_graph = graph.MCP_Geometric(arrCostMod, sampling=(cellSize, cellSize))
-
-    #Get the index of a cell in the current patch ID
-    i,j = np.where(arrPatch == patchID)
-    startCells = list(zip(i,j))
-
-    #Compute cost distance and traceback arrays from a source
-    cd_array = cost_graph.find_costs(starts=startCells)[0]
-    
-    #Process all the to-patches
-    for toID in patchIDs:
-        if toID > patchID:
-            print(".",end="")
-            #--Extract the cost distance between patches--
-            least_cost_distance = cd_array[arrPatch == toID].min()
-            
-            #--Skip if no LCP was found
-            if least_cost_distance == float('inf'): continue
-            
-            #--Compute the least cost path polyline--
-            #Step 1. Find the cell[s] with the lowest cost
-            rowMin,colMin = np.where(cd_array == least_cost_distance)
-            
-            ###---IF LCP FEATURES ARE REQUESTED---
-            if lcp_featureclass:
-                #Step 2. Compute the least cost path (traceback) from this cell
-                lcp_coords = cost_graph.traceback((rowMin[0],colMin[0]))
-                #Step 3. Convert image coords to geographic coords
-                lcp_coords_geog = [to_xy(r,c) for r,c in lcp_coords]
-                #Step 4. Construct a linestring from the coordinates
-                the_linestring = {"paths":[lcp_coords_geog],
-                                  "spatialReference":{"wkid":sr.factoryCode}}
-                #Step 5. Construct a PolyLine geometry from the linestring
-                the_polyline = geometry.Polyline(the_linestring)
-                
-                #--Add the data to the dataframe
-                df_patches = df_patches.append({
-                    'FROM_ID': patchID, 
-                    'TO_ID': toID,
-                    'COST': least_cost_distance,
-                    'geometry': the_polyline},ignore_index=True)
-            else:
-                #--Add the data to the dataframe,w/o geometry
-                df_patches = df_patches.append({
-                    'FROM_ID': patchID, 
-                    'TO_ID': toID,
-                    'COST': least_cost_distance},ignore_index=True)
-            
-    #Add arrays to arrLists
-    costDistArrays.append(cd_array)
-    arcpy.SetProgressorPosition()
-
-#%% Clean up
-
-#Convert dataframe to spatial dataframe
-if lcp_featureclass:
-    arcpy.SetProgressor("default","Converting features to a spatial dataframe")
-    print("Converting to spatial dataframe")
-    sdf_patches = GeoAccessor.from_df(df_patches, geometry_column='geometry')
-    
-    #Save as a feature class
-    arcpy.SetProgressor("default",f"Saving least cost paths to {lcp_featureclass}")
-    print(f"Saving least cost paths to {lcp_featureclass}")
-    sdf_patches.spatial.to_featureclass(lcp_featureclass)
-
-#Write the edges to the edgeListFN
-msg(f"Saving Edges to {edgeListFN}")
-df_patches[['FROM_ID','TO_ID','COST']].to_csv(edgeListFN,float_format=("%2.4f"),index=False)
-
-#Write out cost surface arrays
-msg("Stacking arrays")
-arrStack = np.stack(costDistArrays)
-
-msg(f"Saving Cost Distance Arrays to {edgeListFN}")
-np.save(edgeListFN.replace("csv","npy"),arrStack)
+#Convert an (n, 2) array of row-column values to geographic coordinates
+def to_xy(cells):
+    return cells_to_xy(cells, grid.left, grid.top, grid.cellSize)
+
+#Name of the corridor raster counting paths up to a cost
+def corridor_path(corridorRaster, max_cost):
+    base, ext = os.path.splitext(corridorRaster)
+    return f"{base}_{max_cost:g}".replace('.', '_') + ext
+
+#Save an array as a raster aligned with the patch raster
+def save_raster(arr, path):
+    RasterIO.get_backend(path).write(arr, path, grid)
+
+#Write the least cost paths of a list of edges to a feature writer
+def write_paths(writer, edges):
+    for fromID, toID, cost, path in edges:
+        writer.write(fromID, toID, cost, to_xy(() if path is None else path))
+
+#Save the least cost paths, corridor rasters and edge list
+def save_outputs(edgeTable, density, lcp_featureclass, corridorRaster, edgeListFN, binary_edges):
+    #Shapefiles and GeoPackages are streamed to disk one path at a time
+    if lcp_featureclass.lower().endswith(('.shp', '.gpkg')):
+        RasterIO.set_progressor("default",f"Saving least cost paths to {lcp_featureclass}")
+        print(f"Saving least cost paths to {lcp_featureclass}")
+        with open_writer(lcp_featureclass, grid.wkid, grid.wkt) as writer:
+            for i in range(len(edgeTable)):
+                write_paths(writer, [(edgeTable.from_id[i], edgeTable.to_id[i], edgeTable.cost[i],
+                                      edgeTable.path(i))])
+
+    #Other feature classes (e.g. in a geodatabase) go through a spatial dataframe
+    elif lcp_featureclass:
+        df_patches = edgeTable.to_dataframe()
+        from arcgis import GIS, GeoAccessor, geometry
+        #Initialize the ArcGIS API "GIS" object
+        gis = GIS('home')
+        RasterIO.set_progressor("default","Converting features to a spatial dataframe")
+        print("Converting to spatial dataframe")
+        polylines = []
+        for i in range(len(edgeTable)):
+            #Convert image coords to geographic coords
+            lcp_coords_geog = to_xy(edgeTable.path(i)).tolist()
+            #Construct a PolyLine geometry from the linestring
+            the_linestring = {"paths":[lcp_coords_geog],
+                              "spatialReference":{"wkid":grid.wkid}}
+            polylines.append(geometry.Polyline(the_linestring))
+        df_patches['geometry'] = polylines
+        sdf_patches = GeoAccessor.from_df(df_patches, geometry_column='geometry')
+        
+        #Save as a feature class
+        RasterIO.set_progressor("default",f"Saving least cost paths to {lcp_featureclass}")
+        print(f"Saving least cost paths to {lcp_featureclass}")
+        sdf_patches.spatial.to_featureclass(lcp_featureclass)
+
+    #Save the corridor rasters
+    if density is not None:
+        msg(f"Saving least cost path corridors to {corridorRaster}")
+        save_raster(density.grid, corridorRaster)
+        for corridor_cost, arr in density.grids.items():
+            msg(f"Saving corridors of paths up to {corridor_cost:g} to {corridor_path(corridorRaster, corridor_cost)}")
+            save_raster(arr, corridor_path(corridorRaster, corridor_cost))
+
+    #Write the edges to the edgeListFN
+    msg(f"Saving Edges to {edgeListFN}")
+    edgeTable.to_csv(edgeListFN)
+    if binary_edges:
+        msg(f"Saving binary edge list to {binary_path(edgeListFN)}")
+        edgeTable.save(binary_path(edgeListFN))
+
+#Compute the minimum planar graph edges into the edge table
+def planar_graph(arrPatch, arrCost, edgeTable, trace, density, keepPaths,
+                 max_cost, allocationRaster, validateFN, edgeListFN):
+    import CostDistance
+    msg("Computing the minimum planar graph from one cost distance solve from all patches")
+    edges, alloc, stats = CostDistance.planar_edges(arrPatch, arrCost, grid.cellSize,
+                                                    lcp=trace, max_cost=max_cost)
+    msg(f"{len(edges)} edges from {stats['boundary']} boundary cell pairs; solved in "
+        f"{stats['solve_seconds']:.1f} s ({stats['seconds']:.1f} s in all)")
+    #Count the paths in the corridor raster, keeping them only for features
+    if density is not None:
+        density.add(edges)
+        if not keepPaths:
+            edges = [(fromID, toID, cost, None) for fromID, toID, cost, _ in edges]
+    edgeTable.add_edges(edges)
+    if allocationRaster:
+        msg(f"Saving the cost allocation to {allocationRaster}")
+        save_raster(alloc, allocationRaster)
+    if validateFN:
+        validate_edges(edgeTable, validateFN, max_cost,
+                       edgeListFN.replace(".csv", "") + ".validation.csv")
+
+#Compare the edge table with a pairwise edge list and write the report
+def validate_edges(edgeTable, pairwiseFN, max_cost, reportFN):
+    from PatchGraph import compare_edges
+    #CSV costs are rounded: use the full precision binary edge list if there is one
+    if not pairwiseFN.lower().endswith('.npy') and os.path.exists(binary_path(pairwiseFN)):
+        pairwiseFN = binary_path(pairwiseFN)
+    atol = 0.0 if pairwiseFN.lower().endswith('.npy') else CSV_TOLERANCE
+    msg(f"Comparing the edges with the pairwise edge list {pairwiseFN}")
+    n = len(edgeTable)
+    refU, refV, refW = load_edges(pairwiseFN, max_cost=max_cost)
+    stats = compare_edges(edgeTable.from_id[:n], edgeTable.to_id[:n], edgeTable.cost[:n],
+                          refU, refV, refW, atol=atol)
+    msg(f"{stats['edges']} edges against {stats['ref_edges']} pairwise edges: "
+        f"{stats['shared']} pairs in both, {stats['cost_equal']} of them at the same cost")
+    msg(f"{stats['preserved']} pairwise edges matched by a shortest path through the graph; "
+        f"path cost over pairwise cost {stats['stretch_mean']:.4f} on average, "
+        f"{stats['stretch_max']:.4f} at most ({stats['unreachable']} pairs not connected)")
+    msg(f"Components: {stats['components']} (pairwise {stats['ref_components']}); "
+        f"minimum spanning tree cost: {stats['mst']:.2f} (pairwise {stats['ref_mst']:.2f})")
+    msg(f"Saving the validation report to {reportFN}")
+    with open(reportFN, 'w') as f:
+        f.write("MEASURE,VALUE\n")
+        for measure, value in stats.items():
+            f.write(f"{measure},{value:g}\n" if isinstance(value, float) else f"{measure},{value}\n")
+
+#Read the tool parameters (also works from the command line)
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compute the least cost edge list between all patch pairs")
+    parser.add_argument('patchRaster', help="Patch raster")
+    parser.add_argument('costRaster', help="Cost surface raster")
+    parser.add_argument('edgeListFN', help="Output edge list (csv)")
+    parser.add_argument('lcp_featureclass', nargs='?', default='',
+                        help="Output least cost path feature class [optional]")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes (default: 1)")
+    parser.add_argument('--max-cost', type=float, default=None,
+                        help="Stop each cost distance solve at this cost [optional]")
+    parser.add_argument('--stop-when-settled', action='store_true',
+                        help="Stop each solve once all higher-ID patches are reached")
+    parser.add_argument('--prune', action='store_true',
+                        help="Skip patch pairs and raster areas beyond --max-cost")
+    parser.add_argument('--adaptive-window', type=int, default=None, metavar='PAD',
+                        help="Solve on windows padded by PAD cells, doubled as needed")
+    parser.add_argument('--cover', action='store_true',
+                        help="Solve each patch pair from either end, with the fewest sources")
+    parser.add_argument('--stack-layers', default='all',
+                        help="Cost distance layers to save: all (default), none, "
+                             "or a comma separated list of patch IDs")
+    parser.add_argument('--stack-format', choices=['npy','chunked'], default='npy',
+                        help="Cost distance stack format (default: npy)")
+    parser.add_argument('--stack-dtype', choices=['float64','float32'], default='float64',
+                        help="Cost distance stack data type (default: float64)")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume an interrupted run from its checkpoint")
+    parser.add_argument('--binary-edges', action='store_true',
+                        help="Also save the edge list as a binary .npy file")
+    parser.add_argument('--corridors', default='', metavar='RASTER',
+                        help="Output raster counting the least cost paths crossing each cell")
+    parser.add_argument('--corridor-max-cost', type=float, nargs='+', default=[], metavar='COST',
+                        help="Also count only the paths up to each of these costs")
+    parser.add_argument('--mpg', action='store_true',
+                        help="Compute minimum planar graph edges from one solve from all patches")
+    parser.add_argument('--allocation', default='', metavar='RASTER',
+                        help="Output cost allocation raster (nearest patch of each cell; with --mpg)")
+    parser.add_argument('--validate', default='', metavar='EDGELIST',
+                        help="Compare the minimum planar graph with this pairwise edge list (with --mpg)")
+    parser.add_argument('--tiled', action='store_true',
+                        help="Process rasters too large for memory out of core, in tiles")
+    parser.add_argument('--tile-memory', type=float, default=None, metavar='MB',
+                        help="Memory for each tile solve, in MB (with --tiled; default: 256)")
+    parser.add_argument('--scratch', default='', metavar='FOLDER',
+                        help="Folder for the out of core arrays (with --tiled; "
+                             "default: the edge list's folder)")
+    args = parser.parse_args(argv)
+    if (args.tile_memory is not None or args.scratch) and not args.tiled:
+        parser.error("--tile-memory and --scratch require --tiled")
+    if args.tiled:
+        inMemoryOnly = [option for option, value in (('a least cost path feature class',
+                                                      args.lcp_featureclass not in ('', '#')),
+                                                     ('--corridors', args.corridors),
+                                                     ('--mpg', args.mpg),
+                                                     ('--adaptive-window', args.adaptive_window))
+                        if value]
+        if inMemoryOnly:
+            parser.error(f"--tiled cannot be combined with {', '.join(inMemoryOnly)}")
+    if (args.allocation or args.validate) and not args.mpg:
+        parser.error("--allocation and --validate require --mpg")
+    if args.mpg:
+        pairwiseOnly = [option for option, value in (('--stop-when-settled', args.stop_when_settled),
+                                                     ('--prune', args.prune),
+                                                     ('--adaptive-window', args.adaptive_window),
+                                                     ('--cover', args.cover),
+                                                     ('--resume', args.resume)) if value]
+        if pairwiseOnly:
+            parser.error(f"--mpg cannot be combined with {', '.join(pairwiseOnly)}")
+    if args.prune and args.max_cost is None:
+        parser.error("--prune requires --max-cost")
+    if args.corridor_max_cost and not args.corridors:
+        parser.error("--corridor-max-cost requires --corridors")
+    if args.stack_layers not in ('all', 'none'):
+        args.stack_layers = [int(patchID) for patchID in args.stack_layers.split(',')]
+    #Empty optional toolbox parameters are passed as '#'
+    if args.lcp_featureclass == '#': args.lcp_featureclass = ''
+    return args
+
+
+#%% MAIN
+def main(argv=None):
+    global grid
+    #The solver (SciPy, scikit-image) is only loaded once the arguments are read
+    import CostDistance
+
+    # Get input datasets: Patches and CostSurface
+    debug = False
+    if debug:
+        orig_patchRaster = '..\\Data\\ENH_LCP_ModelInputs_Final2019.gdb\\S_Patches_60ha'
+        orig_costRaster = '..\\Data\\ENH_LCP_ModelInputs_Final2019.gdb\\S_CostSurface'
+        edgeListFN = '..\\Scratch\\edgelist4.csv'
+        lcp_featureclass = edgeListFN.replace('.csv','.shp')
+        workers = 1
+        max_cost = None
+        settle = False
+        prune = False
+        adaptive = None
+        cover = False
+        stack_layers = 'all'
+        stack_format = 'npy'
+        stack_dtype = 'float64'
+        resume = False
+        binary_edges = False
+        corridorRaster = ''
+        corridor_costs = []
+        mpg = False
+        allocationRaster = ''
+        validateFN = ''
+        tiled = False
+        tile_memory = 256
+        scratch = ''
+    else:
+        args = get_args(argv)
+        orig_patchRaster = args.patchRaster
+        orig_costRaster = args.costRaster
+        edgeListFN = args.edgeListFN
+        lcp_featureclass = args.lcp_featureclass
+        workers = args.workers
+        max_cost = args.max_cost
+        settle = args.stop_when_settled
+        prune = args.prune
+        adaptive = args.adaptive_window
+        cover = args.cover
+        stack_layers = args.stack_layers
+        stack_format = args.stack_format
+        stack_dtype = args.stack_dtype
+        resume = args.resume
+        binary_edges = args.binary_edges
+        corridorRaster = args.corridors
+        corridor_costs = args.corridor_max_cost
+        mpg = args.mpg
+        allocationRaster = args.allocation
+        validateFN = args.validate
+        tiled = args.tiled
+        tile_memory = args.tile_memory or 256
+        scratch = args.scratch
+
+    #%% Read the patch and cost rasters over the area they both cover
+    rasterIO = RasterIO.get_backend(orig_patchRaster)
+    tile, tiledFolder = None, None
+    if tiled:
+        #Out of core: memory-mapped copies of the rasters, solved in tiles
+        tiledFolder = tempfile.mkdtemp(prefix='tiled_',
+                                       dir=scratch or os.path.dirname(os.path.abspath(edgeListFN)))
+        msg(f"Copying rasters to memory-mapped arrays in {tiledFolder}")
+        arrPatch, arrCost, grid = RasterIO.read_pair_tiled(rasterIO, orig_patchRaster,
+                                                           orig_costRaster, tiledFolder)
+        tile = CostDistance.tile_size(tile_memory)
+        msg(f"Patch IDs stored as {arrPatch.dtype}, costs as {arrCost.dtype}; "
+            f"solving in tiles of {tile} x {tile} cells")
+    else:
+        msg("Converting rasters to NumPy arrays")
+        arrPatch, arrCost, grid = rasterIO.read_pair(orig_patchRaster, orig_costRaster)
+    cellSize = grid.cellSize
+
+    #Check that arrays are the same size
+    if arrPatch.shape != arrCost.shape:
+        sys.exit("Input rasters must be of same size")
+
+    #%% Create a list of patchIDs
+    index = None
+    if tiled:
+        #Read in blocks rather than masking the whole patch array
+        index = CostDistance.PatchIndex(arrPatch)
+        patchIDs = index.ids.tolist()
+    else:
+        patchIDs = np.unique(arrPatch[arrPatch != RasterIO.NODATA]).tolist()
+    msg(f"{len(patchIDs)} patches to process")
+
+    #%% Initialize the edge table (sized for all patch pairs, up to a point)
+    maxPairs = len(patchIDs) * (len(patchIDs) - 1) // 2
+    edgeTable = EdgeTable(capacity=min(maxPairs, 1000000))
+
+    #%% Least cost paths are traced for the feature class and/or the corridor raster
+    trace = bool(lcp_featureclass or corridorRaster)
+    density = None
+    if corridorRaster:
+        density = CostDistance.PathDensity(arrPatch.shape, corridor_costs)
+
+    #%% Minimum planar graph: one solve from all patches at once
+    if mpg:
+        planar_graph(arrPatch, arrCost, edgeTable, trace, density, bool(lcp_featureclass),
+                     max_cost, allocationRaster, validateFN, edgeListFN)
+        save_outputs(edgeTable, density, lcp_featureclass, corridorRaster, edgeListFN, binary_edges)
+        return
+
+    #%% Prune patch pairs that cannot be connected below the maximum cost
+    reach, candidates = None, None
+    if prune:
+        minCost = CostDistance.min_cost(arrCost)
+        if minCost > 0:
+            if index is None:
+                index = CostDistance.PatchIndex(arrPatch)
+            reach = CostDistance.reach_cells(cellSize, minCost, max_cost)
+            candidates = CostDistance.candidate_pairs(index, cellSize, minCost, max_cost)
+            nCandidates = sum(len(c) for c in candidates.values())
+            msg(f"Pruned {maxPairs - nCandidates} of {maxPairs} patch pairs; "
+                f"solves limited to {reach} cells around each source patch")
+        else:
+            msg("Cost surface has zero cost cells: nothing can be pruned")
+
+    #%% Choose the source patches to solve
+    if stack_layers == 'all':
+        layerIDs = patchIDs
+    elif stack_layers == 'none':
+        layerIDs = []
+    else:
+        layerIDs = sorted(set(stack_layers) & set(patchIDs))
+    sources, targets = CostDistance.schedule_sources(patchIDs, candidates, cover, layerIDs)
+    msg(f"{len(sources)} source patches to solve")
+
+    #%% Preallocate the cost distance stack on disk
+    stack = None
+    if layerIDs:
+        stackFN = edgeListFN.replace("csv","npy")
+        if stack_format == 'chunked':
+            stackFN = stackFN[:-4] + "_stack"
+        msg(f"Writing Cost Distance Arrays to {stackFN}")
+        stack = StackWriter(stackFN, layerIDs, arrPatch.shape,
+                            dtype=stack_dtype, fmt=stack_format).create(resume=resume)
+
+    #%% Open the checkpoint, picking up finished source patches if resuming
+    checkpoint = EdgeCheckpoint(edgeListFN + ".ckpt",
+                                dict(patchIDs=patchIDs, shape=arrPatch.shape,
+                                     lcp=trace, max_cost=max_cost,
+                                     settle=settle, stack=[stack_format, stack_dtype],
+                                     cover=cover, layers=layerIDs))
+    done = checkpoint.open(resume=resume)
+    if done:
+        msg(f"Resuming: {len(done)} source patches already finished")
+    todo = [patchID for patchID in sources if patchID not in done]
+
+    #%% Initialize the progressor
+    step = 0
+    steps = len(sources)
+    RasterIO.set_progressor("step", "Computing Cost Distances...",step,steps,1)
+    if workers > 1:
+        msg(f"Computing cost distances with {workers} worker processes")
+    if max_cost is not None:
+        msg(f"Cost distance solves stop at a cost of {max_cost}")
+
+    #%% Shapefiles and GeoPackages are written as each source patch is solved
+    writer = None
+    if lcp_featureclass.lower().endswith(('.shp', '.gpkg')):
+        msg(f"Writing least cost paths to {lcp_featureclass}")
+        writer = open_writer(lcp_featureclass, grid.wkid, grid.wkt)
+
+    #%% Loop through each patch and compute its cost distance to all other patches
+    solved = CostDistance.iter_sources(arrPatch, arrCost, cellSize, todo,
+                                       lcp=trace,
+                                       workers=workers,
+                                       max_cost=max_cost,
+                                       settle=settle,
+                                       stack=stack,
+                                       reach=reach,
+                                       targets=targets,
+                                       adaptive=adaptive,
+                                       tile=tile,
+                                       scratch=tiledFolder)
+    solveStats = []
+    for patchID in sources:
+        step += 1
+        RasterIO.set_progressor_label("Patch {} of {} ".format(step,steps))
+
+        #Take finished patches from the checkpoint, others from the solver
+        if patchID in done:
+            edges = done.pop(patchID)
+            #Paths are read back one finished patch at a time
+            if trace:
+                edges = checkpoint.paths(patchID)
+        else:
+            _, edges, stats = next(solved)
+            checkpoint.write(patchID, edges)
+            solveStats.append((patchID, stats))
+
+        #Add the edges (and least cost path cells) to the edge table,
+        #listing edges solved from the higher ID patch the other way round
+        print("." * len(edges),end="")
+        if cover:
+            edges = [(toID, fromID, cost, None if path is None else path[::-1])
+                     if toID < fromID else (fromID, toID, cost, path)
+                     for fromID, toID, cost, path in edges]
+        #Count the paths in the corridor raster and write them to the features
+        if density is not None:
+            density.add(edges)
+        if writer is not None:
+            write_paths(writer, edges)
+        #Paths are only kept for feature classes saved at the end
+        if trace and (writer is not None or not lcp_featureclass):
+            edges = [(fromID, toID, cost, None) for fromID, toID, cost, _ in edges]
+        edgeTable.add_edges(edges)
+
+        RasterIO.set_progressor_position()
+    solved.close()
+    if writer is not None:
+        writer.close()
+    if cover:
+        edgeTable.sort()
+
+    #%% Clean up
+    checkpoint.close()
+    if solveStats and (reach is not None or adaptive is not None):
+        #Report the window and time of each solve
+        solvesFN = edgeListFN.replace(".csv", "") + ".solves.csv"
+        with open(solvesFN, 'w') as f:
+            f.write("PATCH_ID,ROW0,COL0,ROWS,COLS,SOLVES,SECONDS\n")
+            for patchID, stats in solveStats:
+                r0, c0, r1, c1 = stats['window']
+                f.write(f"{patchID},{r0},{c0},{r1-r0},{c1-c0},{stats['solves']},{stats['seconds']:.4f}\n")
+        #Extrapolate the time full raster solves would have taken
+        solveCells = sum(stats['cells'] for _, stats in solveStats)
+        solveTime = sum(stats['seconds'] for _, stats in solveStats)
+        fullTime = solveTime * len(solveStats) * arrPatch.size / solveCells
+        msg(f"\nSolved {solveCells / (len(solveStats) * arrPatch.size):.1%} of the raster cells "
+            f"in {solveTime:.1f} s; estimated time saved by windowing: {fullTime - solveTime:.1f} s "
+            f"(per patch windows and times in {solvesFN})")
+    nMissing = maxPairs - len(edgeTable)
+    if nMissing:
+        msg(f"\n{nMissing} patch pairs not connected (or beyond the cost cutoff)")
+
+    if tiledFolder is not None:
+        del arrPatch, arrCost
+        shutil.rmtree(tiledFolder, ignore_errors=True)
+
+    save_outputs(edgeTable, density, '' if writer is not None else lcp_featureclass,
+                 corridorRaster, edgeListFN, binary_edges)
+
+    #All outputs written: the checkpoint is no longer needed
+    checkpoint.close(remove=True)
+
+
+#Guard the entry point so worker processes can import this module safely
+if __name__ == '__main__':
+    main()
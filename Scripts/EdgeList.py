@@ -0,0 +1,308 @@
+'''
+Edge List
+Spring 2021 - John.Fay@duke.edu
+
+Columnar accumulation of the patch-pair edge list built by
+CreateEdgeList_v2.py.
+
+Edges are collected in typed NumPy arrays (int32 FROM_ID/TO_ID, float64
+COST) that are preallocated and grow by doubling, rather than appended
+to a DataFrame one row at a time (which copies the whole frame on every
+append). Least cost paths are kept the same way: the (row, col) cells of
+all paths go in one array, with each edge holding an offset into it.
+The CSV is written straight from the arrays; a DataFrame is only built
+when one is needed (pandas is imported then).
+
+The edges of each finished source patch can also be appended to an
+on-disk checkpoint (EdgeCheckpoint), from which an interrupted run is
+resumed.
+
+Besides the CSV, the edge list can be saved in a compact binary form: a
+.npy structured array (int32 FROM_ID/TO_ID, float64 COST at full
+precision) sorted by cost. load_edges() reads either form into NumPy
+arrays; the binary one is memory-mapped, so edges above a cost threshold
+are never read from disk.
+'''
+
+import os, json, warnings
+import numpy as np
+
+#Record layout of the binary edge list
+EDGE_DTYPE = np.dtype([('FROM_ID', '<i4'), ('TO_ID', '<i4'), ('COST', '<f8')])
+
+#Largest rounding error of the costs in a CSV edge list (written to 4 decimals)
+CSV_TOLERANCE = 5e-5
+
+
+def binary_path(csvPath):
+    """Name of the binary edge list saved alongside an edge list CSV."""
+    return os.path.splitext(csvPath)[0] + '.edges.npy'
+
+
+def save_edges(path, fromIDs, toIDs, costs):
+    """Save edges as a binary edge list (.npy structured array sorted by cost)."""
+    edges = np.empty(len(costs), dtype=EDGE_DTYPE)
+    edges['FROM_ID'] = fromIDs
+    edges['TO_ID'] = toIDs
+    edges['COST'] = costs
+    edges = edges[np.argsort(edges['COST'], kind='stable')]
+    np.save(path, edges)
+
+
+def load_edges(path, max_cost=None):
+    """
+    Read an edge list, either a CSV (FROM_ID, TO_ID, COST with a header
+    line) or a binary edge list (.npy), and return its FROM_ID, TO_ID and
+    COST columns as three arrays. If max_cost is given, only edges with
+    a cost up to max_cost are returned.
+    """
+    if path.lower().endswith('.npy'):
+        edges = np.load(path, mmap_mode='r')
+        if max_cost is not None:
+            #Sorted by cost: keep the leading run of edges up to max_cost
+            edges = edges[:np.searchsorted(edges['COST'], max_cost, side='right')]
+        return (np.array(edges['FROM_ID'], dtype=np.int64),
+                np.array(edges['TO_ID'], dtype=np.int64),
+                np.array(edges['COST'], dtype=np.float64))
+    #A header-only CSV (no pairs connected) gives an empty array
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='loadtxt: input contained no data')
+        data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2).reshape(-1, 3)
+    if max_cost is not None:
+        data = data[data[:, 2] <= max_cost]
+    return data[:, 0].astype(np.int64), data[:, 1].astype(np.int64), data[:, 2]
+
+
+class EdgeTable:
+    """
+    Growable, columnar table of edges and (optionally) their paths.
+
+    Usage:
+    >>> table = EdgeTable(capacity=1000)
+    >>> table.add(1, 2, 1520.3, path=[(0,0),(0,1),(1,2)])
+    >>> df = table.to_dataframe()
+    """
+
+    def __init__(self, capacity=1024):
+        capacity = max(int(capacity), 1)
+        self.size = 0
+        self.from_id = np.empty(capacity, dtype=np.int32)
+        self.to_id = np.empty(capacity, dtype=np.int32)
+        self.cost = np.empty(capacity, dtype=np.float64)
+        #Path of edge i is cells[offsets[i]:offsets[i+1]]
+        self.offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.cells = np.empty((0, 2), dtype=np.int32)
+        self.nCells = 0
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, n):
+        """Double the edge arrays until n more edges fit."""
+        capacity = self.from_id.size
+        if self.size + n <= capacity:
+            return
+        while capacity < self.size + n:
+            capacity *= 2
+        for name in ('from_id', 'to_id', 'cost'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        offsets = np.zeros(capacity + 1, dtype=np.int64)
+        offsets[:self.size + 1] = self.offsets[:self.size + 1]
+        self.offsets = offsets
+
+    def _grow_cells(self, n):
+        """Double the path cell array until n more cells fit."""
+        capacity = self.cells.shape[0]
+        if self.nCells + n <= capacity:
+            return
+        capacity = max(capacity, 1024)
+        while capacity < self.nCells + n:
+            capacity *= 2
+        cells = np.empty((capacity, 2), dtype=np.int32)
+        cells[:self.nCells] = self.cells[:self.nCells]
+        self.cells = cells
+
+    def add(self, fromID, toID, cost, path=None):
+        """Add one edge, with its path as a sequence of (row, col) cells."""
+        self._grow(1)
+        i = self.size
+        self.from_id[i] = fromID
+        self.to_id[i] = toID
+        self.cost[i] = cost
+        if path is not None and len(path):
+            path = np.asarray(path, dtype=np.int32)
+            self._grow_cells(len(path))
+            self.cells[self.nCells:self.nCells + len(path)] = path
+            self.nCells += len(path)
+        self.offsets[i + 1] = self.nCells
+        self.size += 1
+
+    def add_edges(self, edges):
+        """Add a list of (FROM_ID, TO_ID, COST, path) tuples."""
+        self._grow(len(edges))
+        for fromID, toID, cost, path in edges:
+            self.add(fromID, toID, cost, path)
+
+    def path(self, i):
+        """Return the (row, col) cells of the path of edge i."""
+        return self.cells[self.offsets[i]:self.offsets[i + 1]]
+
+    def sort(self):
+        """Sort the edges (and their paths) by FROM_ID, then TO_ID."""
+        n = self.size
+        order = np.lexsort((self.to_id[:n], self.from_id[:n]))
+        lengths = np.diff(self.offsets[:n + 1])[order]
+        #Cell positions of the reordered paths
+        starts = self.offsets[:n][order]
+        cells = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        cells += np.arange(lengths.sum())
+        for name in ('from_id', 'to_id', 'cost'):
+            getattr(self, name)[:n] = getattr(self, name)[:n][order]
+        self.cells[:self.nCells] = self.cells[cells]
+        self.offsets[1:n + 1] = np.cumsum(lengths)
+
+    def save(self, path):
+        """Save the edges as a binary edge list (see save_edges)."""
+        save_edges(path, self.from_id[:self.size], self.to_id[:self.size], self.cost[:self.size])
+
+    def to_csv(self, path):
+        """Write the edges to a CSV file (FROM_ID, TO_ID and COST to 4 decimals)."""
+        with open(path, 'w') as f:
+            f.write('FROM_ID,TO_ID,COST\n')
+            for fromID, toID, cost in zip(self.from_id[:self.size].tolist(),
+                                          self.to_id[:self.size].tolist(),
+                                          self.cost[:self.size].tolist()):
+                f.write('%d,%d,%2.4f\n' % (fromID, toID, cost))
+
+    def to_dataframe(self):
+        """Return the edges as a DataFrame with FROM_ID, TO_ID and COST columns."""
+        import pandas as pd
+        return pd.DataFrame({'FROM_ID': self.from_id[:self.size],
+                             'TO_ID': self.to_id[:self.size],
+                             'COST': self.cost[:self.size]})
+
+
+class EdgeCheckpoint:
+    """
+    Append-only, on-disk record of the edges of each finished source
+    patch, so that an interrupted run can be resumed.
+
+    The file starts with the run settings; then, for each source patch,
+    a record of five arrays written with np.save: [patchID, nEdges], the
+    TO_IDs (int32), the costs (float64), the path lengths (int64) and the
+    path cells (int32). Each record is flushed to disk before the next
+    source is processed. A record cut short by a crash is ignored (and
+    overwritten) on resume.
+
+    On resume, the finished sources' edges are returned without their
+    paths, so paths are never all held in memory; read those of one
+    source back with paths(patchID) when needed.
+
+    Usage:
+    >>> ckpt = EdgeCheckpoint('edges.csv.ckpt', settings)
+    >>> done = ckpt.open(resume=True)   # {patchID: edges} already finished
+    >>> ckpt.write(patchID, edges)
+    >>> ckpt.close()
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = json.dumps(settings, sort_keys=True)
+        self._file = None
+        #File position of each finished source's record
+        self._records = {}
+
+    @staticmethod
+    def _load_record(f, paths=True):
+        """Read the next record: the source patch ID and its edges."""
+        patchID, nEdges = np.load(f).tolist()
+        toIDs, costs, lengths = (np.load(f) for _ in range(3))
+        if paths:
+            cells = np.load(f)
+        else:
+            #Skip over the path cells without reading them
+            version = np.lib.format.read_magic(f)
+            header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                      else np.lib.format.read_array_header_2_0)
+            shape, _, dtype = header(f)
+            f.seek(int(np.prod(shape)) * dtype.itemsize, os.SEEK_CUR)
+            if f.tell() > os.fstat(f.fileno()).st_size:
+                raise EOFError("Record cut short")
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return patchID, [(patchID, toID, cost,
+                          cells[offsets[i]:offsets[i+1]] if paths and lengths[i] else None)
+                         for i, (toID, cost) in enumerate(zip(toIDs.tolist(), costs.tolist()))]
+
+    def _read(self):
+        """Return the finished sources (without paths) and the file position after the last complete record."""
+        done = {}
+        with open(self.path, 'rb') as f:
+            try:
+                settings = str(np.load(f))
+            except (ValueError, EOFError, OSError):
+                return done, 0
+            if settings != self.settings:
+                raise ValueError(f"Checkpoint {self.path} was written with different settings")
+            end = f.tell()
+            while True:
+                try:
+                    patchID, edges = self._load_record(f, paths=False)
+                except (ValueError, EOFError, OSError):
+                    break
+                done[patchID] = edges
+                self._records[patchID] = end
+                end = f.tell()
+        return done, end
+
+    def paths(self, patchID):
+        """The edges, with their paths, of a source patch finished before resuming."""
+        with open(self.path, 'rb') as f:
+            f.seek(self._records[patchID])
+            return self._load_record(f)[1]
+
+    def open(self, resume=False):
+        """
+        Open the checkpoint for writing and return a dictionary of the
+        edges of the source patches already finished (empty unless
+        resuming from an existing checkpoint).
+        """
+        done, end = {}, 0
+        if resume and os.path.exists(self.path):
+            done, end = self._read()
+        if end:
+            #Drop any partial record left after the last complete one
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(self.path, 'wb')
+            np.save(self._file, np.array(self.settings))
+            self._sync()
+        return done
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write(self, patchID, edges):
+        """Append the edges of one finished source patch."""
+        lengths = np.array([0 if path is None else len(path) for _, _, _, path in edges],
+                           dtype=np.int64)
+        paths = [np.asarray(path, dtype=np.int32) for _, _, _, path in edges if path is not None and len(path)]
+        np.save(self._file, np.array([patchID, len(edges)], dtype=np.int64))
+        np.save(self._file, np.array([e[1] for e in edges], dtype=np.int32))
+        np.save(self._file, np.array([e[2] for e in edges], dtype=np.float64))
+        np.save(self._file, lengths)
+        np.save(self._file, np.concatenate(paths) if paths else np.empty((0, 2), dtype=np.int32))
+        self._sync()
+
+    def close(self, remove=False):
+        """Close the checkpoint, deleting it if remove is True (run completed)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
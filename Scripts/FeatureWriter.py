@@ -0,0 +1,209 @@
+'''
+Feature Writer
+Spring 2021 - John.Fay@duke.edu
+
+Streaming writers for least cost path polylines that need neither arcpy
+nor the ArcGIS API: an ESRI shapefile (.shp/.shx/.dbf/.prj, written with
+struct) or a GeoPackage (.gpkg, written with sqlite3). Each path is
+written as soon as it is passed in, so no geometry objects are kept in
+memory.
+
+Every feature holds one polyline and its FROM_ID, TO_ID and COST.
+
+Usage:
+>>> with open_writer('edges.shp', wkid, wkt) as writer:
+...     writer.write(1, 2, 1520.3, xy)   # xy: (n, 2) array of x, y
+'''
+
+import os, struct, sqlite3, datetime
+import numpy as np
+
+
+def cells_to_xy(cells, x0, y0, cellSize):
+    """
+    Convert an (n, 2) array of (row, col) cells to map coordinates, with
+    (x0, y0) the upper left corner of the raster.
+    """
+    cells = np.asarray(cells, dtype=np.float64).reshape(-1, 2)
+    return np.column_stack([x0 + cells[:, 1] * cellSize, y0 - cells[:, 0] * cellSize])
+
+
+def open_writer(path, wkid=None, wkt=''):
+    """
+    Return a writer for path: a GeoPackage if it ends with .gpkg,
+    otherwise a shapefile. wkid and wkt describe the coordinate system.
+    """
+    if path.lower().endswith('.gpkg'):
+        return GeoPackageWriter(path, wkid, wkt)
+    return ShapefileWriter(path, wkid, wkt)
+
+
+class ShapefileWriter:
+    """
+    Writes polylines to an ESRI shapefile, one record at a time. The
+    headers (file lengths, extent, record count) are filled in on close.
+    """
+
+    #dBASE field definitions: name, type, width, decimals
+    DBF_FIELDS = (('FROM_ID', b'N', 10, 0), ('TO_ID', b'N', 10, 0), ('COST', b'N', 19, 4))
+
+    def __init__(self, path, wkid=None, wkt=''):
+        base = os.path.splitext(path)[0]
+        self.shp = open(base + '.shp', 'wb')
+        self.shx = open(base + '.shx', 'wb')
+        self.dbf = open(base + '.dbf', 'wb')
+        if wkt:
+            with open(base + '.prj', 'w') as f:
+                f.write(wkt)
+        self.count = 0
+        self.offset = 50                    #in 16-bit words, past the header
+        self.bbox = [np.inf, np.inf, -np.inf, -np.inf]
+        #Placeholder headers, rewritten on close
+        self.shp.write(b'\0' * 100)
+        self.shx.write(b'\0' * 100)
+        self._dbf_header()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _main_header(self, fileLength):
+        xmin, ymin, xmax, ymax = self.bbox if self.count else (0, 0, 0, 0)
+        return (struct.pack('>7i', 9994, 0, 0, 0, 0, 0, fileLength) +
+                struct.pack('<2i4d4d', 1000, 3, xmin, ymin, xmax, ymax, 0, 0, 0, 0))
+
+    def _dbf_header(self):
+        today = datetime.date.today()
+        recordLength = 1 + sum(width for _, _, width, _ in self.DBF_FIELDS)
+        headerLength = 32 + 32 * len(self.DBF_FIELDS) + 1
+        self.dbf.write(struct.pack('<4BIHH20x', 3, today.year - 1900, today.month, today.day,
+                                   self.count, headerLength, recordLength))
+        for name, ftype, width, decimals in self.DBF_FIELDS:
+            self.dbf.write(struct.pack('<11sc4xBB14x', name.encode('ascii'), ftype, width, decimals))
+        self.dbf.write(b'\r')
+
+    def write(self, fromID, toID, cost, xy):
+        """Write one polyline (an (n, 2) array of x, y) and its attributes."""
+        xy = np.asarray(xy, dtype='<f8').reshape(-1, 2)
+        box = (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+        self.bbox = [min(self.bbox[0], box[0]), min(self.bbox[1], box[1]),
+                     max(self.bbox[2], box[2]), max(self.bbox[3], box[3])]
+        #Single part polyline record
+        content = struct.pack('<i4d2ii', 3, *box, 1, len(xy), 0) + xy.tobytes()
+        self.count += 1
+        self.shp.write(struct.pack('>2i', self.count, len(content) // 2) + content)
+        self.shx.write(struct.pack('>2i', self.offset, len(content) // 2))
+        self.offset += 4 + len(content) // 2
+        values = (int(fromID), int(toID), float(cost))
+        record = b' ' + b''.join(('%*.*f' % (width, decimals, value)).encode('ascii')[:width]
+                                 for (_, _, width, decimals), value in zip(self.DBF_FIELDS, values))
+        self.dbf.write(record)
+
+    def close(self):
+        """Fill in the headers and close the files."""
+        if self.shp.closed:
+            return
+        self.dbf.write(b'\x1a')
+        self.shp.seek(0)
+        self.shp.write(self._main_header(self.offset))
+        self.shx.seek(0)
+        self.shx.write(self._main_header(50 + 4 * self.count))
+        self.dbf.seek(0)
+        self._dbf_header()
+        for f in (self.shp, self.shx, self.dbf):
+            f.close()
+
+
+class GeoPackageWriter:
+    """
+    Writes polylines (LineStrings) to a new GeoPackage feature table,
+    committing in batches. The table is named after the file.
+    """
+
+    def __init__(self, path, wkid=None, wkt='', batch=1000):
+        if os.path.exists(path):
+            os.remove(path)
+        self.table = os.path.splitext(os.path.basename(path))[0]
+        self.srsID = int(wkid) if wkid else -1
+        self.batch = batch
+        self.rows = []
+        self.bbox = [np.inf, np.inf, -np.inf, -np.inf]
+        self.db = sqlite3.connect(path)
+        self._create(wkt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _create(self, wkt):
+        db = self.db
+        db.execute("PRAGMA application_id = 1196444487")   #'GPKG'
+        db.execute("PRAGMA user_version = 10200")
+        db.execute("""CREATE TABLE gpkg_spatial_ref_sys (
+                          srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY,
+                          organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL,
+                          definition TEXT NOT NULL, description TEXT)""")
+        db.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)", [
+            ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+            ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+            ('WGS 84 geodetic', 4326, 'EPSG', 4326,
+             'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+             'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]', None)])
+        if self.srsID not in (-1, 0, 4326):
+            db.execute("INSERT INTO gpkg_spatial_ref_sys VALUES (?,?,?,?,?,?)",
+                       (f'EPSG:{self.srsID}', self.srsID, 'EPSG', self.srsID, wkt or 'undefined', None))
+        db.execute("""CREATE TABLE gpkg_contents (
+                          table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+                          identifier TEXT UNIQUE, description TEXT DEFAULT '',
+                          last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+                          min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER)""")
+        db.execute("""CREATE TABLE gpkg_geometry_columns (
+                          table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+                          geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL,
+                          z TINYINT NOT NULL, m TINYINT NOT NULL,
+                          CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name))""")
+        db.execute(f"""CREATE TABLE "{self.table}" (
+                           fid INTEGER PRIMARY KEY AUTOINCREMENT, geom LINESTRING,
+                           FROM_ID INTEGER, TO_ID INTEGER, COST DOUBLE)""")
+        db.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) "
+                   "VALUES (?, 'features', ?, ?)", (self.table, self.table, self.srsID))
+        db.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'LINESTRING', ?, 0, 0)",
+                   (self.table, self.srsID))
+
+    def _geometry(self, xy, box):
+        """GeoPackage binary geometry: header with envelope, then WKB LineString."""
+        header = b'GP' + struct.pack('<BBi4d', 0, 0b00000011, self.srsID,
+                                     box[0], box[2], box[1], box[3])
+        return header + struct.pack('<BII', 1, 2, len(xy)) + xy.tobytes()
+
+    def write(self, fromID, toID, cost, xy):
+        """Write one polyline (an (n, 2) array of x, y) and its attributes."""
+        xy = np.asarray(xy, dtype='<f8').reshape(-1, 2)
+        box = (xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max())
+        self.bbox = [min(self.bbox[0], box[0]), min(self.bbox[1], box[1]),
+                     max(self.bbox[2], box[2]), max(self.bbox[3], box[3])]
+        self.rows.append((self._geometry(xy, box), int(fromID), int(toID), float(cost)))
+        if len(self.rows) >= self.batch:
+            self._flush()
+
+    def _flush(self):
+        self.db.executemany(f'INSERT INTO "{self.table}" (geom, FROM_ID, TO_ID, COST) '
+                            'VALUES (?,?,?,?)', self.rows)
+        self.db.commit()
+        self.rows = []
+
+    def close(self):
+        """Write any remaining features, record the extent and close."""
+        if self.db is None:
+            return
+        self._flush()
+        if np.isfinite(self.bbox[0]):
+            self.db.execute("UPDATE gpkg_contents SET min_x=?, min_y=?, max_x=?, max_y=? "
+                            "WHERE table_name=?", (*self.bbox, self.table))
+        self.db.commit()
+        self.db.close()
+        self.db = None
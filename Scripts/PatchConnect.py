@@ -0,0 +1,109 @@
+'''
+Patch Connect
+Spring 2021 - John.Fay@duke.edu
+
+Runs the whole PatchConnect workflow from the command line, without
+ArcGIS when the rasters are GeoTIFFs or .npy rasters (see RasterIO.py):
+
+  1. CreateEdgeList_v2.py - the least cost edge list between all patches
+  2. SummarizeGraph.py - components and diameter over a range of cost
+     thresholds (or an adaptive search, with --tolerance), and the
+     threshold of maximum connectivity
+  3. CalculatePatchConnectivityAttributes.py - patch connectivity
+     attributes at that threshold (or at --threshold)
+
+Outputs are written to the output folder: EdgeList.csv (and its binary
+EdgeList.edges.npy, read by steps 2 and 3), GraphSummary.csv and
+PatchAttributes.csv (and, with --sensitivity, NodeSensitivity.csv: the
+cut nodes and the change in diameter as each patch is removed from the
+graph at the threshold). Step 1 only looks for connections up to the largest
+threshold used (--max-cost), pruning patch pairs beyond it.
+
+Usage: PatchConnect.py <patch raster> <cost raster> <output folder>
+           <min threshold> <max threshold> <threshold step>
+           [--tolerance COST] [--threshold COST] [--workers N]
+           [--backend {networkx,csr}] [--stack-layers {all,none,ID,...}] [--lcp-features FC]
+           [--corridors RASTER] [--sensitivity]
+'''
+
+import os, sys, argparse
+
+import CreateEdgeList_v2
+import SummarizeGraph
+import CalculatePatchConnectivityAttributes
+from EdgeList import binary_path
+from RasterIO import add_message as msg
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run PatchConnect steps 1-3")
+    parser.add_argument('patchRaster', help="Patch raster")
+    parser.add_argument('costRaster', help="Cost surface raster")
+    parser.add_argument('outputFolder', help="Folder for the outputs")
+    parser.add_argument('minThreshold', type=int, help="Smallest cost threshold evaluated")
+    parser.add_argument('maxThreshold', type=int, help="Largest cost threshold evaluated")
+    parser.add_argument('thresholdStep', type=int, help="Cost threshold interval")
+    parser.add_argument('--tolerance', type=int, default=None,
+                        help="Search the thresholds adaptively, locating the inflection "
+                             "to within this cost (the step sets the first, coarse sweep)")
+    parser.add_argument('--threshold', type=int, default=None,
+                        help="Cost threshold for the patch attributes "
+                             "(default: the threshold of maximum connectivity)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of worker processes (default: 1)")
+    parser.add_argument('--backend', choices=['networkx','csr'], default='networkx',
+                        help="Centrality backend (default: networkx)")
+    parser.add_argument('--stack-layers', default='none',
+                        help="Cost distance layers to save: all, none (default), "
+                             "or a comma separated list of patch IDs")
+    parser.add_argument('--lcp-features', default='',
+                        help="Output least cost path feature class (.shp or .gpkg) [optional]")
+    parser.add_argument('--corridors', default='',
+                        help="Output least cost path corridor raster [optional]")
+    parser.add_argument('--sensitivity', action='store_true',
+                        help="Also write the node removal sensitivity at the threshold")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = get_args(argv)
+    os.makedirs(args.outputFolder, exist_ok=True)
+    edgeListFN = os.path.join(args.outputFolder, 'EdgeList.csv')
+    summaryFN = os.path.join(args.outputFolder, 'GraphSummary.csv')
+    attributesFN = os.path.join(args.outputFolder, 'PatchAttributes.csv')
+    sensitivityFN = os.path.join(args.outputFolder, 'NodeSensitivity.csv')
+    maxCost = max(args.maxThreshold, args.threshold or 0)
+
+    msg("\n1. Computing the edge list")
+    step1 = [args.patchRaster, args.costRaster, edgeListFN,
+             '--workers', str(args.workers), '--max-cost', str(maxCost), '--prune',
+             '--stack-layers', args.stack_layers, '--binary-edges']
+    if args.lcp_features:
+        step1.insert(3, args.lcp_features)
+    if args.corridors:
+        step1 += ['--corridors', args.corridors]
+    CreateEdgeList_v2.main(step1)
+
+    msg("\n2. Summarizing the graph")
+    edgesFN = binary_path(edgeListFN)
+    step2 = [edgesFN, str(args.minThreshold), str(args.maxThreshold),
+             str(args.thresholdStep), summaryFN]
+    if args.tolerance:
+        step2.append(str(args.tolerance))
+    _, optimal = SummarizeGraph.main(step2)
+    threshold = args.threshold or optimal
+    if threshold is None:
+        msg("No inflection point found in the diameter: rerun with a wider range of "
+            "thresholds, or set one with --threshold")
+        sys.exit(1)
+    if args.sensitivity:
+        SummarizeGraph.node_sensitivity(edgesFN, threshold, sensitivityFN, args.workers)
+
+    msg(f"\n3. Computing patch connectivity attributes at a threshold of {threshold}")
+    CalculatePatchConnectivityAttributes.main([args.patchRaster, edgesFN, str(threshold),
+                                               attributesFN, '--backend', args.backend,
+                                               '--workers', str(args.workers)])
+
+
+if __name__ == '__main__':
+    main()
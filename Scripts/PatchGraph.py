@@ -0,0 +1,995 @@
+'''
+Patch Graph
+Spring 2021 - John.Fay@duke.edu
+
+Graph routines shared by SummarizeGraph.py and
+CalculatePatchConnectivityAttributes.py, working on the edge list as
+NumPy arrays of (FROM_ID, TO_ID, COST).
+
+ThresholdSweep adds edges to a union-find structure in order of cost, so
+the number of components and the members of the largest component can be
+reported at any number of increasing thresholds in near-linear total
+time, without building a separate graph for every threshold.
+
+Weighted diameters are computed over a CSR adjacency matrix with the
+compiled shortest path routines in scipy.sparse.csgraph, using the
+bounding-diameters algorithm of Takes & Kosters (2011): lower and upper
+bounds on every node's eccentricity are tightened after each shortest
+path search, and nodes that can no longer affect the diameter are
+dropped, so only a handful of searches are needed to certify the exact
+diameter.
+
+Across a sweep, IncrementalDistances can also keep the all-pairs
+distance matrix of each component up to date as edges arrive (edge
+insertion relaxation within a component, block merge when two components
+join), so the diameter at each threshold is an update rather than a
+full recompute.
+
+centrality() computes degree, closeness and (Brandes) betweenness
+centrality of every node from a CSR adjacency matrix: shortest paths come
+from csgraph.dijkstra, and the path counts and dependencies of each
+source are accumulated with two sparse triangular solves over its
+shortest path DAG rather than node by node in Python. Sources can be
+spread over a process pool. Results match NetworkX's degree_centrality,
+closeness_centrality(distance='weight') and
+betweenness_centrality(normalized=True, weight='weight') to within
+floating point round-off (relative differences below 1e-9).
+
+For very large graphs betweenness can instead be estimated from a
+uniform sample of sources (Brandes & Pich pivots), either a fixed number
+of them or a sample grown until a target error is met, with a per-node
+confidence interval half-width from Hoeffding-Serfling and empirical
+Bernstein bounds (in the spirit of Riondato & Kornaropoulos).
+
+diameter_sensitivity() removes each node in turn and reports whether the
+graph splits and how much the diameter of the largest component
+changes, solving the removals over a process pool and skipping nodes
+that provably leave the diameter unchanged.
+
+compare_edges() measures how well a reduced edge list (such as a minimum
+planar graph's) stands in for the full pairwise list: shared costs,
+shortest path stretch, components and spanning tree cost.
+'''
+
+import math
+import multiprocessing
+
+import numpy as np
+
+
+def cheapest_pairs(i, j, w):
+    """
+    Positions, in order, of the cheapest listing of each node pair (either
+    way round) among the edges (i, j) of weight w.
+    """
+    lo = np.minimum(i, j)
+    hi = np.maximum(i, j)
+    if not lo.size:
+        return np.arange(0)
+    #Listings of each pair from the cheapest, the first one kept
+    order = np.lexsort((w, hi, lo))
+    lo, hi = lo[order], hi[order]
+    first = np.r_[True, (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])]
+    return np.sort(order[first])
+
+
+def csr_graph(i, j, w, n):
+    """
+    Return the symmetric CSR adjacency matrix of an undirected graph with
+    n nodes (numbered 0..n-1) and edges (i, j) of weight w. Zero weights
+    are kept as explicit entries, which csgraph treats as edges. A pair
+    listed more than once (either way round) is linked at its lowest
+    weight, as the threshold sweep connects it, rather than at the sum of
+    its weights.
+    """
+    from scipy import sparse
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    w = np.asarray(w, dtype=np.float64)
+    keep = cheapest_pairs(i, j, w)
+    if keep.size < i.size:
+        i, j, w = i[keep], j[keep], w[keep]
+    #Self loops are entered once
+    off = i != j
+    return sparse.csr_matrix((np.concatenate([w, w[off]]),
+                              (np.concatenate([i, j[off]]), np.concatenate([j, i[off]]))),
+                             shape=(n, n))
+
+
+def weighted_diameter(A, return_searches=False, return_pair=False):
+    """
+    Exact weighted diameter of the connected graph with CSR adjacency A,
+    by the bounding-diameters algorithm (Takes & Kosters 2011).
+
+    Each step runs one single-source Dijkstra search and uses the result
+    to bound the eccentricity of every node from below and above; nodes
+    whose bounds show they cannot change the diameter are dropped. Sources
+    alternate between the candidate with the largest upper bound and the
+    one with the smallest lower bound, starting from the node with the
+    highest degree.
+
+    If return_searches is True, also returns the number of searches run,
+    and if return_pair is True, a pair of nodes the diameter lies between.
+    """
+    from scipy.sparse import csgraph
+    n = A.shape[0]
+    if n < 2:
+        return _diameter_result(0.0, 0, (0, 0), return_searches, return_pair)
+    lower = np.zeros(n)
+    upper = np.full(n, np.inf)
+    candidates = np.ones(n, dtype=bool)
+    dLower, dUpper = 0.0, np.inf
+    v = int(np.argmax(np.diff(A.indptr)))
+    pair = (v, v)
+    pickHigh = True
+    searches = 0
+    while candidates.any():
+        dist = csgraph.dijkstra(A, directed=False, indices=v)
+        searches += 1
+        ecc = dist.max()
+        if ecc > dLower:
+            pair = (v, int(np.argmax(dist)))
+        dLower = max(dLower, ecc)
+        #Tighten the bounds of every node
+        lower = np.maximum(lower, np.maximum(ecc - dist, dist))
+        upper = np.minimum(upper, ecc + dist)
+        lower[v] = upper[v] = ecc
+        dUpper = min(dUpper, upper.max())
+        if dUpper - dLower <= 1e-12 * dUpper:
+            break
+        #Drop nodes that can no longer change the diameter
+        candidates &= ~(((upper <= dLower) & (lower >= dUpper / 2)) | (lower == upper))
+        if not candidates.any():
+            break
+        idx = np.flatnonzero(candidates)
+        v = int(idx[np.argmax(upper[idx])] if pickHigh else idx[np.argmin(lower[idx])])
+        pickHigh = not pickHigh
+    return _diameter_result(dLower, searches, pair, return_searches, return_pair)
+
+
+def _diameter_result(diameter, searches, pair, return_searches, return_pair):
+    result = (diameter,) + ((searches,) if return_searches else ()) + ((pair,) if return_pair else ())
+    return result if len(result) > 1 else diameter
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0..n-1 (union by size, path halving).
+    The members of each set are kept with its root and merged smaller
+    into larger, so each node moves O(log n) times in total.
+
+    The root of the largest set is tracked as sets are merged. Ties go to
+    the set holding the lowest rank (by default the node number), so the
+    choice matches NetworkX's max(connected_components(G), key=len) when
+    ranks follow the order nodes were added to G.
+    """
+
+    def __init__(self, n, rank=None):
+        self.parent = list(range(n))
+        self.members = [[i] for i in range(n)]
+        self.rank = list(range(n)) if rank is None else list(rank)
+        self.n_sets = n
+        self.largest = None
+        if n:
+            self.largest = self.rank.index(min(self.rank))
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i, j):
+        """Merge the sets holding i and j; return False if already joined."""
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return False
+        if len(self.members[i]) < len(self.members[j]):
+            i, j = j, i
+        self.parent[j] = i
+        self.members[i].extend(self.members[j])
+        self.members[j] = None
+        self.rank[i] = min(self.rank[i], self.rank[j])
+        self.n_sets -= 1
+        #Only the merged set can overtake the current largest (and it
+        #always does if it absorbed it)
+        best = self.largest
+        if best == j or (len(self.members[i]), -self.rank[i]) > (len(self.members[best]), -self.rank[best]):
+            self.largest = i
+        return True
+
+
+class IncrementalDistances:
+    """
+    All-pairs shortest path distances of every component of a growing
+    graph, updated as edges are added.
+
+    An edge (a, b, w) inside a component relaxes every pair through it:
+        D = min(D, D[:,a] + w + D[b,:], D[:,b] + w + D[a,:])
+    and is skipped outright if it is no shorter than D[a,b]. A pair (x, y)
+    can only get shorter if D[x,a] + w < D[x,b] and D[y,b] + w < D[y,a]
+    (or the same with a and b swapped), so only that block is updated. An edge
+    joining two components builds the merged matrix from the two blocks,
+    the single bridge giving the cross distances.
+
+    Components larger than max_nodes keep no matrix (memory is O(m^2)).
+    When a component receives more shortening edges in one step than
+    updating is worth (see budget), its matrix is marked stale and rebuilt
+    from scratch with csgraph the next time it is needed.
+    """
+
+    def __init__(self, n, max_nodes=4000):
+        self.max_nodes = max_nodes
+        self.pos = np.zeros(n, dtype=np.intp)
+        #Component record keyed by union-find root
+        self.comps = {i: {'nodes': np.array([i]), 'D': np.zeros((1, 1)), 'edges': 0,
+                          'stale': False, 'updates': 0} for i in range(n)}
+
+    def new_step(self):
+        """Reset the per-step update counts."""
+        for comp in self.comps.values():
+            comp['updates'] = 0
+
+    def budget(self, comp):
+        """
+        Number of per-edge updates (about m^2 each) worth doing in one step
+        before a full rebuild (m searches over the component's edges) is
+        cheaper.
+        """
+        m = len(comp['nodes'])
+        return max(1, int(10 * 2 * comp['edges'] / m * np.log2(m + 1)))
+
+    def add_within(self, root, a, b, w):
+        """Add edge (a, b, w) inside the component rooted at root."""
+        comp = self.comps[root]
+        comp['edges'] += 1
+        D = comp['D']
+        if D is None or comp['stale']:
+            return
+        pa, pb = self.pos[a], self.pos[b]
+        if D[pa, pb] <= w:
+            return
+        comp['updates'] += 1
+        if comp['updates'] > self.budget(comp):
+            comp['stale'] = True
+            return
+        #D is symmetric, so rows are used in place of columns
+        da, db = D[pa], D[pb]
+        P = (da + w < db).nonzero()[0]
+        Q = (db + w < da).nonzero()[0]
+        block = np.minimum(D[P[:, None], Q], da[P, None] + (w + db[Q]))
+        D[P[:, None], Q] = block
+        D[Q[:, None], P] = block.T
+
+    def merge(self, rootA, rootB, a, b, w, root):
+        """Join components rootA (holding a) and rootB (holding b) by edge (a, b, w) into root."""
+        A, B = self.comps.pop(rootA), self.comps.pop(rootB)
+        mA = len(A['nodes'])
+        nodes = np.concatenate([A['nodes'], B['nodes']])
+        D = None
+        stale = A['stale'] or B['stale'] or A['D'] is None or B['D'] is None
+        if len(nodes) <= self.max_nodes and not stale:
+            DA, DB = A['D'], B['D']
+            D = np.empty((len(nodes), len(nodes)))
+            D[:mA, :mA] = DA
+            D[mA:, mA:] = DB
+            D[:mA, mA:] = DA[:, self.pos[a], None] + w + DB[None, self.pos[b], :]
+            D[mA:, :mA] = D[:mA, mA:].T
+        self.pos[B['nodes']] += mA
+        self.comps[root] = {'nodes': nodes, 'D': D, 'edges': A['edges'] + B['edges'] + 1,
+                            'stale': stale and len(nodes) <= self.max_nodes,
+                            'updates': A['updates'] + B['updates']}
+
+    def matrix(self, root, edges):
+        """
+        Return the distance matrix of a component (rows and columns in the
+        order of its nodes), rebuilding it if stale, or None if the
+        component is too large to hold one. edges is a callable returning
+        the component's edges as global node indices (i, j, w).
+        """
+        from scipy.sparse import csgraph
+        comp = self.comps[root]
+        if comp['stale']:
+            i, j, w = edges()
+            A = csr_graph(self.pos[i], self.pos[j], w, len(comp['nodes']))
+            comp['D'] = csgraph.dijkstra(A, directed=False)
+            comp['stale'] = False
+        return comp['D']
+
+
+class ThresholdSweep:
+    """
+    Incremental edge-threshold sweep of a weighted graph.
+
+    Edges are sorted by weight once; advance(t) then adds only the edges
+    with weights up to t that were not yet added. Thresholds must be
+    visited in increasing order (or the sweep reset() to start over).
+    When components tie for largest, the one holding the node listed
+    first in the edge list is used (as a NetworkX graph built from the
+    edge list would).
+
+    If max_matrix_nodes is set, the all-pairs distances of each component
+    (up to that many nodes) are kept up to date as edges are added (see
+    IncrementalDistances) and largest_diameter() reads the diameter off
+    the matrix; larger components fall back to weighted_diameter().
+
+    changed_components() returns the components that gained edges in the
+    last advance(), so per-component measures need only be recomputed
+    for those.
+
+    Usage:
+    >>> sweep = ThresholdSweep(u, v, w)
+    >>> for t in range(1000, 10000, 1000):
+    ...     sweep.advance(t)
+    ...     print(t, sweep.n_components, len(sweep.largest_nodes()))
+    """
+
+    def __init__(self, u, v, w, nodes=None, max_matrix_nodes=None):
+        u = np.asarray(u)
+        v = np.asarray(v)
+        w = np.asarray(w, dtype=np.float64)
+        order = np.argsort(w, kind='stable')
+        self.w = w[order]
+        #Nodes are numbered by their position in the sorted node list and
+        #ranked by their first appearance in the edge list
+        uv = np.column_stack([u, v]).ravel()
+        if nodes is None:
+            nodes = np.unique(uv)
+        self.nodes = np.asarray(nodes)
+        rank = np.full(len(self.nodes), uv.size, dtype=np.int64)
+        np.minimum.at(rank, np.searchsorted(self.nodes, uv), np.arange(uv.size))
+        self.ui = np.searchsorted(self.nodes, u[order])
+        self.vi = np.searchsorted(self.nodes, v[order])
+        self.rank = rank.tolist()
+        self.max_matrix_nodes = max_matrix_nodes
+        self.reset()
+
+    def reset(self):
+        """Remove all edges, so thresholds can be swept again from the lowest."""
+        self.uf = UnionFind(len(self.nodes), self.rank)
+        self.n_edges = 0
+        self.changed = set()
+        self.threshold = -np.inf
+        self.dist = None
+        if self.max_matrix_nodes:
+            self.dist = IncrementalDistances(len(self.nodes), self.max_matrix_nodes)
+
+    @property
+    def n_components(self):
+        """Number of connected components among all nodes."""
+        return self.uf.n_sets
+
+    def advance(self, threshold):
+        """Add all edges with a weight <= threshold. Returns the number added."""
+        if threshold < self.threshold:
+            raise ValueError("Thresholds must be visited in increasing order")
+        self.threshold = threshold
+        end = int(np.searchsorted(self.w, threshold, side='right'))
+        union = self.uf.union
+        find = self.uf.find
+        if self.dist is None:
+            for i, j in zip(self.ui[self.n_edges:end].tolist(), self.vi[self.n_edges:end].tolist()):
+                union(i, j)
+        else:
+            self.dist.new_step()
+            for i, j, w in zip(self.ui[self.n_edges:end].tolist(),
+                               self.vi[self.n_edges:end].tolist(),
+                               self.w[self.n_edges:end].tolist()):
+                ri, rj = find(i), find(j)
+                if ri == rj:
+                    self.dist.add_within(ri, i, j, w)
+                else:
+                    union(i, j)
+                    self.dist.merge(ri, rj, i, j, w, find(i))
+        #Roots of the components that gained edges
+        self.changed = {find(i) for i in self.ui[self.n_edges:end].tolist()}
+        added = end - self.n_edges
+        self.n_edges = end
+        return added
+
+    def changed_components(self):
+        """
+        Return the components that gained edges in the last advance(), as
+        a list of (node IDs, edges) with the edges as arrays of node IDs
+        (u, v) and weights, largest component first. Centrality and other
+        per-component measures of every other component are unchanged.
+        """
+        roots = sorted(self.changed, key=lambda r: -len(self.uf.members[r]))
+        comp = np.full(len(self.nodes), -1, dtype=np.intp)
+        for k, r in enumerate(roots):
+            comp[self.uf.members[r]] = k
+        ui, vi, w = self.ui[:self.n_edges], self.vi[:self.n_edges], self.w[:self.n_edges]
+        edgeComp = comp[ui]
+        keep = np.flatnonzero(edgeComp >= 0)
+        keep = keep[np.argsort(edgeComp[keep], kind='stable')]
+        bounds = np.searchsorted(edgeComp[keep], np.arange(len(roots) + 1))
+        components = []
+        for k, r in enumerate(roots):
+            e = keep[bounds[k]:bounds[k+1]]
+            components.append((self.nodes[np.sort(self.uf.members[r])],
+                               (self.nodes[ui[e]], self.nodes[vi[e]], w[e])))
+        return components
+
+    def largest_members(self):
+        """Return the node indices of the largest component."""
+        if self.uf.largest is None:
+            return np.empty(0, dtype=np.intp)
+        return np.array(self.uf.members[self.uf.largest], dtype=np.intp)
+
+    def largest_nodes(self):
+        """Return the node IDs of the largest component."""
+        return self.nodes[self.largest_members()]
+
+    def largest_edges(self):
+        """
+        Return the edges added so far that lie in the largest component,
+        as arrays of node indices (i, j) and weights.
+        """
+        inLargest = np.zeros(len(self.nodes), dtype=bool)
+        inLargest[self.largest_members()] = True
+        ui = self.ui[:self.n_edges]
+        keep = inLargest[ui]
+        return ui[keep], self.vi[:self.n_edges][keep], self.w[:self.n_edges][keep]
+
+    def largest_diameter(self, return_searches=False):
+        """
+        Return the exact weighted diameter of the largest component (see
+        weighted_diameter).
+        """
+        #No edge at or below the threshold yet: no component to measure
+        if self.dist is not None and self.uf.largest is not None:
+            D = self.dist.matrix(self.uf.largest, self.largest_edges)
+            if D is not None:
+                return (D.max(), 0) if return_searches else D.max()
+        members = self.largest_members()
+        i, j, w = self.largest_edges()
+        #Renumber the component's nodes 0..m-1
+        local = np.empty(len(self.nodes), dtype=np.intp)
+        local[members] = np.arange(len(members))
+        A = csr_graph(local[i], local[j], w, len(members))
+        return weighted_diameter(A, return_searches)
+
+    def largest_graph(self):
+        """Return the largest component as a NetworkX graph (weight attribute)."""
+        import networkx as nx
+        G = nx.Graph()
+        G.add_nodes_from(self.largest_nodes().tolist())
+        i, j, w = self.largest_edges()
+        G.add_weighted_edges_from(zip(self.nodes[i].tolist(), self.nodes[j].tolist(), w.tolist()))
+        return G
+
+
+#%% CENTRALITY
+#CSR graph made available to the worker processes (set by _init_worker)
+_shared = {}
+
+
+def _init_worker(indptr, indices, data, labels=None):
+    """Pool initializer: rebuild the CSR graph (and its component labels) once per worker."""
+    from scipy import sparse
+    n = len(indptr) - 1
+    _shared['A'] = sparse.csr_matrix((data, indices, indptr), shape=(n, n))
+    if labels is not None:
+        #Nodes of each component, grouped
+        order = np.argsort(labels, kind='stable')
+        _shared['members'] = (order, np.searchsorted(labels[order], np.arange(labels.max() + 2)))
+
+
+def _worker_graph(comp):
+    """
+    The graph a worker task runs on: the whole graph, or one of its
+    connected components (kept for the next task, as tasks of a
+    component come together).
+    """
+    if comp is None:
+        return _shared['A']
+    if _shared.get('comp') != comp:
+        order, bounds = _shared['members']
+        idx = order[bounds[comp]:bounds[comp + 1]]
+        _shared.update(comp=comp, sub=_shared['A'][idx][:, idx].tocsr())
+    return _shared['sub']
+
+
+def source_dependencies(A, sources, chunk=256):
+    """
+    Return, for the connected graph with CSR adjacency A, the Brandes
+    dependencies of every node summed over the given sources
+    (unnormalized betweenness), their sum of squares, and the sum of
+    shortest path distances from each source.
+
+    For each source the edges (u, v) on a shortest path (dist[u] + w ==
+    dist[v], u settled before v) form a DAG. With nodes ranked by
+    distance, the path counts solve the lower triangular system
+    sigma = e_s + M sigma, and the dependencies the upper triangular
+    system delta = C (1 + delta) with C[u,v] = sigma[u] / sigma[v].
+    """
+    from scipy import sparse
+    from scipy.sparse import csgraph
+    from scipy.sparse.linalg import spsolve_triangular
+    n = A.shape[0]
+    rows = np.repeat(np.arange(n), np.diff(A.indptr))
+    cols, wts = A.indices, A.data
+    eye = sparse.identity(n, format='csr')
+    bc = np.zeros(n)
+    bc2 = np.zeros(n)
+    totals = np.empty(len(sources))
+    for c in range(0, len(sources), chunk):
+        batch = sources[c:c+chunk]
+        dists = np.atleast_2d(csgraph.dijkstra(A, directed=False, indices=batch))
+        for k, s in enumerate(batch):
+            dist = dists[k]
+            totals[c + k] = dist.sum()
+            #Rank nodes in the order they are settled
+            order = np.argsort(dist, kind='stable')
+            rank = np.empty(n, dtype=np.intp)
+            rank[order] = np.arange(n)
+            dag = (dist[rows] + wts == dist[cols]) & (rank[rows] < rank[cols])
+            u, v = rank[rows[dag]], rank[cols[dag]]
+            #Number of shortest paths from s to each node
+            M = sparse.csr_matrix((np.ones(u.size), (v, u)), shape=(n, n))
+            e = np.zeros(n)
+            e[0] = 1.0
+            sigma = spsolve_triangular(eye - M, e, lower=True)
+            #Dependency of s on each node
+            C = sparse.csr_matrix((sigma[u] / sigma[v], (u, v)), shape=(n, n))
+            delta = spsolve_triangular(eye - C, np.asarray(C.sum(axis=1)).ravel(), lower=False)
+            delta[0] = 0.0
+            delta = delta[rank]
+            bc += delta
+            bc2 += delta * delta
+    return bc, bc2, totals
+
+
+def distance_totals(A, sources, chunk=256):
+    """Sum of shortest path distances from each source (for closeness)."""
+    from scipy.sparse import csgraph
+    totals = np.empty(len(sources))
+    for c in range(0, len(sources), chunk):
+        batch = sources[c:c+chunk]
+        totals[c:c+len(batch)] = np.atleast_2d(
+            csgraph.dijkstra(A, directed=False, indices=batch)).sum(axis=1)
+    return totals
+
+
+def _dependencies_task(task):
+    """Worker task: dependencies for a (component, chunk of sources) task."""
+    comp, sources = task
+    return source_dependencies(_worker_graph(comp), sources)
+
+
+def _totals_task(task):
+    """Worker task: distance totals for a (component, chunk of sources) task."""
+    comp, sources = task
+    return distance_totals(_worker_graph(comp), sources)
+
+
+def _centrality_task(task):
+    """Worker task: centrality of a whole component (see component_centrality)."""
+    comp, samples, epsilon, delta, seed = task
+    return component_centrality(_worker_graph(comp), 1, samples, epsilon, delta,
+                                np.random.default_rng(seed))
+
+
+def _removals_task(task):
+    """Worker task: node removal diameters for a (component, chunk of nodes) task."""
+    comp, nodes = task
+    return removal_diameters(_worker_graph(comp), nodes)
+
+
+class _SourceRunner:
+    """
+    Runs per-source (or per-node) computations on one graph, either in
+    this process or spread over a process pool (workers > 1) that holds
+    the graph.
+
+    Given the connected component labels of the graph, one pool serves
+    every component: select one with component() before running on it.
+    """
+
+    def __init__(self, A, workers=1, labels=None):
+        self.A = A
+        self.workers = workers
+        self.labels = labels
+        self.comp = None
+        self.graph = A
+        self.pool = None
+        if workers > 1 and A.shape[0] > 2 * workers:
+            from CostDistance import _set_executable
+            _set_executable()
+            self.pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                             initargs=(A.indptr, A.indices, A.data, labels))
+
+    def component(self, comp, idx):
+        """Run on connected component comp (its nodes idx); returns its CSR graph."""
+        self.A = self.graph[idx][:, idx].tocsr()
+        self.comp = comp
+        return self.A
+
+    def map(self, func, task, tasks):
+        """[func(t) for t in tasks], or task(t) for each over the pool, one at a time."""
+        if self.pool is None:
+            return [func(t) for t in tasks]
+        return self.pool.map(task, tasks, chunksize=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+
+    def _map(self, func, task, sources):
+        if self.pool is None or len(sources) < 2 * self.workers:
+            return [func(self.A, sources)]
+        chunks = [(self.comp, c) for c in np.array_split(sources, self.workers * 4) if c.size]
+        return self.pool.map(task, chunks)
+
+    def dependencies(self, sources):
+        """Summed dependencies, their squares and distance totals (see source_dependencies)."""
+        results = self._map(source_dependencies, _dependencies_task, sources)
+        return (np.sum([r[0] for r in results], axis=0),
+                np.sum([r[1] for r in results], axis=0),
+                np.concatenate([r[2] for r in results]))
+
+    def totals(self, sources):
+        """Distance totals of the sources (see distance_totals)."""
+        return np.concatenate(self._map(distance_totals, _totals_task, sources))
+
+    def removals(self, nodes):
+        """Components and diameter after removing each node (see removal_diameters)."""
+        return np.concatenate(self._map(removal_diameters, _removals_task, nodes))
+
+
+def pool_map(func, tasks, workers=1):
+    """
+    Return [func(task) for task in tasks], computed over a process pool
+    when workers > 1. func must be a module-level function, so the
+    workers can import it. Tasks are handed out one at a time, largest
+    first if they are listed that way.
+    """
+    tasks = list(tasks)
+    if workers < 2 or len(tasks) < 2:
+        return [func(task) for task in tasks]
+    from CostDistance import _set_executable
+    _set_executable()
+    with multiprocessing.Pool(min(workers, len(tasks))) as pool:
+        return pool.map(func, tasks, chunksize=1)
+
+
+def hoeffding_samples(n, epsilon, delta):
+    """
+    Number of sampled sources after which the normalized betweenness of
+    every node of an n-node graph is within epsilon of its exact value
+    with probability 1 - delta (Hoeffding bound over the n nodes, each
+    sample lying in [0, n / (n-1)]).
+    """
+    R = n / (n - 1)
+    return int(math.ceil(R * R * math.log(2 * n / delta) / (2 * epsilon * epsilon)))
+
+
+def sampling_error(n, k, mean, var, delta):
+    """
+    Half-width of the confidence interval around the sampled betweenness
+    of each node, from k of the n sources sampled without replacement:
+    the smaller of the Hoeffding-Serfling bound (the same for all nodes)
+    and the empirical Bernstein bound (tighter for nodes whose
+    dependencies vary little), each holding for all nodes at once with
+    probability 1 - delta/2.
+    """
+    if k >= n:
+        return np.zeros_like(mean)
+    R = n / (n - 1)
+    log = math.log(4 * n / delta)
+    hoeffding = R * math.sqrt((1 - (k - 1) / n) * log / (2 * k))
+    bernstein = np.sqrt(2 * var * log / k) + 7 * R * log / (3 * (k - 1))
+    return np.minimum(bernstein, hoeffding)
+
+
+def sampled_betweenness(runner, n, samples=None, epsilon=None, delta=0.1, rng=None):
+    """
+    Approximate normalized betweenness of the nodes of a connected n-node
+    graph from a uniform sample of sources (without replacement).
+
+    With samples set, that many sources are used. With epsilon set, the
+    sample is grown adaptively, doubling each round, until every node's
+    confidence interval half-width (see sampling_error; delta is split
+    over the rounds) is at most epsilon, or until the Hoeffding sample
+    size for epsilon is reached.
+
+    Returns the estimates, their half-widths and the number of sources.
+    """
+    rng = np.random.default_rng(rng)
+    order = rng.permutation(n)
+    scale = n / ((n - 1) * (n - 2))
+    if samples is not None:
+        plan = [min(int(samples), n)]
+    else:
+        kMax = min(hoeffding_samples(n, epsilon, delta), n)
+        k = min(max(32, kMax // 32), kMax)
+        plan = [k]
+        while k < kMax:
+            k = min(2 * k, kMax)
+            plan.append(k)
+    bc = np.zeros(n)
+    bc2 = np.zeros(n)
+    done = 0
+    for r, k in enumerate(plan):
+        b, b2, _ = runner.dependencies(order[done:k])
+        bc += b
+        bc2 += b2
+        done = k
+        mean = bc * scale / k
+        var = np.maximum(bc2 * scale * scale / k - mean * mean, 0) * k / max(k - 1, 1)
+        roundDelta = delta if samples is not None else delta / 2 ** (r + 1)
+        error = sampling_error(n, k, mean, var, roundDelta)
+        if epsilon is not None and error.max() <= epsilon:
+            break
+    return mean, error, done
+
+
+def component_centrality(A, workers=1, samples=None, epsilon=None, delta=0.1, rng=None,
+                         runner=None):
+    """
+    Degree, closeness and betweenness centrality of the nodes of the
+    connected graph with CSR adjacency A, normalized as NetworkX does,
+    and the half-width of the betweenness confidence interval (zero when
+    exact). Betweenness is sampled (see sampled_betweenness) if samples
+    or epsilon is set. With workers > 1 the sources are split over a
+    process pool, or over the pool of runner (a _SourceRunner set to A's
+    component) if given. Returns four arrays aligned with the rows of A.
+    """
+    n = A.shape[0]
+    if n < 2:
+        return np.ones(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    if runner is None:
+        with _SourceRunner(A, workers) as runner:
+            return component_centrality(A, workers, samples, epsilon, delta, rng, runner)
+    sampled = n > 2 and (samples is not None and samples < n or epsilon is not None)
+    if sampled:
+        bc, error, k = sampled_betweenness(runner, n, samples, epsilon, delta, rng)
+        totals = runner.totals(np.arange(n))
+    else:
+        bc, _, totals = runner.dependencies(np.arange(n))
+        error = np.zeros(n)
+        if n > 2:
+            bc = bc / ((n - 1) * (n - 2))
+    degree = np.diff(A.indptr) / (n - 1)
+    closeness = np.where(totals > 0, (n - 1) / np.where(totals > 0, totals, 1), 0.0)
+    return degree, closeness, bc, error
+
+
+def centrality(u, v, w, workers=1, samples=None, epsilon=None, delta=0.1, seed=None):
+    """
+    Degree, closeness and betweenness centrality of every node of the
+    graph with edges (u, v, w), computed one connected component at a
+    time (as CalculatePatchConnectivityAttributes.py does with NetworkX).
+    See component_centrality for the sampling options; seed fixes the
+    sampled sources.
+
+    Returns the node IDs and four arrays aligned with them: degree,
+    closeness, betweenness and the betweenness confidence half-width.
+    """
+    from scipy.sparse import csgraph
+    nodes = np.unique(np.concatenate([np.asarray(u), np.asarray(v)]))
+    A = csr_graph(np.searchsorted(nodes, u), np.searchsorted(nodes, v), w, len(nodes))
+    nComps, labels = csgraph.connected_components(A, directed=False)
+    #Each component samples its sources from its own stream, whatever the workers
+    seeds = np.random.SeedSequence(seed).spawn(nComps)
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(nComps + 1))
+    members = [order[bounds[c]:bounds[c + 1]] for c in range(nComps)]
+    results = np.zeros((4, len(nodes)))
+    #One pool, holding the whole graph, serves every component: components
+    #too large for one worker have their sources split over the pool, the
+    #others are handed out whole, largest first
+    sizes = np.diff(bounds)
+    split = sizes > max(len(nodes) // max(workers, 1), 2 * workers) if workers > 1 \
+        else np.zeros(nComps, dtype=bool)
+    with _SourceRunner(A, workers, labels) as runner:
+        for comp in np.flatnonzero(split).tolist():
+            sub = runner.component(comp, members[comp])
+            results[:, members[comp]] = component_centrality(
+                sub, workers, samples, epsilon, delta, np.random.default_rng(seeds[comp]), runner)
+        whole = [comp for comp in np.argsort(-sizes, kind='stable').tolist() if not split[comp]]
+        solved = runner.map(lambda t: component_centrality(A[members[t[0]]][:, members[t[0]]].tocsr(),
+                                                           1, *t[1:4], np.random.default_rng(t[4])),
+                            _centrality_task,
+                            [(comp, samples, epsilon, delta, seeds[comp]) for comp in whole])
+        for comp, result in zip(whole, solved):
+            results[:, members[comp]] = result
+    return (nodes,) + tuple(results)
+
+
+#%% NODE REMOVAL SENSITIVITY
+def largest_component(A):
+    """
+    Nodes of the largest connected component of the graph with CSR
+    adjacency A (of equal sized components, the one holding the lowest
+    numbered node), and the number of components.
+    """
+    from scipy.sparse import csgraph
+    nComps, labels = csgraph.connected_components(A, directed=False)
+    return np.flatnonzero(labels == np.argmax(np.bincount(labels))), nComps
+
+
+def removal_diameters(A, nodes):
+    """
+    For each node, the number of connected components of the graph with
+    CSR adjacency A once that node is removed, and the weighted diameter
+    of its largest component then. Returns an (n, 2) array.
+    """
+    results = np.zeros((len(nodes), 2))
+    keep = np.ones(A.shape[0], dtype=bool)
+    for k, v in enumerate(nodes):
+        keep[v] = False
+        B = A[keep][:, keep]
+        keep[v] = True
+        members, nComps = largest_component(B)
+        results[k] = nComps, weighted_diameter(B[members][:, members].tocsr())
+    return results
+
+
+def articulation_points(A):
+    """
+    Boolean mask of the cut nodes of the graph with CSR adjacency A
+    (nodes whose removal splits their component), from one iterative
+    depth-first search (Hopcroft & Tarjan 1973).
+    """
+    n = A.shape[0]
+    indptr, indices = A.indptr.tolist(), A.indices.tolist()
+    disc = [-1] * n
+    low = [0] * n
+    cut = np.zeros(n, dtype=bool)
+    t = 0
+    for root in range(n):
+        if disc[root] >= 0:
+            continue
+        disc[root] = low[root] = t
+        t += 1
+        children = 0
+        #Stack of (node, parent, next neighbor position)
+        stack = [(root, -1, indptr[root])]
+        while stack:
+            v, parent, i = stack[-1]
+            if i < indptr[v + 1]:
+                stack[-1] = (v, parent, i + 1)
+                u = indices[i]
+                if disc[u] < 0:
+                    disc[u] = low[u] = t
+                    t += 1
+                    if v == root:
+                        children += 1
+                    stack.append((u, v, indptr[u]))
+                elif u != parent:
+                    low[v] = min(low[v], disc[u])
+            else:
+                stack.pop()
+                if stack:
+                    p = stack[-1][0]
+                    low[p] = min(low[p], low[v])
+                    if p != root and low[v] >= disc[p]:
+                        cut[p] = True
+        cut[root] = children > 1
+    return cut
+
+
+def diameter_sensitivity(u, v, w, workers=1):
+    """
+    Sensitivity of the graph with edges (u, v, w) to the removal of each
+    node in turn: whether the removal splits the graph into more
+    components (a cut node), and the drop in the weighted diameter of the
+    largest component (d0 - dx; negative if the diameter grows).
+
+    Removals are solved on the shared CSR graph, over a process pool when
+    workers > 1, except for nodes that provably leave the diameter
+    unchanged:
+      - nodes outside the largest component, which stays the largest;
+      - leaves of the largest component that are not an end of the
+        diametral pair found (no shortest path runs through a leaf, so
+        that pair keeps its distance), provided the component stays
+        strictly larger than any other.
+    Their cut flags come from the graph's articulation points.
+
+    Returns the node IDs and three arrays aligned with them: the cut
+    flags (0/1), the diameter changes, and whether each removal was
+    solved (False where it was skipped).
+    """
+    from scipy.sparse import csgraph
+    nodes = np.unique(np.concatenate([np.asarray(u), np.asarray(v)]))
+    n = len(nodes)
+    A = csr_graph(np.searchsorted(nodes, u), np.searchsorted(nodes, v), w, n)
+    members, nComps = largest_component(A)
+    d0, (a, b) = weighted_diameter(A[members][:, members].tocsr(), return_pair=True)
+    inLargest = np.zeros(n, dtype=bool)
+    inLargest[members] = True
+    sizes = np.sort(np.bincount(csgraph.connected_components(A, directed=False)[1]))
+    runnerUp = sizes[-2] if len(sizes) > 1 else 0
+
+    #Removals that cannot change the diameter
+    skip = ~inLargest
+    if len(members) - 1 > runnerUp:
+        leaves = inLargest & (np.diff(A.indptr) == 1)
+        leaves[members[[a, b]]] = False
+        skip |= leaves
+    cuts = articulation_points(A).astype(int)
+    delta = np.zeros(n)
+
+    solve = np.flatnonzero(~skip)
+    with _SourceRunner(A, workers) as runner:
+        results = runner.removals(solve) if solve.size else np.zeros((0, 2))
+    cuts[solve] = results[:, 0] > nComps
+    delta[solve] = d0 - results[:, 1]
+    return nodes, cuts, delta, ~skip
+
+
+#%% EDGE LIST COMPARISON
+def compare_edges(u, v, w, refU, refV, refW, chunk=256, atol=0.0):
+    """
+    Compare a reduced edge list (u, v, w), such as a minimum planar
+    graph's, with a reference edge list (refU, refV, refW) of the same
+    patches, such as the full pairwise list. Returns a dict of:
+
+      edges, ref_edges    number of edges in each list
+      shared              patch pairs in both lists
+      cost_equal          shared pairs whose costs agree (to 1e-9, relative,
+                          or atol, whichever is larger)
+      below_ref           shared pairs cheaper than in the reference
+      cost_diff_mean/max  cost minus reference cost, over shared pairs
+      preserved           reference edges whose cost is matched by the
+                          shortest path between their patches through the
+                          reduced graph
+      unreachable         reference edges whose patches the reduced graph
+                          does not connect
+      stretch_mean/max    that shortest path over the reference cost, over
+                          the reference edges whose patches are connected
+      components, ref_components
+                          number of connected components of each graph
+      mst, ref_mst        total cost of the minimum spanning forest of each
+
+    Both graphs are built over every patch in either list. Set atol to the
+    rounding error of the reference costs if they were rounded (such as
+    EdgeList.CSV_TOLERANCE for a CSV edge list).
+    """
+    from scipy.sparse import csgraph
+    nodes = np.unique(np.concatenate([u, v, refU, refV]))
+    n = len(nodes)
+    i, j = np.searchsorted(nodes, u), np.searchsorted(nodes, v)
+    ri, rj = np.searchsorted(nodes, refU), np.searchsorted(nodes, refV)
+    A = csr_graph(i, j, w, n)
+    R = csr_graph(ri, rj, refW, n)
+    stats = dict(edges=len(u), ref_edges=len(refU))
+
+    #Costs of the pairs in both lists
+    key = np.minimum(i, j).astype(np.int64) * n + np.maximum(i, j)
+    refKey = np.minimum(ri, rj).astype(np.int64) * n + np.maximum(ri, rj)
+    _, a, b = np.intersect1d(key, refKey, assume_unique=True, return_indices=True)
+    diff = np.asarray(w, dtype=np.float64)[a] - np.asarray(refW, dtype=np.float64)[b]
+    tol = np.maximum(1e-9 * np.maximum(np.abs(np.asarray(refW, dtype=np.float64)[b]), 1), atol)
+    stats.update(shared=a.size, cost_equal=int((np.abs(diff) <= tol).sum()),
+                 below_ref=int((diff < -tol).sum()),
+                 cost_diff_mean=diff.mean() if diff.size else 0.0,
+                 cost_diff_max=diff.max(initial=0.0))
+
+    #Shortest paths through the reduced graph between the reference pairs
+    sources, inverse = np.unique(ri, return_inverse=True)
+    dist = np.empty(len(ri))
+    for c in range(0, len(sources), chunk):
+        batch = sources[c:c+chunk]
+        d = np.atleast_2d(csgraph.dijkstra(A, directed=False, indices=batch))
+        inBatch = (inverse >= c) & (inverse < c + len(batch))
+        dist[inBatch] = d[inverse[inBatch] - c, rj[inBatch]]
+    ref = np.asarray(refW, dtype=np.float64)
+    reached = np.isfinite(dist)
+    stretch = dist[reached] / np.maximum(ref[reached], 1e-12)
+    stats.update(preserved=int((dist <= np.maximum(ref * (1 + 1e-9), ref + atol)).sum()),
+                 unreachable=int((~reached).sum()),
+                 stretch_mean=stretch.mean() if stretch.size else 1.0,
+                 stretch_max=stretch.max(initial=1.0))
+
+    stats.update(components=csgraph.connected_components(A, directed=False)[0],
+                 ref_components=csgraph.connected_components(R, directed=False)[0],
+                 mst=csgraph.minimum_spanning_tree(A).sum(),
+                 ref_mst=csgraph.minimum_spanning_tree(R).sum())
+    return stats
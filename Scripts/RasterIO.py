@@ -0,0 +1,407 @@
+'''
+Raster I/O
+Spring 2021 - John.Fay@duke.edu
+
+Reading and writing the rasters of the PatchConnect workflow through one
+of two interchangeable backends, so the scripts can run with or without
+ArcGIS:
+
+  arcpy - any raster ArcGIS reads (geodatabase rasters, grids, ...),
+          through arcpy and the Spatial Analyst extension. Used by the
+          toolbox.
+  numpy - GeoTIFFs (.tif, read and written with rasterio) and NumPy
+          arrays (.npy) with a JSON sidecar (<name>.npy.json) holding
+          their georeferencing:
+              {"transform": [cellSize, 0, left, 0, -cellSize, top],
+               "nodata": -9999, "wkid": 26917, "wkt": "PROJCS[...]"}
+          (the transform is in rasterio/GDAL affine order). Needs no
+          ArcGIS; .npy rasters need nothing but NumPy.
+
+The backend is picked from the raster path (see get_backend): GeoTIFFs
+are read with arcpy whenever ArcGIS is installed, and with rasterio
+otherwise. Both give the patch and cost arrays over the area where the
+two rasters intersect, with nodata cells set to NODATA, and the area of
+each patch.
+
+Rasters too large for memory can instead be copied, a block of rows at a
+time, to memory-mapped arrays on disk (see read_pair_tiled).
+
+Messages and progress are passed on to ArcGIS (add_message and the
+set_progressor functions) only when arcpy has been imported, as it is
+when the scripts run from the toolbox; otherwise messages are printed.
+'''
+
+import os, sys, json, math
+import importlib.util
+import numpy as np
+
+#Value given to nodata cells in the arrays read
+NODATA = -9999
+
+#Rasters read and written by the numpy backend
+NUMPY_EXTENSIONS = ('.tif', '.tiff', '.npy')
+
+#Cells read at a time when copying rasters to memory-mapped arrays
+BLOCK_CELLS = 1 << 22
+
+
+#%% TOOL MESSAGES
+def _arcpy():
+    """The arcpy module, if it has been imported."""
+    return sys.modules.get('arcpy')
+
+def add_message(txt):
+    """Print a message, and show it in ArcGIS Pro when run from the toolbox."""
+    print(txt)
+    if _arcpy() is not None:
+        _arcpy().AddMessage(txt)
+
+def set_progressor(*args):
+    if _arcpy() is not None:
+        _arcpy().SetProgressor(*args)
+
+def set_progressor_label(label):
+    if _arcpy() is not None:
+        _arcpy().SetProgressorLabel(label)
+
+def set_progressor_position():
+    if _arcpy() is not None:
+        _arcpy().SetProgressorPosition()
+
+
+#%% GRIDS
+class Grid:
+    """
+    Georeferencing of a north-up raster with square cells: its upper left
+    corner, cell size, number of rows and columns, and coordinate system
+    (wkid and/or wkt, either may be missing).
+    """
+
+    def __init__(self, left, top, cellSize, rows, cols, wkid=None, wkt=''):
+        self.left = float(left)
+        self.top = float(top)
+        self.cellSize = float(cellSize)
+        self.rows = int(rows)
+        self.cols = int(cols)
+        self.wkid = wkid
+        self.wkt = wkt or ''
+
+    def __repr__(self):
+        return (f"Grid(left={self.left}, top={self.top}, cellSize={self.cellSize}, "
+                f"rows={self.rows}, cols={self.cols}, wkid={self.wkid})")
+
+    @property
+    def shape(self):
+        return (self.rows, self.cols)
+
+    @property
+    def right(self):
+        return self.left + self.cols * self.cellSize
+
+    @property
+    def bottom(self):
+        return self.top - self.rows * self.cellSize
+
+    @property
+    def transform(self):
+        """Affine transform, in rasterio/GDAL order (a, b, c, d, e, f)."""
+        return (self.cellSize, 0.0, self.left, 0.0, -self.cellSize, self.top)
+
+    @classmethod
+    def from_transform(cls, transform, rows, cols, wkid=None, wkt=''):
+        a, b, c, d, e, f = transform[:6]
+        if b or d or not math.isclose(a, -e):
+            raise ValueError("Only north-up rasters with square cells are supported")
+        return cls(c, f, a, rows, cols, wkid, wkt)
+
+    def offset(self, other):
+        """
+        (row, col) of other's upper left cell in this grid. The two grids
+        must have the same cell size and be aligned.
+        """
+        if not math.isclose(self.cellSize, other.cellSize, rel_tol=1e-9):
+            raise ValueError(f"Rasters have different cell sizes ({self.cellSize}, "
+                             f"{other.cellSize}): resample them to the same cells first")
+        row = (self.top - other.top) / self.cellSize
+        col = (other.left - self.left) / self.cellSize
+        if abs(row - round(row)) > 1e-6 or abs(col - round(col)) > 1e-6:
+            raise ValueError("Raster cells are not aligned: snap the rasters to the same cells first")
+        return round(row), round(col)
+
+    def intersect(self, other):
+        """The grid (in this grid's cells) of the area covered by both grids."""
+        row, col = self.offset(other)
+        r0, c0 = max(row, 0), max(col, 0)
+        r1, c1 = min(row + other.rows, self.rows), min(col + other.cols, self.cols)
+        if r1 <= r0 or c1 <= c0:
+            raise ValueError("Rasters do not overlap")
+        return self.window((r0, c0, r1, c1))
+
+    def window(self, window):
+        """The grid of a (row0, col0, row1, col1) window of this grid."""
+        r0, c0, r1, c1 = window
+        return Grid(self.left + c0 * self.cellSize, self.top - r0 * self.cellSize,
+                    self.cellSize, r1 - r0, c1 - c0, self.wkid, self.wkt)
+
+    def window_in(self, other):
+        """This grid as a (row0, col0, row1, col1) window of other."""
+        row, col = other.offset(self)
+        return (row, col, row + self.rows, col + self.cols)
+
+
+def set_nodata(arr, mask):
+    """Set the masked cells to NODATA, widening integer types that cannot hold it."""
+    if not mask.any():
+        return arr
+    dtype = np.result_type(arr.dtype, np.int16)
+    arr = arr.astype(dtype, copy=False)
+    arr[mask] = NODATA
+    return arr
+
+
+def tabulate_areas(arrPatch, cellSize):
+    """
+    Patch IDs (ascending) and areas in hectares of a patch array, with
+    nodata cells set to NODATA.
+    """
+    values = arrPatch[arrPatch != NODATA].astype(np.int64, copy=False)
+    if values.size and values.min() < 0:
+        ids, counts = np.unique(values, return_counts=True)
+    else:
+        counts = np.bincount(values)
+        ids = np.flatnonzero(counts)
+        counts = counts[ids]
+    return ids, counts * ((cellSize ** 2) / 10000.0)
+
+
+#%% BACKENDS
+class NumpyBackend:
+    """GeoTIFF (via rasterio) and .npy (with a JSON sidecar) rasters."""
+    name = 'numpy'
+
+    @staticmethod
+    def sidecar_path(path):
+        return path + '.json'
+
+    @staticmethod
+    def _rasterio():
+        try:
+            import rasterio
+        except ImportError:
+            raise ImportError("Reading and writing GeoTIFFs without ArcGIS requires rasterio "
+                              "(or use .npy rasters with a .npy.json sidecar)")
+        return rasterio
+
+    def describe(self, path):
+        """Grid of a raster."""
+        if path.lower().endswith('.npy'):
+            arr = np.load(path, mmap_mode='r')
+            with open(self.sidecar_path(path)) as f:
+                meta = json.load(f)
+            return Grid.from_transform(meta['transform'], *arr.shape[:2],
+                                       meta.get('wkid'), meta.get('wkt', ''))
+        rasterio = self._rasterio()
+        with rasterio.open(path) as src:
+            wkid = src.crs.to_epsg() if src.crs else None
+            wkt = src.crs.to_wkt() if src.crs else ''
+            return Grid.from_transform(tuple(src.transform), src.height, src.width, wkid, wkt)
+
+    def read(self, path, grid=None):
+        """
+        Read a raster (or the window of it covered by grid) as an array,
+        with nodata cells set to NODATA.
+        """
+        window = None if grid is None else grid.window_in(self.describe(path))
+        if path.lower().endswith('.npy'):
+            arr = np.load(path, mmap_mode='r')
+            if window is not None:
+                r0, c0, r1, c1 = window
+                arr = arr[r0:r1, c0:c1]
+            arr = np.array(arr)
+            with open(self.sidecar_path(path)) as f:
+                nodata = json.load(f).get('nodata')
+        else:
+            rasterio = self._rasterio()
+            with rasterio.open(path) as src:
+                if window is not None:
+                    r0, c0, r1, c1 = window
+                    window = rasterio.windows.Window(c0, r0, c1 - c0, r1 - r0)
+                arr = src.read(1, window=window)
+                nodata = src.nodata
+        mask = np.zeros(arr.shape, dtype=bool)
+        if nodata is not None and not (isinstance(nodata, float) and math.isnan(nodata)):
+            mask |= arr == nodata
+        if arr.dtype.kind == 'f':
+            mask |= np.isnan(arr)
+        return set_nodata(arr, mask)
+
+    def read_pair(self, patchPath, costPath):
+        """Patch and cost arrays over the area both rasters cover, and its grid."""
+        grid = self.describe(patchPath).intersect(self.describe(costPath))
+        return self.read(patchPath, grid), self.read(costPath, grid), grid
+
+    def write(self, arr, path, grid, nodata=None):
+        """Save an array as a raster with the given grid."""
+        if path.lower().endswith('.npy'):
+            np.save(path, arr)
+            meta = dict(transform=grid.transform, nodata=nodata, wkid=grid.wkid, wkt=grid.wkt)
+            with open(self.sidecar_path(path), 'w') as f:
+                json.dump(meta, f)
+            return
+        rasterio = self._rasterio()
+        crs = None
+        if grid.wkid:
+            crs = rasterio.crs.CRS.from_epsg(grid.wkid)
+        elif grid.wkt:
+            crs = rasterio.crs.CRS.from_wkt(grid.wkt)
+        with rasterio.open(path, 'w', driver='GTiff', height=grid.rows, width=grid.cols,
+                           count=1, dtype=arr.dtype, crs=crs, nodata=nodata,
+                           transform=rasterio.transform.Affine(*grid.transform),
+                           compress='deflate') as dst:
+            dst.write(arr, 1)
+
+    def patch_areas(self, path):
+        """Patch IDs (ascending) and their areas in hectares."""
+        return tabulate_areas(self.read(path), self.describe(path).cellSize)
+
+
+class ArcpyBackend:
+    """Rasters read and written with arcpy (requires ArcGIS and Spatial Analyst)."""
+    name = 'arcpy'
+
+    def __init__(self):
+        import arcpy
+        arcpy.CheckOutExtension("spatial")
+        self.arcpy = arcpy
+
+    def describe(self, path):
+        """Grid of a raster."""
+        desc = self.arcpy.Describe(path)
+        sr = desc.spatialReference
+        return Grid(desc.extent.XMin, desc.extent.YMax, desc.meanCellWidth,
+                    desc.height, desc.width, sr.factoryCode or None,
+                    sr.exportToString().split(';')[0])
+
+    def read_pair(self, patchPath, costPath):
+        """Patch and cost arrays over the area both rasters cover, and its grid."""
+        arcpy = self.arcpy
+        arcpy.env.cellSize = patchPath
+        arcpy.env.extent = patchPath
+        arcpy.env.snapRaster = patchPath
+        #Subset each raster to the other's extent
+        costRaster = arcpy.sa.ExtractByRectangle(costPath, patchPath, "INSIDE")
+        patchRaster = arcpy.sa.ExtractByRectangle(patchPath, costRaster, "INSIDE")
+        grid = self.describe(patchRaster)
+        llCorner = arcpy.Describe(patchRaster).extent.lowerLeft
+        arrPatch = arcpy.RasterToNumPyArray(patchRaster, lower_left_corner=llCorner,
+                                            nodata_to_value=NODATA)
+        arrCost = arcpy.RasterToNumPyArray(costRaster, lower_left_corner=llCorner,
+                                           nodata_to_value=NODATA)
+        return arrPatch, arrCost, grid
+
+    def read(self, path, grid=None):
+        """
+        Read a raster (or the window of it covered by grid, which must be
+        aligned with its cells) as an array, with nodata cells set to NODATA.
+        """
+        arcpy = self.arcpy
+        if grid is None:
+            return arcpy.RasterToNumPyArray(path, nodata_to_value=NODATA)
+        return arcpy.RasterToNumPyArray(path, arcpy.Point(grid.left, grid.bottom),
+                                        grid.cols, grid.rows, nodata_to_value=NODATA)
+
+    def write(self, arr, path, grid, nodata=None):
+        """Save an array as a raster with the given grid."""
+        arcpy = self.arcpy
+        raster = arcpy.NumPyArrayToRaster(arr, arcpy.Point(grid.left, grid.bottom),
+                                          grid.cellSize, grid.cellSize, nodata)
+        raster.save(path)
+
+    def patch_areas(self, path):
+        """Patch IDs and their areas in hectares, from the raster attribute table."""
+        cellSize2HA = (self.arcpy.Raster(path).meanCellWidth ** 2) / 10000.0
+        ids, areas = [], []
+        rows = self.arcpy.SearchCursor(path)
+        row = rows.next()
+        while row:
+            ids.append(row.VALUE)
+            areas.append(row.COUNT * cellSize2HA)
+            row = rows.next()
+        del row, rows
+        return np.array(ids), np.array(areas)
+
+
+#%% OUT OF CORE
+def _copy_blocks(backend, path, blocks, out, check=None):
+    """
+    Copy a raster to a memory-mapped array, one block (grid) of rows at a
+    time. Stops and returns False as soon as check(block) fails.
+    """
+    row = 0
+    for block in blocks:
+        arr = backend.read(path, block)
+        if check is not None and not check(arr):
+            return False
+        out[row:row + block.rows] = arr
+        row += block.rows
+    out.flush()
+    return True
+
+
+def read_pair_tiled(backend, patchPath, costPath, folder):
+    """
+    Out-of-core version of read_pair: copy the patch and cost rasters,
+    over the area both cover, to memory-mapped arrays in folder
+    (patch.npy and cost.npy), a block of rows at a time, and return them
+    (read-only) with their grid. Neither raster is ever held in memory.
+
+    Patch IDs are stored as int32 (a ValueError is raised for IDs that
+    are not integers or do not fit), and costs as float32 unless that
+    would change some of them (float64 then).
+    """
+    grid = backend.describe(patchPath).intersect(backend.describe(costPath))
+    step = max(1, BLOCK_CELLS // grid.cols)
+    blocks = [grid.window((r, 0, min(r + step, grid.rows), grid.cols))
+              for r in range(0, grid.rows, step)]
+    patchFN = os.path.join(folder, 'patch.npy')
+    costFN = os.path.join(folder, 'cost.npy')
+
+    def patch_ids(arr):
+        if arr.dtype.kind == 'f' and not np.array_equal(arr, np.round(arr)):
+            raise ValueError(f"{patchPath} holds patch IDs that are not integers")
+        info = np.iinfo(np.int32)
+        if arr.size and (arr.min() < info.min or arr.max() > info.max):
+            raise ValueError(f"{patchPath} holds patch IDs too large for 32 bit integers")
+        return True
+
+    arrPatch = np.lib.format.open_memmap(patchFN, 'w+', np.int32, grid.shape)
+    _copy_blocks(backend, patchPath, blocks, arrPatch, patch_ids)
+    del arrPatch
+
+    #Costs that float32 cannot hold exactly are kept as float64
+    arrCost = np.lib.format.open_memmap(costFN, 'w+', np.float32, grid.shape)
+    exact = _copy_blocks(backend, costPath, blocks, arrCost,
+                         lambda arr: np.array_equal(arr.astype(np.float32), arr))
+    del arrCost
+    if not exact:
+        arrCost = np.lib.format.open_memmap(costFN, 'w+', np.float64, grid.shape)
+        _copy_blocks(backend, costPath, blocks, arrCost)
+        del arrCost
+    return np.load(patchFN, mmap_mode='r'), np.load(costFN, mmap_mode='r'), grid
+
+
+def _arcpy_available():
+    """Whether arcpy is loaded or can be (without importing it)."""
+    return _arcpy() is not None or importlib.util.find_spec('arcpy') is not None
+
+
+def get_backend(path):
+    """
+    The backend for a raster path: numpy for .npy rasters, arcpy for
+    anything else when ArcGIS is installed, and numpy for .tif and .tiff
+    rasters when it is not.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy' or (ext in NUMPY_EXTENSIONS and not _arcpy_available()):
+        return NumpyBackend()
+    return ArcpyBackend()
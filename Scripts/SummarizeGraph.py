@@ -6,15 +6,28 @@
 #          Results are returned as a text file.
 #
 # Usage: SummarizeGraph.py <LCP edge list> <Min Threshold> <Max Threshold> <interval> <output>
+#            [<tolerance>] [--sensitivity <output>] [--sensitivity-threshold <cost>]
+#            [--workers <N>]
+#
+#        With a tolerance, the interval only sets a coarse first sweep: the
+#        thresholds around the diameter peak are then refined until the
+#        inflection distance is known to within the tolerance.
+#
+#        With --sensitivity, each node of the graph at the inflection
+#        distance (or --sensitivity-threshold) is removed in turn, and
+#        whether it is a cut node and the change in diameter are written
+#        to a second table (Node, Cuts, deltaD).
 #
 #-------------------------------------------------------------------------------------------
 # Updated for Python 3.5 (Spring 2018, John.Fay@duke.edu)
 
-import sys, arcpy
-import networkx as nx
+import time, argparse
+
+from EdgeList import load_edges
+import RasterIO
 
 #--Messaging function--
-def msg(msgText): print (msgText); arcpy.AddMessage(msgText); return
+def msg(msgText): RasterIO.add_message(msgText); return
 
 #--DLU Functions---
 #   Assess graph connectivity in terms of a threshold distance (edge
@@ -38,6 +51,7 @@ def edge_threshold(G, max_wt):
    DL Urban (22 Feb 2007)
    Added NetworkX version checking - 26 May 2009; JP Fay
    """
+   import networkx as nx
    tG = nx.Graph()
    G_edges = G.edges(data=True)
      
@@ -70,6 +84,7 @@ def edge_threshold_sequence(G, min_wt, max_wt, winc):
    DL Urban (22 Feb 2007)
    Added NetworkX version checking - 26 May 2009; JP Fay
    """
+   import networkx as nx
    Gts = {}
    nbunch = G.nodes()
    edges = G.edges(data=True)
@@ -105,6 +120,7 @@ def graph_comp_sequence(Gts):
 
    DL Urban (22 Feb 2007)
    """
+   import networkx as nx
    seq = Gts.keys()
    gcs = {}
    start_diam = -1
@@ -128,6 +144,107 @@ def graph_comp_sequence(Gts):
    return gcs
 
 
+#   The same, but from an incremental sweep: edges are added to a
+#   union-find structure in order of cost, so nothing is rebuilt and
+#   no graph is kept for thresholds already evaluated.
+def graph_comp_sweep(sweep, thresholds):
+   """
+   sweep is a PatchGraph.ThresholdSweep over the full edge list and
+   thresholds an increasing sequence of threshold distances. At each
+   threshold the edges up to that distance are added to the sweep and
+   the number of components and the diameter of the largest component
+   are computed. Returns the same dictionary of tuples (NC, D(G)) keyed
+   by threshold distance as graph_comp_sequence().
+
+   The diameter comes from PatchGraph.weighted_diameter (compiled
+   shortest paths with eccentricity bounds), which gives the same value
+   as x_diameter() with only a few shortest path searches. If the sweep
+   keeps component distance matrices (max_matrix_nodes), the diameter is
+   instead read off the matrix, which the sweep updates as edges are
+   added. The time taken by each step is reported.
+
+   Usage:
+   >>> sweep = ThresholdSweep(u, v, w)
+   >>> gcs = graph_comp_sweep(sweep, range(min, max+inc, inc))
+   """
+   gcs = {}
+   start_diam = -1
+   for d in thresholds:
+       t0 = time.perf_counter()
+       sweep.advance(d)
+       nc = sweep.n_components
+       diam = sweep.largest_diameter()
+       secs = time.perf_counter() - t0
+       gcs[d] = (nc, diam)
+       if start_diam * 0.9 > diam:
+           msg("{0}:\tnc={1}\tdiam={2:2.4f}\t({3:.3f} s)***".format(d,nc,diam,secs))
+       else:
+           msg("{0}:\tnc={1}\tdiam={2:2.4f}\t({3:.3f} s)".format(d,nc,diam,secs))
+       start_diam = diam
+       if nc == 1: break
+   return gcs
+
+
+#   Adaptive version: a coarse sweep first, then only the intervals on
+#   either side of the diameter peak are halved, until they are no wider
+#   than a tolerance. A few dozen diameters locate the inflection.
+def graph_comp_search(sweep, min_wt, max_wt, winc, tol):
+   """
+   sweep is a PatchGraph.ThresholdSweep over the full edge list. The
+   thresholds from min_wt to max_wt in steps of winc are evaluated first
+   (as in graph_comp_sweep). Then, at each round, the intervals between
+   the threshold where the diameter peaks and its two neighbours are
+   halved (the sweep is reset and the midpoints evaluated in increasing
+   order), until both are no wider than tol. Like graph_comp_sweep, the
+   search stops at the first threshold where the graph is connected.
+
+   Returns the dictionary of tuples (NC, D(G)) of all thresholds
+   evaluated, in increasing order, and the inflection distance (see
+   inflection_distance), found to within tol.
+
+   Usage:
+   >>> sweep = ThresholdSweep(u, v, w)
+   >>> gcs, optimal = graph_comp_search(sweep, 500, 5000, 500, 10)
+   """
+   gcs = graph_comp_sweep(sweep, range(min_wt, max_wt+winc, winc))
+   tol = max(int(tol), 1)
+   while True:
+      ds = sorted(gcs)
+      peak = _peak(gcs, ds)
+      brackets = [(ds[i], ds[i+1]) for i in (peak-1, peak) if 0 <= i < len(ds)-1]
+      midpoints = [(a + b) // 2 for a, b in brackets if b - a > tol]
+      if not midpoints:
+         break
+      sweep.reset()
+      for d in midpoints:
+         t0 = time.perf_counter()
+         sweep.advance(d)
+         gcs[d] = (sweep.n_components, sweep.largest_diameter())
+         msg("{0}:\tnc={1}\tdiam={2:2.4f}\t({3:.3f} s)".format(d, *gcs[d], time.perf_counter() - t0))
+         #As in graph_comp_sweep, nothing beyond the first connected graph counts
+         if gcs[d][0] == 1:
+            gcs = {k: gcs[k] for k in gcs if k <= d}
+            break
+   gcs = {d: gcs[d] for d in sorted(gcs)}
+   return gcs, inflection_distance(gcs)
+
+
+def _peak(gcs, ds):
+   """Position in ds of the last threshold with the largest diameter."""
+   return max(range(len(ds)), key=lambda i: (gcs[ds[i]][1], i))
+
+
+def inflection_distance(gcs):
+   """
+   The first threshold evaluated after the diameter peaks, where it has
+   started to decline (the distance of maximum connectivity). None if
+   the largest diameter is at the last threshold evaluated.
+   """
+   ds = sorted(gcs)
+   peak = _peak(gcs, ds)
+   return ds[peak+1] if peak + 1 < len(ds) else None
+
+
 #   Write these out to a file:
 
 def write_graph_comp_sequence(gcs, path):
@@ -230,32 +347,34 @@ def sensi_diameter(G):
     
     DL Urban (9 Feb 2007)
     """
+    import networkx as nx
     
     # Starting diameter for full graph:
     
     if nx.is_connected(G):
         d0 = x_diameter(G)
+        nc = 1
     else:
-        G0 = nx.connected_component_subgraphs(G) [0] # the largest subgraph
+        G0 = _largest_subgraph(G)                     # the largest subgraph
         d0 = x_diameter(G0)
         nc = nx.number_connected_components(G)	     # how many are there?
     
     sensi = {}
     
-    for node in G.nodes():
-        ex = G.edges(node) 		# a set of edges adjacent to node; 
-        G.delete_edges_from(ex)		# remove all of these,
-        G.delete_node(node)		# and then kill the node, too
+    for node in list(G.nodes()):
+        ex = list(G.edges(node, data=True))	# a set of edges adjacent to node;
+        G.remove_edges_from(ex)		# remove all of these,
+        G.remove_node(node)		# and then kill the node, too
         if nx.is_connected(G):
             dx = x_diameter(G)
             cuts = 0
         else:
-            Gx = nx.connected_component_subgraphs(G) [0]	# the biggest
+            Gx = _largest_subgraph(G)	# the biggest
             ncx = nx.number_connected_components(G)
-            if nc == ncx:
-                cuts = 0
-            else:
+            if ncx > nc:
                 cuts = 1
+            else:
+                cuts = 0
             dx = x_diameter(Gx)
         delta = d0 - dx
         G.add_node(node)		# put the node and edges back again
@@ -266,6 +385,15 @@ def sensi_diameter(G):
     return sensi
 
 
+def _largest_subgraph(G):
+    """The largest connected component of G, as a graph. Of equal sized
+    components, the one holding the lowest node ID (as in PatchGraph), rather
+    than whichever comes first in the node order, which sensi_diameter changes
+    as it removes and restores nodes."""
+    import networkx as nx
+    return G.subgraph(max(nx.connected_components(G), key=lambda c: (len(c), -min(c)))).copy()
+
+
 #   Write this output to a CSV file:
 def write_sensi_diameter(sensi, path):
     f = open(path, 'w')
@@ -344,46 +472,96 @@ def _dijkstra_multisource(G, sources, weight, pred=None, paths=None,cutoff=None,
     return dist
 
     #return _dijkstra(G, source, get_weight, cutoff=cutoff)
-#--INPUT VARIABLES--
-edgeFile = sys.argv[1]
-minThresh = int(sys.argv[2])
-maxThresh = int(sys.argv[3])
-threshInt = int(sys.argv[4])
-outFile = sys.argv[5]
-
-# Build graph from edgelist
-msg("Building graph from %s" %edgeFile)
-G = nx.Graph()
-edgeList = open(edgeFile, 'r')
-lineText = edgeList.readline()
-# Check whether the first line is a header line
-if (lineText.split(",")[0]).isalpha:
-    lineText = edgeList.readline()
-while lineText:
-    lineData = lineText.split(",")
-    u = int(float(lineData[0]))
-    v = int(float(lineData[1]))
-    w = float(lineData[2][:-1])
-    if w <= maxThresh:
-        G.add_edge(u,v,weight = w)
-    lineText = edgeList.readline()
-edgeList.close()
-
-msg("Creating thresholded graphs")
-gts = edge_threshold_sequence(G,minThresh,maxThresh,threshInt)
-msg("Calculating graph properties")
-gcs = graph_comp_sequence(gts)
-msg("Writing data to %s" %outFile)
-write_graph_comp_sequence(gcs,outFile)
-
-#Report distance at max connectivity (when diameter trends down)
-prev_diam = -1
-for k,v in gcs.items():
-      (nc, diam) = v
-
-      #Check whether diameter starts declining
-      if prev_diam > diam:
-          optimal_dist = k
-          msg(f'Optimal diameter is {optimal_dist}')
-      #Update start_diam
-      prev_diam = diam
+
+def get_args(argv=None):
+   parser = argparse.ArgumentParser(description="Summarize graph connectivity over cost thresholds")
+   parser.add_argument('edgeFile', help="Edge list (csv or .edges.npy)")
+   parser.add_argument('minThresh', type=int, help="Smallest cost threshold")
+   parser.add_argument('maxThresh', type=int, help="Largest cost threshold")
+   parser.add_argument('threshInt', type=int, help="Cost threshold interval")
+   parser.add_argument('outFile', help="Output graph summary table (csv)")
+   parser.add_argument('tolerance', nargs='?', default=None,
+                       help="Search the thresholds adaptively, to within this cost [optional]")
+   parser.add_argument('--sensitivity', default='',
+                       help="Output node removal sensitivity table (csv) [optional]")
+   parser.add_argument('--sensitivity-threshold', type=int, default=None,
+                       help="Cost threshold of the graph whose nodes are removed "
+                            "(default: the inflection distance, else the largest threshold)")
+   parser.add_argument('--workers', type=int, default=1,
+                       help="Number of worker processes for the node removals (default: 1)")
+   args = parser.parse_args(argv)
+   args.tolerance = int(args.tolerance) if args.tolerance not in (None, '', '#') else None
+   return args
+
+
+def node_sensitivity(edgeFile, threshold, outFile, workers=1):
+   """
+   Remove each node of the graph of edges up to threshold in turn (see
+   PatchGraph.diameter_sensitivity) and write whether it is a cut node
+   and the change in diameter to outFile, as write_sensi_diameter does.
+   """
+   from PatchGraph import diameter_sensitivity
+
+   msg(f"Computing node removal sensitivity at a threshold of {threshold}")
+   us, vs, ws = load_edges(edgeFile, max_cost=threshold)
+   t0 = time.perf_counter()
+   nodes, cuts, delta, solved = diameter_sensitivity(us, vs, ws, workers)
+   msg(f"{solved.sum()} of {len(nodes)} node removals computed, {len(nodes) - solved.sum()} "
+       f"skipped as they cannot change the diameter ({time.perf_counter() - t0:.3f} s)")
+   msg("Writing node sensitivity to %s" %outFile)
+   write_sensi_diameter({int(n): (c, d) for n, c, d in zip(nodes, cuts, delta)}, outFile)
+
+
+def main(argv=None):
+   """
+   Run the summary with the command line arguments (argv, by default
+   sys.argv[1:]). Returns the graph component sequence and the distance
+   at maximum connectivity (None if the diameter never declines).
+
+   If a tolerance is given (a sixth argument), the thresholds are
+   searched adaptively (see graph_comp_search): the interval is used
+   for a coarse sweep, refined around the diameter peak to within the
+   tolerance.
+   """
+   from PatchGraph import ThresholdSweep
+
+   #--INPUT VARIABLES--
+   args = get_args(argv)
+   edgeFile = args.edgeFile
+   minThresh = args.minThresh
+   maxThresh = args.maxThresh
+   threshInt = args.threshInt
+   outFile = args.outFile
+   tolerance = args.tolerance
+
+   # Read the edges from the edgelist
+   msg("Reading edges from %s" %edgeFile)
+   us, vs, ws = load_edges(edgeFile, max_cost=maxThresh)
+
+   msg("Sorting edges by cost")
+   #Adaptive searches revisit thresholds, so diameters are computed at each one
+   sweep = ThresholdSweep(us, vs, ws, max_matrix_nodes=4000 if tolerance is None else None)
+   msg("Calculating graph properties")
+   if tolerance is None:
+      gcs = graph_comp_sweep(sweep, range(minThresh, maxThresh+threshInt, threshInt))
+      optimal_dist = inflection_distance(gcs)
+   else:
+      gcs, optimal_dist = graph_comp_search(sweep, minThresh, maxThresh, threshInt, tolerance)
+      msg(f"{len(gcs)} thresholds evaluated")
+   msg("Writing data to %s" %outFile)
+   write_graph_comp_sequence(gcs,outFile)
+
+   #Report distance at max connectivity (when diameter trends down)
+   if optimal_dist is None:
+      msg("Diameter does not decline: try a larger maximum threshold")
+   else:
+      msg(f'Optimal distance (diameter inflection) is {optimal_dist}')
+
+   if args.sensitivity:
+      threshold = args.sensitivity_threshold or optimal_dist or maxThresh
+      node_sensitivity(edgeFile, threshold, args.sensitivity, args.workers)
+   return gcs, optimal_dist
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,34 @@
+import os, sys
+import numpy as np
+import pytest
+
+#The scripts are run from their own folder and import each other directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts'))
+
+import RasterIO
+
+
+def synthetic_rasters(size=40, nPatches=12, seed=0):
+    """Random rectangular patches on a random cost surface with a few impassable cells."""
+    rng = np.random.default_rng(seed)
+    arrPatch = np.full((size, size), RasterIO.NODATA, dtype=np.int32)
+    for patchID in range(1, nPatches + 1):
+        r, c = rng.integers(0, size - 4, 2)
+        h, w = rng.integers(1, 4, 2)
+        arrPatch[r:r+h, c:c+w] = patchID
+    arrCost = rng.uniform(1, 10, (size, size))
+    arrCost[(rng.random((size, size)) < 0.03) & (arrPatch == RasterIO.NODATA)] = RasterIO.NODATA
+    return arrPatch, arrCost
+
+
+@pytest.fixture
+def write_rasters(tmp_path):
+    """Save a patch and a cost array as .npy rasters; returns their paths."""
+    def write(arrPatch, arrCost, cellSize=30.0):
+        grid = RasterIO.Grid(500000.0, 4000000.0, cellSize, *arrPatch.shape)
+        backend = RasterIO.NumpyBackend()
+        paths = str(tmp_path / 'patches.npy'), str(tmp_path / 'costs.npy')
+        for arr, path in zip((arrPatch, arrCost), paths):
+            backend.write(arr, path, grid, nodata=RasterIO.NODATA)
+        return paths
+    return write
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+import CalculatePatchConnectivityAttributes as CPCA
+import CreateEdgeList_v2
+from EdgeList import load_edges
+from conftest import synthetic_rasters
+
+
+def read_rows(path):
+    with open(path) as f:
+        next(f)
+        return [np.array(line.split(', '), dtype=float) for line in f]
+
+
+@pytest.mark.parametrize('backend', ['networkx', 'csr'])
+def test_each_threshold_matches_a_single_run(tmp_path, write_rasters, backend):
+    patchFN, costFN = write_rasters(*synthetic_rasters())
+    edgeListFN = str(tmp_path / 'edges.csv')
+    CreateEdgeList_v2.main([patchFN, costFN, edgeListFN, '--stack-layers', 'none'])
+    w = load_edges(edgeListFN)[2]
+    thresholds = [int(t) for t in np.percentile(w, [5, 15, 40])]
+
+    multiFN = str(tmp_path / 'multi.csv')
+    CPCA.main([patchFN, edgeListFN, *map(str, thresholds), multiFN,
+               '--backend', backend, '--workers', '2'])
+    multi = read_rows(multiFN)
+    for t in thresholds:
+        singleFN = str(tmp_path / f'single_{t}.csv')
+        CPCA.main([patchFN, edgeListFN, str(t), singleFN, '--backend', backend])
+        rows = [np.delete(row, 1) for row in multi if row[1] == t]
+        single = read_rows(singleFN)
+        assert len(rows) == len(single)
+        for row, expected in zip(rows, single):
+            np.testing.assert_allclose(row, expected, rtol=0, atol=2e-4)
+
+
+@pytest.mark.parametrize('missing', [3, 9, 0])
+def test_area_attributes_rejects_unknown_patches(missing):
+    #Patch 3 falls between two patch IDs, 9 beyond and 0 before them all
+    u, v, w = np.array([1, 2]), np.array([2, missing]), np.array([10., 20.])
+    with pytest.raises(KeyError, match=str(missing)):
+        CPCA.area_attributes([1, 2, 4, 5], [1., 2., 3., 4.], u, v, w, [100.])
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from CostDistanceStack import CostDistanceStack, StackWriter
+
+
+@pytest.mark.parametrize('fmt, name', [('npy', 'edges.npy'), ('chunked', 'edges_stack')])
+def test_stack_layers_looked_up_by_patch_id(tmp_path, fmt, name):
+    path = str(tmp_path / name)
+    writer = StackWriter(path, [4, 17, 22], (2, 3), fmt=fmt).create()
+    for patchID in (22, 4, 17):
+        writer.write(patchID, np.full((2, 3), float(patchID)))
+    writer.close()
+
+    stack = CostDistanceStack(path)
+    assert stack.patchIDs == [4, 17, 22]
+    for patchID in (4, 17, 22):
+        assert (stack.layer(patchID) == patchID).all()
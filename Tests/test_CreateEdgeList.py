@@ -0,0 +1,78 @@
+import sqlite3
+import numpy as np
+import pytest
+
+import CreateEdgeList_v2
+import RasterIO
+from EdgeList import binary_path, load_edges
+from conftest import synthetic_rasters
+
+
+def run(tmp_path, patchFN, costFN, *options, name='edges.csv'):
+    edgeListFN = str(tmp_path / name)
+    CreateEdgeList_v2.main([patchFN, costFN, edgeListFN, *options])
+    if '--binary-edges' in options:
+        return load_edges(binary_path(edgeListFN))
+    return load_edges(edgeListFN)
+
+
+def one_patch():
+    arrPatch = np.full((10, 10), RasterIO.NODATA, dtype=np.int32)
+    arrPatch[2:4, 2:4] = 1
+    return arrPatch, np.ones((10, 10)), []
+
+def beyond_max_cost():
+    arrPatch = np.full((10, 10), RasterIO.NODATA, dtype=np.int32)
+    arrPatch[1, 1] = 1
+    arrPatch[8, 8] = 2
+    return arrPatch, np.ones((10, 10)), ['--max-cost', '10']
+
+def nodata_row():
+    arrPatch = np.full((10, 10), RasterIO.NODATA, dtype=np.int32)
+    arrPatch[1, 1] = 1
+    arrPatch[8, 8] = 2
+    arrCost = np.ones((10, 10))
+    arrCost[5] = RasterIO.NODATA
+    return arrPatch, arrCost, []
+
+
+@pytest.mark.parametrize('case', [one_patch, beyond_max_cost, nodata_row])
+def test_mpg_without_touching_regions(tmp_path, write_rasters, case):
+    arrPatch, arrCost, options = case()
+    patchFN, costFN = write_rasters(arrPatch, arrCost)
+    corridorFN = str(tmp_path / 'corridors.npy')
+    u, v, w = run(tmp_path, patchFN, costFN, str(tmp_path / 'paths.gpkg'), '--mpg',
+                  '--corridors', corridorFN, *options)
+    assert u.size == v.size == w.size == 0
+    with sqlite3.connect(str(tmp_path / 'paths.gpkg')) as db:
+        table = db.execute("SELECT table_name FROM gpkg_contents").fetchone()[0]
+        assert db.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] == 0
+    assert not np.load(corridorFN).any()
+
+
+@pytest.mark.parametrize('options', [[], ['--max-cost', '1500', '--workers', '2']])
+def test_tiled_edges_match_in_memory(tmp_path, write_rasters, options):
+    patchFN, costFN = write_rasters(*synthetic_rasters(size=60, nPatches=15, seed=1))
+    expected = run(tmp_path, patchFN, costFN, '--binary-edges', *options, name='memory.csv')
+    #The smallest tiles (16 cells a side) split the raster into 4 x 4 tiles
+    tiled = run(tmp_path, patchFN, costFN, '--binary-edges', '--tiled', '--tile-memory', '0.001',
+                '--scratch', str(tmp_path), *options, name='tiled.csv')
+    assert expected[0].size
+    for a, b in zip(tiled, expected):
+        np.testing.assert_allclose(a, b, rtol=1e-12)
+    assert (np.load(str(tmp_path / 'tiled.npy')) == np.load(str(tmp_path / 'memory.npy'))).all()
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('options', [['--workers', '2'], ['--stop-when-settled'],
+                                     ['--adaptive-window', '2'], ['--cover'],
+                                     ['--max-cost', '2500', '--prune']])
+def test_options_keep_default_edges(tmp_path, write_rasters, seed, options):
+    patchFN, costFN = write_rasters(*synthetic_rasters(seed=seed))
+    #Pruning is compared with a run cut off at the same cost
+    cutoff = options[:2] if '--max-cost' in options else []
+    expected = run(tmp_path, patchFN, costFN, '--binary-edges', *cutoff, name='default.csv')
+    u, v, w = run(tmp_path, patchFN, costFN, '--binary-edges', *options, name='options.csv')
+    assert expected[0].size
+    assert (u == expected[0]).all() and (v == expected[1]).all()
+    np.testing.assert_allclose(w, expected[2], rtol=1e-12)
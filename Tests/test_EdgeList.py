@@ -0,0 +1,35 @@
+import os
+import numpy as np
+
+from EdgeList import EdgeCheckpoint, EdgeTable, load_edges
+
+
+def test_load_edges_header_only_csv(tmp_path):
+    path = str(tmp_path / 'edges.csv')
+    EdgeTable().to_csv(path)
+    for max_cost in (None, 100):
+        u, v, w = load_edges(path, max_cost=max_cost)
+        assert u.size == v.size == w.size == 0
+        assert u.dtype == v.dtype == np.int64
+
+
+def test_checkpoint_resume_reads_paths_per_source(tmp_path):
+    path = str(tmp_path / 'edges.csv.ckpt')
+    ckpt = EdgeCheckpoint(path, {'run': 1})
+    ckpt.open()
+    ckpt.write(1, [(1, 2, 5.0, np.array([[0, 0], [0, 1]])), (1, 3, 7.5, np.array([[0, 0]]))])
+    ckpt.write(2, [(2, 3, 4.0, np.array([[1, 1], [2, 2], [3, 3]]))])
+    ckpt.close()
+    #Cut the last record short, as a crash would
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 8)
+
+    ckpt = EdgeCheckpoint(path, {'run': 1})
+    done = ckpt.open(resume=True)
+    assert list(done) == [1]
+    assert [edge[:3] for edge in done[1]] == [(1, 2, 5.0), (1, 3, 7.5)]
+    assert all(edge[3] is None for edge in done[1])
+    edges = ckpt.paths(1)
+    assert edges[0][3].tolist() == [[0, 0], [0, 1]]
+    assert edges[1][3].tolist() == [[0, 0]]
+    ckpt.close()
@@ -0,0 +1,144 @@
+import networkx as nx
+import numpy as np
+import pytest
+from scipy.sparse import csgraph
+
+import PatchGraph
+
+from EdgeList import EdgeTable, CSV_TOLERANCE, load_edges
+from PatchGraph import ThresholdSweep, centrality, compare_edges, csr_graph, weighted_diameter
+
+
+def random_graph(seed, nodes=60, edges=120):
+    """Edges (u, v, w) of a random graph with integer (often tied) weights and
+    several components; node IDs are not consecutive."""
+    rng = np.random.default_rng(seed)
+    ids = np.sort(rng.choice(1000, nodes, replace=False))
+    #A large component spanned by a path, plus random edges among a few small groups
+    big = rng.permutation(ids[:40])
+    u = [big[:-1]]
+    v = [big[1:]]
+    for group in (ids[:40], ids[40:48], ids[48:55]):
+        pairs = rng.choice(group, (edges // 3, 2))
+        u.append(pairs[:, 0])
+        v.append(pairs[:, 1])
+    u, v = np.concatenate(u), np.concatenate(v)
+    keep = u != v
+    u, v = u[keep], v[keep]
+    return u, v, rng.integers(1, 4, u.size).astype(float)
+
+
+def networkx_centrality(u, v, w):
+    """Degree, closeness and betweenness of each node, one component at a time,
+    with repeated pairs linked at their lowest weight"""
+    order = np.argsort(-w, kind='stable')
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip(u[order].tolist(), v[order].tolist(), w[order].tolist()))
+    dG, cG, bG = {}, {}, {}
+    for subG in (G.subgraph(c).copy() for c in nx.connected_components(G)):
+        dG.update(nx.degree_centrality(subG))
+        cG.update(nx.closeness_centrality(subG, distance='weight'))
+        bG.update(nx.betweenness_centrality(subG, normalized=True, weight='weight'))
+    return dG, cG, bG
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+@pytest.mark.parametrize('workers', [1, 3])
+def test_centrality_matches_networkx(seed, workers):
+    u, v, w = random_graph(seed)
+    nodes, degree, closeness, between, _ = centrality(u, v, w, workers)
+    for values, expected in zip((degree, closeness, between), networkx_centrality(u, v, w)):
+        assert sorted(expected) == nodes.tolist()
+        np.testing.assert_allclose(values, [expected[n] for n in nodes.tolist()],
+                                   rtol=1e-9, atol=1e-12)
+
+
+def test_centrality_links_repeated_pairs_at_lowest_weight():
+    #2-3 is listed twice, the second time the other way round
+    u, v, w = np.array([1, 2, 3, 3]), np.array([2, 3, 4, 2]), np.array([1., 5., 1., 1.])
+    nodes, degree, closeness, between, _ = centrality(u, v, w)
+    dG, cG, bG = networkx_centrality(u, v, w)
+    np.testing.assert_allclose(degree, [dG[n] for n in nodes.tolist()])
+    np.testing.assert_allclose(closeness, [cG[n] for n in nodes.tolist()])
+    np.testing.assert_allclose(between, [bG[n] for n in nodes.tolist()])
+
+
+def test_compare_edges_csv_reference(tmp_path):
+    #Pairwise costs at full precision, and the same costs read back from a CSV
+    u, v = np.array([1, 1, 2]), np.array([2, 3, 3])
+    w = np.array([10.123456, 20.654321, 9.876549])
+    table = EdgeTable()
+    table.add_edges([(a, b, c, None) for a, b, c in zip(u, v, w)])
+    table.to_csv(str(tmp_path / 'base.csv'))
+    refU, refV, refW = load_edges(str(tmp_path / 'base.csv'))
+    stats = compare_edges(u, v, w, refU, refV, refW, atol=CSV_TOLERANCE)
+    assert stats['cost_equal'] == 3
+    assert stats['below_ref'] == 0
+    assert stats['preserved'] == 3
+
+
+def test_largest_diameter_below_every_edge():
+    #No edge at or below the threshold, with and without distance matrices
+    for max_matrix_nodes in (None, 100):
+        sweep = ThresholdSweep(np.array([1, 2]), np.array([2, 3]), np.array([10., 20.]),
+                               max_matrix_nodes=max_matrix_nodes)
+        sweep.advance(5)
+        assert sweep.largest_diameter() == 0
+        sweep.advance(20)
+        assert sweep.largest_diameter() == 30
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_weighted_diameter_matches_all_pairs(seed):
+    u, v, w = random_graph(seed)
+    nodes = np.unique(np.concatenate([u, v]))
+    A = csr_graph(np.searchsorted(nodes, u), np.searchsorted(nodes, v), w, len(nodes))
+    _, labels = csgraph.connected_components(A, directed=False)
+    members = np.flatnonzero(labels == labels[0])
+    A = A[members][:, members].tocsr()
+    assert weighted_diameter(A) == csgraph.shortest_path(A, directed=False).max()
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('max_matrix_nodes, rebuild', [(None, False), (4000, False),
+                                                       (4000, True), (10, False)])
+def test_sweep_matches_full_recompute(monkeypatch, seed, max_matrix_nodes, rebuild):
+    #With max_matrix_nodes=10, larger components fall back to weighted_diameter;
+    #with rebuild, distance matrices go stale at the first shortening edge
+    if rebuild:
+        monkeypatch.setattr(PatchGraph.IncrementalDistances, 'budget', lambda self, comp: 0)
+    u, v, w = random_graph(seed)
+    w = w + np.random.default_rng(seed).integers(0, 4, w.size)
+    nodes = np.unique(np.concatenate([u, v]))
+    i, j = np.searchsorted(nodes, u), np.searchsorted(nodes, v)
+    sweep = ThresholdSweep(u, v, w, max_matrix_nodes=max_matrix_nodes)
+    for t in np.unique(w):
+        sweep.advance(t)
+        keep = w <= t
+        A = csr_graph(i[keep], j[keep], w[keep], len(nodes))
+        nComps, labels = csgraph.connected_components(A, directed=False)
+        assert sweep.n_components == nComps
+        members = np.searchsorted(nodes, sweep.largest_nodes())
+        assert len(members) == np.bincount(labels).max()
+        assert (labels[members] == labels[members[0]]).all()
+        D = csgraph.shortest_path(A[members][:, members].tocsr(), directed=False)
+        assert sweep.largest_diameter() == pytest.approx(D.max(), rel=1e-12)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_diameter_sensitivity_matches_brute_force(workers):
+    from SummarizeGraph import sensi_diameter
+    rng = np.random.default_rng(3)
+    #Two cycles joined through cut nodes 4 and 5, leaves and a path hanging
+    #off them, and a smaller separate component
+    u = np.array([1, 2, 3, 4, 5, 6, 7, 8, 5, 9, 10, 10, 4, 2, 20, 21, 22])
+    v = np.array([2, 3, 4, 1, 6, 7, 8, 5, 4, 4, 11, 9, 12, 13, 21, 22, 20])
+    w = rng.integers(1, 5, u.size).astype(float)
+    nodes, cuts, delta, solved = PatchGraph.diameter_sensitivity(u, v, w, workers)
+    assert not solved.all()
+    G = nx.Graph()
+    G.add_weighted_edges_from(zip(u.tolist(), v.tolist(), w.tolist()))
+    expected = sensi_diameter(G)
+    assert sorted(expected) == nodes.tolist()
+    assert cuts.tolist() == [expected[n][0] for n in nodes.tolist()]
+    np.testing.assert_allclose(delta, [expected[n][1] for n in nodes.tolist()], atol=1e-9)
@@ -0,0 +1,17 @@
+import os, subprocess, sys
+
+import pytest
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Scripts')
+MODULES = sorted(os.path.splitext(name)[0] for name in os.listdir(SCRIPTS) if name.endswith('.py'))
+HEAVY = ('arcpy', 'arcgis', 'pandas', 'networkx', 'scipy', 'skimage')
+
+
+@pytest.mark.parametrize('module', MODULES)
+def test_import_loads_no_heavy_library(module):
+    #A fresh interpreter, as the toolbox and every worker process start with
+    code = (f"import sys; import {module}\n"
+            f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, '-c', code], cwd=SCRIPTS,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.split() == []
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from PatchGraph import ThresholdSweep
+from SummarizeGraph import graph_comp_search, graph_comp_sweep, inflection_distance
+
+
+def clustered_chain(seed, n=40, far=10):
+    """Edges between all pairs of patches strung along a line, with costs
+    growing less than linearly with distance (so longer links become
+    shortcuts and the diameter declines), the last far patches far away."""
+    rng = np.random.default_rng(seed)
+    x = np.cumsum(rng.uniform(10, 100, n))
+    x[n-far:] += 1e5
+    i, j = np.triu_indices(n, 1)
+    return i, j, np.round(30 * (x[j] - x[i]) ** 0.7)
+
+
+def peak(gcs):
+    """Last threshold with the largest diameter, and its (NC, D(G))"""
+    top = max(diam for _, diam in gcs.values())
+    d = max(k for k in gcs if gcs[k][1] == top)
+    return d, gcs[d]
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_search_finds_the_dense_sweep_inflection(seed):
+    u, v, w = clustered_chain(seed)
+    dense = graph_comp_sweep(ThresholdSweep(u, v, w, max_matrix_nodes=4000), range(0, 5001))
+    gcs, optimal = graph_comp_search(ThresholdSweep(u, v, w), 0, 5000, 500, 1)
+    assert inflection_distance(dense) is not None
+    assert optimal == inflection_distance(dense)
+    assert peak(gcs) == peak(dense)
+    assert len(gcs) < 50
+
+
+def test_search_stops_at_the_first_connected_graph():
+    #Without far patches the graph is connected before its diameter declines
+    u, v, w = clustered_chain(0, far=0)
+    dense = graph_comp_sweep(ThresholdSweep(u, v, w, max_matrix_nodes=4000), range(0, 5001))
+    gcs, optimal = graph_comp_search(ThresholdSweep(u, v, w), 0, 5000, 500, 1)
+    assert optimal is inflection_distance(dense) is None
+    assert max(gcs) == max(dense)
+    assert peak(gcs) == peak(dense)